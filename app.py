@@ -1,134 +1,332 @@
+import time
+SCRIPT_STARTED = time.perf_counter()
 import streamlit as st
-import pandas as pd
 import os
-import matplotlib.pyplot as plt
 from datetime import datetime
-import io
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
+import functools
+import threading
+from contextlib import contextmanager
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import metrics
+from metrics import METRICS_PORT, stage
+from folder_index import FolderIndex
+from charts import EXPORT_DPI, LOSS_TREND_TITLES, TARGET_WIDTH, draw_tba_threshold, draw_loss_trend, draw_feeder, get_figure_cache
+from session_results import files_version, forget, init_slots, memoize
+from config import ALL_FOLDER_IDS, FOLDER_NAMES, FOLDER_ID, FOLDER_ID_HA, FOLDER_ID_TRUNG, FOLDER_ID_DY, FOLDER_ID_TOAN_DON_VI
+# pandas, matplotlib, plotly, googleapiclient chỉ được nạp trong phần phân tích cần đến chúng
+IMPORT_SECONDS = time.perf_counter() - SCRIPT_STARTED
 
 st.set_page_config(layout="wide", page_title="Báo cáo tổn thất TBA")
 st.title("📥 AI_Trợ lý tổn thất")
 
-# --- Khởi tạo Session State cho dữ liệu (Giữ nguyên cho các phần khác) ---
-if 'df_tba_thang' not in st.session_state:
-    st.session_state.df_tba_thang = None
-if 'df_tba_luyke' not in st.session_state:
-    st.session_state.df_tba_luyke = None # Corrected: Changed session_session to session_state
-if 'df_tba_ck' not in st.session_state:
-    st.session_state.df_tba_ck = None
-if 'df_ha_thang' not in st.session_state:
-    st.session_state.df_ha_thang = None
-if 'df_ha_luyke' not in st.session_state:
-    st.session_state.df_ha_luyke = None
-if 'df_ha_ck' not in st.session_state:
-    st.session_state.df_ha_ck = None
-if 'df_trung_thang_tt' not in st.session_state:
-    st.session_state.df_trung_thang_tt = None
-if 'df_trung_luyke_tt' not in st.session_state:
-    st.session_state.df_trung_ck_tt = None
-if 'df_trung_thang_dy' not in st.session_state:
-    st.session_state.df_trung_thang_dy = None
-if 'df_trung_luyke_dy' not in st.session_state:
-    st.session_state.df_trung_luyke_dy = None
-if 'df_trung_ck_dy' not in st.session_state:
-    st.session_state.df_trung_ck_dy = None
-if 'df_dv_thang' not in st.session_state:
-    st.session_state.df_dv_thang = None
-if 'df_dv_luyke' not in st.session_state:
-    st.session_state.df_dv_luyke = None
-if 'df_dv_ck' not in st.session_state:
-    st.session_state.df_dv_ck = None
+# --- Bộ nhớ kết quả theo phiên: mỗi ô df_* giữ các kết quả đã tổng hợp gần nhất (xem session_results.py) ---
+init_slots(st.session_state)
 
 
 # --- Biến và Hàm hỗ trợ tải dữ liệu từ Google Drive (từ app moi.py) ---
-FOLDER_ID = '165Txi8IyqG50uFSFHzWidSZSG9qpsbaq' # ID thư mục Google Drive chứa file Excel
-
-@st.cache_data
-def get_drive_service():
-    """Khởi tạo và trả về đối tượng dịch vụ Google Drive."""
+@st.cache_resource(show_spinner=False)
+def get_drive_pool():
+    """Nhóm client Google Drive dùng chung cho mọi phiên và mọi luồng tải trong tiến trình."""
+    from drive_client import DriveClientPool
+    return DriveClientPool(st.secrets["google"])
+
+def drive_pool():
+    """Nhóm client Drive của tiến trình; gọi trong luồng script (get_drive_pool là cache_resource)."""
     try:
-        credentials = service_account.Credentials.from_service_account_info(
-            st.secrets["google"],
-            scopes=["https://www.googleapis.com/auth/drive.readonly"] # Chỉ cần quyền đọc
-        )
-        return build('drive', 'v3', credentials=credentials)
+        return get_drive_pool()
     except Exception as e:
-        st.error(f"Lỗi khi xác thực Google Drive: {e}. Vui lòng kiểm tra cấu hình `secrets.toml`.")
-        return None
+        # Không cache lỗi: lần gọi sau thử xác thực lại
+        raise RuntimeError(f"Lỗi khi xác thực Google Drive: {e}. Vui lòng kiểm tra cấu hình `secrets.toml`.") from e
+
+@contextmanager
+def drive_client():
+    """Mượn một Drive service từ nhóm client (mỗi luồng một client riêng trong lúc dùng)."""
+    with drive_pool().client() as service:
+        yield service
+
+@st.cache_resource
+def get_folder_index():
+    """Chỉ mục file của cả năm thư mục Drive, dùng chung cho mọi phiên trong tiến trình.
+
+    Nhận thẳng pool.client để luồng làm nóng cache cập nhật chỉ mục mà không tra cache_resource.
+    """
+    return FolderIndex(drive_pool().client, ALL_FOLDER_IDS)
+
+def list_folder_files(folder_id):
+    """Liệt kê các file Excel (tên -> {'id', 'name', 'modifiedTime', 'size'}) trong thư mục Drive.
+
+    Chỉ mục chỉ đọc các thay đổi kể từ lần đồng bộ trước nên file mới tải lên sẽ xuất hiện mà không cần khởi động lại.
+    """
+    with stage("listing", folder=FOLDER_NAMES.get(folder_id)) as m:
+        files = get_folder_index().files(folder_id)
+        m["rows"] = len(files)
+    return files
 
-@st.cache_data
 def list_excel_files():
     """Liệt kê các file Excel trong thư mục Google Drive đã cho."""
-    service = get_drive_service()
-    if not service:
-        return {}
-    query = f"'{FOLDER_ID}' in parents and mimeType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'"
     try:
-        results = service.files().list(q=query, fields="files(id, name)").execute()
-        return {f['name']: f['id'] for f in results.get('files', [])}
+        return list_folder_files(FOLDER_ID)
     except Exception as e:
         st.error(f"Lỗi khi liệt kê file từ Google Drive: {e}. Vui lòng kiểm tra ID thư mục và quyền truy cập.")
         return {}
 
-@st.cache_data
-def download_excel(file_id):
-    """Tải xuống file Excel từ Google Drive bằng ID file."""
-    service = get_drive_service()
-    if not service:
-        return pd.DataFrame()
-    try:
-        request = service.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-            # st.progress(status.progress()) # Có thể thêm thanh tiến trình
-        fh.seek(0)
-        return pd.read_excel(fh, sheet_name=0)
-    except Exception as e:
+@st.cache_data(show_spinner=False)
+def fetch_excel(file_id, modified_time=None, usecols=None, nrows=None, numeric_cols=None, compact=False):
+    """Đọc file Excel từ cache trên đĩa hoặc tải từ Google Drive; ném lỗi để tầng tải song song thử lại.
+
+    usecols / nrows / numeric_cols / compact: chỉ đọc phần cần dùng, thu gọn kiểu dữ liệu (xem drive_fetch.load_sheet).
+    """
+    from drive_fetch import load_sheet
+    return load_sheet(drive_client, file_id, modified_time, usecols=usecols, nrows=nrows, numeric_cols=numeric_cols, compact=compact)
+
+def download_excel_batch(files, usecols=None, nrows=None, numeric_cols=None, compact=False):
+    """Tải song song nhiều file Excel, trả về danh sách DataFrame theo đúng thứ tự files.
+
+    Mỗi phần tử là bản ghi file từ list_excel_files; None (file không có trên Drive)
+    hoặc file lỗi sau khi thử lại cho DataFrame rỗng. usecols / nrows / numeric_cols / compact
+    được chuyển cho fetch_excel để chỉ đọc phần cần dùng của sheet.
+    """
+    import pandas as pd
+    from drive_fetch import fetch_many
+    ctx = get_script_run_ctx()
+    read_opts = {
+        "usecols": tuple(usecols) if usecols is not None else None,
+        "nrows": nrows,
+        "numeric_cols": tuple(numeric_cols) if numeric_cols is not None else None,
+        "compact": compact,
+    }
+
+    def fetch_one(key):
+        # Gắn context của phiên Streamlit để st.cache_data hoạt động trong luồng phụ
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return fetch_excel(*key, **read_opts)
+
+    keys = [(f['id'], f.get('modifiedTime')) if f else None for f in files]
+    results, errors = fetch_many(keys, fetch_one)
+    # Kết quả tính từ lần tải có lỗi không được nhớ trong phiên (xem remember)
+    st.session_state["fetch_failures"] = st.session_state.get("fetch_failures", 0) + len(errors)
+    for (file_id, _), e in errors.items():
         st.warning(f"Không thể tải xuống hoặc đọc file với ID {file_id}. Lỗi: {e}. Có thể file không tồn tại hoặc không đúng định dạng sheet 'dữ liệu'.")
-        return pd.DataFrame()
+    return [df if df is not None else pd.DataFrame() for df in results]
 
 def generate_filenames(year, start_month, end_month):
     """Tạo danh sách tên file dự kiến dựa trên năm và tháng."""
     return [f"TBA_{year}_{str(m).zfill(2)}.xlsx" for m in range(start_month, end_month + 1)]
 
 def load_data(file_list, all_files, nhan="Thực hiện"):
-    """Tải và nối các DataFrame từ danh sách file."""
-    dfs = []
-    for fname in file_list:
-        file_id = all_files.get(fname)
-        if file_id:
-            df = download_excel(file_id)
-            if not df.empty:
-                df["Kỳ"] = nhan
-                dfs.append(df)
-        else:
-            st.info(f"Không tìm thấy file: {fname}")
-    return pd.concat(dfs) if dfs else pd.DataFrame()
-
-def classify_nguong(x):
-    """Phân loại tỷ lệ tổn thất vào các ngưỡng."""
+    """Tải các file TBA (đã thu gọn kiểu dữ liệu), trả về danh sách bảng từng tháng có cột "Kỳ".
+
+    Nối một lần bằng concat_compact sau khi đã có đủ các kỳ.
+    """
+    from loss_calc import TBA_READ, with_ky
+    frames = download_excel_batch([all_files.get(fname) for fname in file_list], **TBA_READ)
+    return [with_ky(df, nhan) for df in frames if not df.empty]
+
+@st.cache_resource
+def get_loss_facts():
+    """Bảng tổng hợp tổn thất theo tháng (hạ thế, trung thế, toàn đơn vị), dùng chung trong tiến trình."""
+    from loss_facts import LossFacts
+    return LossFacts()
+
+@st.cache_resource(show_spinner=False)
+def get_warehouse():
+    """Kho Postgres / Supabase dùng chung trong tiến trình (nhóm kết nối), xem warehouse.py."""
+    from warehouse import get_warehouse
+    return get_warehouse()
+
+def warehouse_query(query, kind, files, keep=lambda year, month: True):
+    """Gọi query(kho) khi đã đặt WAREHOUSE_URL và kho khớp với Drive; ngược lại trả về None để đọc workbook như cũ.
+
+    Kho khớp khi đã nạp đúng phiên bản hiện tại của mọi file loại kind trong files ({tên: bản ghi
+    Drive}) có (năm, tháng) thỏa keep, và không có file nào đã bị xóa khỏi Drive (Warehouse.stale_sources).
+    """
+    if not os.environ.get("WAREHOUSE_URL"):
+        return None
     try:
-        # Chuyển đổi sang số nếu cần, xử lý dấu phẩy thành dấu chấm
-        x = float(str(x).replace(",", "."))
-    except (ValueError, TypeError):
-        return "Không rõ" # Xử lý các giá trị không phải số
+        with stage("warehouse") as m:
+            wh = get_warehouse()
+            if wh.stale_sources(kind, files, keep):
+                # Có tháng mới tải lên / sửa sau lần nạp kho gần nhất
+                return None
+            result = query(wh)
+            m["rows"] = len(result)
+        return result
+    except Exception as e:
+        st.warning(f"Không truy vấn được kho dữ liệu, đọc trực tiếp file Excel: {e}")
+        return None
 
-    if x < 2: return "<2%"
-    elif 2 <= x < 3: return ">=2 và <3%"
-    elif 3 <= x < 4: return ">=3 và <4%"
-    elif 4 <= x < 5: return ">=4 và <5%"
-    elif 5 <= x < 7: return ">=5 và <7%"
-    else: return ">=7%"
+def remember(section, mode, key, compute):
+    """Kết quả compute() của (section, mode, key) nhớ trong phiên (session_results.memoize).
+
+    Lần tính có file tải lỗi thì không giữ kết quả, lần chạy sau thử tải lại.
+    """
+    failures = st.session_state.get("fetch_failures", 0)
+    value = memoize(st.session_state, section, mode, key, compute)
+    if st.session_state.get("fetch_failures", 0) != failures:
+        forget(st.session_state, section, mode, key)
+    return value
+
+def load_loss_rows(level, all_files, nam):
+    """Nạp các file mới hoặc đã đổi của năm nam và nam - 1 vào bảng tổng hợp.
+
+    Trả về (các dòng năm nam, các dòng năm nam - 1) của cấp level. Có kho dữ liệu và kho đã
+    nạp đúng các file hiện có của hai năm thì lấy từ kho, ngược lại đọc workbook.
+    """
+    from loss_facts import SCALAR_READ
+    rows = warehouse_query(lambda wh: wh.level_rows(level, [nam, nam - 1]), level, all_files, lambda year, month: year in (nam, nam - 1))
+    if rows is not None:
+        return rows[rows["year"] == nam].reset_index(drop=True), rows[rows["year"] == nam - 1].reset_index(drop=True)
+    facts = get_loss_facts()
+    # Chỉ đọc dòng đầu, ba cột số liệu của mỗi file
+    fetch = lambda files: download_excel_batch(files, **SCALAR_READ)
+    facts.sync(level, all_files, fetch, years={nam, nam - 1})
+    return facts.rows(level, nam), facts.rows(level, nam - 1)
+
+def level_results(level, all_files, nam, thang, loai_bc):
+    """(tỷ lệ năm nam, tỷ lệ cùng kỳ, các tháng đọc lỗi) của cấp level, nhớ trong phiên.
+
+    Tỷ lệ năm nam nhớ theo (năm, tháng, loại báo cáo), cùng kỳ (đủ 12 tháng) nhớ theo năm trước;
+    bảng tổng hợp chỉ được tra khi một trong hai chưa có.
+    """
+    from loss_facts import loss_series
+    version = files_version(all_files, years=(nam, nam - 1))
+    loaded = []
+
+    def rows():
+        # Tra bảng tổng hợp (chỉ nạp file mới hoặc đã thay đổi) thay vì mở lại từng workbook
+        if not loaded:
+            loaded.extend(load_loss_rows(level, all_files, nam))
+        return loaded
+
+    def compute_th():
+        rows_th = rows()[0]
+        loi = rows_th[(rows_th["month"] <= thang) & rows_th[["thuong_pham", "ton_that", "ty_le"]].isna().any(axis=1)]
+        with stage("aggregation"):
+            return loss_series(rows_th, thang, luy_ke=(loai_bc == "Lũy kế")), [int(i) for i in loi["month"]]
+
+    df_th, loi = remember(level, loai_bc, (nam, 1, thang, version), compute_th)
+    # Cùng kỳ luôn lấy đủ 12 tháng
+    df_ck = remember(level, "Cùng kỳ", (nam - 1, 1, 12, version), lambda: loss_series(rows()[1]))
+    return df_th, df_ck, loi
+
+# --- Tùy chọn hiển thị biểu đồ ---
+INTERACTIVE = "Tương tác"
+st.sidebar.radio(
+    "Định dạng biểu đồ",
+    ["SVG (vector)", "PNG", INTERACTIVE],
+    key="chart_fmt",
+    help="SVG nhẹ và nét ở mọi kích thước; PNG được raster theo độ rộng hiển thị; "
+    "Tương tác gửi số liệu một lần, đổi kiểu biểu đồ / cùng kỳ / ngưỡng ngay trên trình duyệt.",
+)
+st.sidebar.select_slider("Độ rộng hiển thị PNG (px)", [800, 1200, 1600, 2400], value=TARGET_WIDTH if TARGET_WIDTH in (800, 1200, 1600, 2400) else 1200, key="chart_width")
+
+def interactive_charts():
+    return st.session_state.get("chart_fmt") == INTERACTIVE
+
+def show_chart(draw, *data, export_name=None, plotly_options=None, **options):
+    """Hiển thị biểu đồ từ cache theo định dạng đã chọn; ảnh độ phân giải cao chỉ tạo khi bấm tải về.
+
+    Ở chế độ tương tác, hình plotly tương ứng (charts_plotly.FIGURES) nhận thêm plotly_options.
+    """
+    cache = get_figure_cache()
+    if interactive_charts():
+        from charts_plotly import FIGURES
+        fig = cache.render(FIGURES[draw.__name__], *data, fmt="plotly", **options, **(plotly_options or {}))
+        st.plotly_chart(fig, width="stretch", config={"displaylogo": False})
+    elif st.session_state.get("chart_fmt") == "PNG":
+        st.image(cache.render(draw, *data, target_width=st.session_state.get("chart_width"), **options), width="stretch")
+    else:
+        st.image(cache.render(draw, *data, fmt="svg", **options).decode("utf-8"), width="stretch")
+    if export_name:
+        st.download_button(
+            f"⬇️ Tải ảnh {EXPORT_DPI} DPI",
+            data=lambda: cache.render(draw, *data, dpi=EXPORT_DPI, **options),
+            file_name=export_name,
+            mime="image/png",
+            key=f"export_{export_name}",
+        )
+
+st.sidebar.toggle("⏱️ Hiển thị thời gian xử lý", key="perf_debug", help="Thời gian liệt kê file, tải, đọc Excel, tổng hợp và vẽ biểu đồ của từng phần.")
+
+def timed_section(name):
+    """Đo thời gian các giai đoạn của một phần phân tích; hiện bảng số liệu khi bật chế độ debug."""
+    def decorator(render):
+        @functools.wraps(render)
+        def wrapper():
+            with metrics.section(name) as run:
+                render()
+            if st.session_state.get("perf_debug"):
+                with st.container(border=True):
+                    st.caption(f"⏱️ {name}: {run.seconds:.2f}s")
+                    st.dataframe(run.table(), width="stretch")
+        return wrapper
+    return decorator
+
+def lazy_section(label, key, render):
+    """Hiển thị một phần phân tích trong expander, chỉ chạy render khi expander đang mở.
+
+    render là một st.fragment nên thay đổi widget bên trong chỉ chạy lại phần đó.
+    """
+    expander = st.expander(label, key=key, on_change="rerun")
+    if expander.open:
+        with expander:
+            render()
 
 
 # --- Các nút điều hướng chính (Expander) ---
 
-with st.expander("🔌 Tổn thất các TBA công cộng"):
+PAGE_SIZES = [25, 50, 100, 200]
+
+@st.fragment
+def tba_detail_table(index):
+    """Bảng chi tiết TBA phân trang: lọc ngưỡng, tìm tên, sắp xếp, chọn cột; chỉ gửi trang đang xem.
+
+    Là fragment lồng trong section_tba nên đổi trang / bộ lọc chỉ chạy lại bảng, dùng chỉ mục đã dựng.
+    """
+    from loss_calc import NGUONG_LABELS
+    columns = list(index.df.columns)
+    col1, col2, col3 = st.columns([2, 3, 2])
+    with col1:
+        nguong_filter = st.selectbox("Chọn ngưỡng để lọc danh sách TBA", ["(All)"] + NGUONG_LABELS, key="tba_detail_filter")
+    with col2:
+        search = st.text_input("Tìm theo tên TBA", key="tba_detail_search")
+    with col3:
+        sort_by = st.selectbox("Sắp xếp theo", ["(Mặc định)"] + columns, key="tba_detail_sort")
+        descending = st.checkbox("Giảm dần", key="tba_detail_desc")
+    shown = st.multiselect("Cột hiển thị", columns, default=columns, key="tba_detail_columns")
+
+    query = (
+        None if nguong_filter == "(All)" else nguong_filter,
+        search,
+        None if sort_by == "(Mặc định)" else sort_by,
+        not descending,
+    )
+    positions = index.positions(*query)
+    page_size = st.session_state.get("tba_detail_page_size", 50)
+    n_pages = max(1, -(-len(positions) // page_size))
+    # Truy vấn mới bắt đầu lại từ trang 1; đổi số dòng mỗi trang có thể làm trang vượt quá số trang
+    # (trang chỉ đặt qua session_state, không truyền value cho number_input)
+    if st.session_state.get("tba_detail_query") != query:
+        st.session_state["tba_detail_query"] = query
+        st.session_state["tba_detail_page"] = 1
+    elif st.session_state.setdefault("tba_detail_page", 1) > n_pages:
+        st.session_state["tba_detail_page"] = n_pages
+
+    st.dataframe(index.page(positions, st.session_state["tba_detail_page"], page_size, shown or None), width="stretch", hide_index=True)
+    col1, col2, col3 = st.columns([1, 1, 3])
+    with col1:
+        page = st.number_input("Trang", min_value=1, max_value=n_pages, step=1, key="tba_detail_page")
+    with col2:
+        st.selectbox("Số dòng mỗi trang", PAGE_SIZES, index=1, key="tba_detail_page_size")
+    with col3:
+        st.caption(f"Trang {page}/{n_pages} · {len(positions):,} / {len(index):,} dòng")
+
+@st.fragment
+@timed_section("tba")
+def section_tba():
+    """Phân tích tổn thất các TBA công cộng."""
+    from detail_table import DetailIndex
+    from loss_calc import concat_compact, tba_cumulative_columns, tba_threshold_summary
     st.header("Phân tích dữ liệu TBA công cộng")
 
     # Toàn bộ nội dung từ app moi.py được chèn vào đây
@@ -160,142 +358,72 @@ with st.expander("🔌 Tổn thất các TBA công cộng"):
         nam = st.selectbox("Chọn năm", list(range(2020, datetime.now().year + 1))[::-1], index=0, key="tba_nam")
         nam_cungkỳ = nam - 1 if "cùng kỳ" in mode.lower() else None
 
-    nguong_display = st.selectbox("Ngưỡng tổn thất", ["(All)", "<2%", ">=2 và <3%", ">=3 và <4%", ">=4 và <5%", ">=5 và <7%", ">=7%"], key="tba_nguong_display")
-
     # Tải dữ liệu từ Google Drive
     all_files = list_excel_files()
-
     files = generate_filenames(nam, thang_from, thang_to if "Lũy kế" in mode or "cùng kỳ" in mode.lower() else thang_from)
-    df = load_data(files, all_files, "Thực hiện")
-
-    if "cùng kỳ" in mode.lower() and nam_cungkỳ:
-        files_ck = generate_filenames(nam_cungkỳ, thang_from, thang_to if "Lũy kế" in mode or "cùng kỳ" in mode.lower() else thang_from)
-        df_ck = load_data(files_ck, all_files, "Cùng kỳ")
-        if not df_ck.empty:
-            # Đảm bảo cột "Kỳ" là string để có thể concat
-            df_ck["Kỳ"] = "Cùng kỳ"
-            df = pd.concat([df, df_ck])
-
-    if not df.empty and "Tỷ lệ tổn thất" in df.columns:
-        # Đảm bảo cột Tỷ lệ tổn thất là số để apply classify_nguong
-        df["Tỷ lệ tổn thất"] = pd.to_numeric(df["Tỷ lệ tổn thất"].astype(str).str.replace(',', '.'), errors='coerce')
-        df["Ngưỡng tổn thất"] = df["Tỷ lệ tổn thất"].apply(classify_nguong)
-
-        # Drop duplicates based on 'Tên TBA' and 'Kỳ' to count unique TBAs per period
-        df_unique = df.drop_duplicates(subset=["Tên TBA", "Kỳ"])
-
-        # Create count_df and pivot_df for plotting
-        count_df = df_unique.groupby(["Ngưỡng tổn thất", "Kỳ"]).size().reset_index(name="Số lượng")
-        pivot_df = count_df.pivot(index="Ngưỡng tổn thất", columns="Kỳ", values="Số lượng").fillna(0).astype(int)
-        # Sắp xếp lại thứ tự các ngưỡng
-        pivot_df = pivot_df.reindex(["<2%", ">=2 và <3%", ">=3 và <4%", ">=4 và <5%", ">=5 và <7%", ">=7%"])
-
-        # --- Vẽ biểu đồ ---
-        # Increased DPI to 600 for sharpness, adjusted figsize for better presentation
-        fig, (ax_bar, ax_pie) = plt.subplots(1, 2, figsize=(10, 4), dpi=600)
-
-        # Biểu đồ cột
-        x = range(len(pivot_df))
-        width = 0.35
-        colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728'] # Màu sắc cho các cột
-        for i, col in enumerate(pivot_df.columns):
-            offset = (i - (len(pivot_df.columns)-1)/2) * width
-            bars = ax_bar.bar([xi + offset for xi in x], pivot_df[col], width, label=col, color=colors[i % len(colors)])
-            for bar in bars:
-                height = bar.get_height()
-                if height > 0:
-                    # Adjusted fontsize for bar value labels
-                    ax_bar.text(bar.get_x() + bar.get_width()/2, height + 0.5, f'{int(height)}', ha='center', va='bottom', fontsize=7, fontweight='bold', color='black')
-
-        # Adjusted fontsize for y-axis label
-        ax_bar.set_ylabel("Số lượng", fontsize=8)
-        # Adjusted fontsize and weight for title
-        ax_bar.set_title("Số lượng TBA theo ngưỡng tổn thất", fontsize=10, weight='bold')
-        ax_bar.set_xticks(list(x))
-        # Adjusted fontsize for x-axis tick labels
-        ax_bar.set_xticklabels(pivot_df.index, fontsize=7)
-        # Adjusted fontsize for y-axis tick labels
-        ax_bar.tick_params(axis='y', labelsize=7)
-        # Adjusted fontsize for legend
-        ax_bar.legend(title="Kỳ", fontsize=7)
-        # Adjusted gridline properties
-        ax_bar.grid(axis='y', linestyle='--', linewidth=0.7, alpha=0.6)
-
-        # Biểu đồ tròn (Tỷ trọng) - Ưu tiên dữ liệu 'Thực hiện' hoặc kỳ đầu tiên nếu không có
-        pie_data = pd.Series(0, index=pivot_df.index) # Default empty
-        if 'Thực hiện' in df_unique['Kỳ'].unique():
-            df_latest = df_unique[df_unique['Kỳ'] == 'Thực hiện']
-            pie_data = df_latest["Ngưỡng tổn thất"].value_counts().reindex(pivot_df.index, fill_value=0)
-        elif not df_unique.empty and not pivot_df.empty:
-            # Fallback to the first available period if 'Thực hiện' is not present
-            first_col_data = pivot_df.iloc[:, 0]
-            if first_col_data.sum() > 0:
-                pie_data = first_col_data
-
-        if pie_data.sum() > 0:
-            wedges, texts, autotexts = ax_pie.pie(
-                pie_data,
-                labels=pivot_df.index,
-                autopct='%1.1f%%',
-                startangle=90,
-                colors=colors,
-                pctdistance=0.75,
-                wedgeprops={'width': 0.3, 'edgecolor': 'w'}
+    files_ck = generate_filenames(nam_cungkỳ, thang_from, thang_to if "Lũy kế" in mode or "cùng kỳ" in mode.lower() else thang_from) if nam_cungkỳ else []
+
+    def compute():
+        """(bảng đã phân ngưỡng, pivot, tỷ trọng, chỉ mục chi tiết, file thiếu, thiếu cột lũy kế); None nếu không có dữ liệu."""
+        cumulative = "Lũy kế" in mode
+        missing = [fname for fname in files + files_ck if not all_files.get(fname)]
+        df = None
+        if cumulative:
+            # Lũy kế: bảng chi tiết cũng chỉ còn một dòng mỗi (TBA, Kỳ) như tba_cumulative, nên khi kho
+            # khớp các file đã chọn thì lấy tổng đã cộng trong SQL; theo tháng luôn đọc workbook để
+            # bảng chi tiết giữ đủ các cột của sheet
+            selected = {fname: all_files.get(fname) for fname in files + files_ck}
+            df = warehouse_query(
+                lambda wh: wh.tba_totals(nam, list(range(thang_from, thang_to + 1)), nam_cungkỳ is not None), "tba", selected,
+                lambda year, month: f"TBA_{year}_{month:02}.xlsx" in selected,
             )
-
-            for text in texts:
-                # Adjusted fontsize for pie chart labels
-                text.set_fontsize(6)
-                text.set_fontweight('bold')
-            for autotext in autotexts:
-                autotext.set_color('black')
-                # Adjusted fontsize for autopct values
-                autotext.set_fontsize(6)
-                autotext.set_fontweight('bold')
-
-            # Adjusted fontsize for total TBA text
-            ax_pie.text(0, 0, f"Tổng số TBA\\n{pie_data.sum()}", ha='center', va='center', fontsize=7, fontweight='bold', color='black')
-            # Adjusted fontsize and weight for pie chart title
-            ax_pie.set_title("Tỷ trọng TBA theo ngưỡng tổn thất", fontsize=10, weight='bold')
+            # Sheet thiếu cột tổn thất / thương phẩm: đọc workbook để phân ngưỡng theo tháng đầu như khi không có kho
+            if df is not None and (df.empty or df[["Tổn thất", "Thương phẩm"]].isna().all().any()):
+                df = None
+        if df is not None:
+            cumulative = False
         else:
-            # Adjusted fontsize for no data text
-            ax_pie.text(0.5, 0.5, "Không có dữ liệu tỷ trọng phù hợp", horizontalalignment='center', verticalalignment='center', transform=ax_pie.transAxes, fontsize=8)
-            # Adjusted fontsize and weight for pie chart title
-            ax_pie.set_title("Tỷ trọng TBA theo ngưỡng tổn thất", fontsize=10, weight='bold')
-
-
-        st.pyplot(fig)
+            frames = load_data(files, all_files, "Thực hiện") + (load_data(files_ck, all_files, "Cùng kỳ") if files_ck else [])
+            # Nối các tháng một lần, các cột chữ dùng chung tập category
+            df = concat_compact(frames)
+        if df.empty or "Tỷ lệ tổn thất" not in df.columns:
+            return None, missing
+        no_columns = cumulative and tba_cumulative_columns(df) is None
+        with stage("aggregation"):
+            df, pivot_df, pie_data = tba_threshold_summary(df, cumulative=cumulative)
+        return (df, pivot_df, pie_data, DetailIndex(df, "Tên TBA", "Ngưỡng tổn thất"), no_columns), missing
+
+    # Đã xem (năm, khoảng tháng, chế độ) này trong phiên và file không đổi: dùng lại kết quả
+    result, missing = remember("tba", mode, (nam, thang_from, thang_to, files_version(all_files, files + files_ck)), compute)
+    for fname in missing:
+        st.info(f"Không tìm thấy file: {fname}")
+
+    if result:
+        df, pivot_df, pie_data, index, no_columns = result
+        if no_columns:
+            st.warning("Không tìm thấy cột tổn thất / thương phẩm trong file TBA: lũy kế được phân ngưỡng theo tháng đầu tiên của mỗi TBA.")
+
+        # --- Vẽ biểu đồ (lấy từ cache nếu cùng dữ liệu) ---
+        show_chart(draw_tba_threshold, pivot_df, pie_data, export_name=f"TBA_{nam}_{thang_from:02}_{thang_to:02}.png")
 
         # --- Danh sách chi tiết TBA ---
-        nguong_filter = st.selectbox("Chọn ngưỡng để lọc danh sách TBA", ["(All)", "<2%", ">=2 và <3%", ">=3 và <4%", ">=4 và <5%", ">=5 và <7%", ">=7%"], key="tba_detail_filter")
-        if nguong_filter != "(All)":
-            df_filtered = df[df["Ngưỡng tổn thất"] == nguong_filter]
-        else:
-            df_filtered = df
-
         st.markdown("### 📋 Danh sách chi tiết TBA")
-        st.dataframe(df_filtered.reset_index(drop=True), use_container_width=True)
+        tba_detail_table(index)
 
     else:
         st.warning("Không có dữ liệu phù hợp để hiển thị biểu đồ. Vui lòng kiểm tra các file Excel trên Google Drive và định dạng của chúng (cần cột 'Tỷ lệ tổn thất').")
 
+lazy_section("🔌 Tổn thất các TBA công cộng", "exp_tba", section_tba)
 
-
-
-with st.expander("⚡ Tổn thất hạ thế"):
+@st.fragment
+@timed_section("ha")
+def section_ha():
+    """Phân tích tổn thất hạ thế."""
     st.header("Phân tích dữ liệu tổn thất hạ thế")
 
-    FOLDER_ID_HA = '1_rAY5T-unRyw20YwMgKuG1C0y7oq6GkK'
-
-    @st.cache_data
     def list_excel_files_ha():
-        service = get_drive_service()
-        if not service:
-            return {}
-        query = f"'{FOLDER_ID_HA}' in parents and mimeType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'"
         try:
-            results = service.files().list(q=query, fields="files(id, name)").execute()
-            return {f['name']: f['id'] for f in results.get('files', [])}
+            return list_folder_files(FOLDER_ID_HA)
         except Exception as e:
             st.error(f"Lỗi liệt kê file hạ thế: {e}")
             return {}
@@ -305,90 +433,28 @@ with st.expander("⚡ Tổn thất hạ thế"):
     loai_bc = st.radio("Loại báo cáo", ["Tháng", "Lũy kế"], horizontal=True, key="ha_loai_bc")
     thang = st.selectbox("Chọn tháng", list(range(1, 13)), index=0, key="ha_thang")
 
-    months = list(range(1, 13))
-    df_th = pd.DataFrame({"Tháng": months, "Tỷ lệ": [None]*12})
-    df_ck = pd.DataFrame({"Tháng": months, "Tỷ lệ": [None]*12})
-
-    tong_ton_that = 0
-    tong_thuong_pham = 0
-
-    for i in range(1, 13):
-        fname = f"HA_{nam}_{i:02}.xlsx"
-        file_id = all_files_ha.get(fname)
-
-        if file_id and i <= thang:
-            df = download_excel(file_id)
-            if not df.empty and df.shape[0] >= 1:
-                try:
-                    ty_le_th = float(str(df.iloc[0, 4]).replace(",", "."))
-                    ton_that = float(str(df.iloc[0, 3]).replace(",", "."))
-                    thuong_pham = float(str(df.iloc[0, 1]).replace(",", "."))
-
-                    if loai_bc == "Lũy kế":
-                        tong_ton_that += ton_that
-                        tong_thuong_pham += thuong_pham
-                        ty_le_lk = (tong_ton_that / tong_thuong_pham) * 100 if tong_thuong_pham > 0 else 0
-                        df_th.loc[df_th["Tháng"] == i, "Tỷ lệ"] = ty_le_lk
-                    else:
-                        df_th.loc[df_th["Tháng"] == i, "Tỷ lệ"] = ty_le_th
-                except:
-                    st.warning(f"Lỗi đọc file: {fname}")
-
-        # Cùng kỳ luôn lấy đủ 12 tháng
-        fname_ck = f"HA_{nam - 1}_{i:02}.xlsx"
-        file_id_ck = all_files_ha.get(fname_ck)
-        if file_id_ck:
-            df_ck_file = download_excel(file_id_ck)
-            if not df_ck_file.empty and df_ck_file.shape[0] >= 1:
-                try:
-                    ty_le_ck = float(str(df_ck_file.iloc[0, 4]).replace(",", "."))
-                    df_ck.loc[df_ck["Tháng"] == i, "Tỷ lệ"] = ty_le_ck
-                except:
-                    pass
+    df_th, df_ck, loi = level_results("ha", all_files_ha, nam, thang, loai_bc)
+    for i in loi:
+        st.warning(f"Lỗi đọc file: HA_{nam}_{i:02}.xlsx")
 
     if df_th["Tỷ lệ"].notna().any():
-        # Changed figsize for a slightly smaller plot, and DPI for sharpness
-        fig, ax = plt.subplots(figsize=(6, 3), dpi=600) # Increased DPI to 600 for sharpness, adjusted figsize
-
-        ax.plot(df_th["Tháng"], df_th["Tỷ lệ"], color='#1f77b4', label='Thực hiện', linewidth=1, markersize=3, marker='o') # Adjusted linewidth and markersize
-        if df_ck["Tỷ lệ"].notna().any():
-            ax.plot(df_ck["Tháng"], df_ck["Tỷ lệ"], color='#ff7f0e', label='Cùng kỳ', linewidth=1, markersize=3, marker='o') # Adjusted linewidth and markersize
-
-        for i, v in df_th.dropna(subset=["Tỷ lệ"]).iterrows():
-            ax.text(v["Tháng"], v["Tỷ lệ"] + 0.05, f"{v['Tỷ lệ']:.2f}", ha='center', fontsize=6, color='black') # Adjusted fontsize to 6
-
-        if df_ck["Tỷ lệ"].notna().any():
-            for i, v in df_ck.dropna(subset=["Tỷ lệ"]).iterrows():
-                ax.text(v["Tháng"], v["Tỷ lệ"] + 0.05, f"{v['Tỷ lệ']:.2f}", ha='center', fontsize=6, color='black') # Adjusted fontsize to 6
-
-        ax.set_ylabel("Tỷ lệ (%)", fontsize=7, color='black') # Adjusted fontsize to 7
-        ax.set_xlabel("Tháng", fontsize=7, color='black') # Adjusted fontsize to 7
-        ax.set_xticks(months)
-        ax.tick_params(axis='both', colors='black', labelsize=6) # Adjusted labelsize to 6
-        ax.grid(True, linestyle='--', linewidth=0.5, alpha=0.7) # Adjusted linewidth and alpha for grid
-        ax.set_title("Biểu đồ tỷ lệ tổn thất hạ thế", fontsize=9, color='black') # Adjusted fontsize to 9
-        ax.legend(fontsize=7, frameon=False) # Adjusted fontsize to 7
-
-        st.pyplot(fig)
+        show_chart(draw_loss_trend, df_th, df_ck, title=LOSS_TREND_TITLES["ha"], export_name=f"HA_{nam}_{thang:02}.png")
         st.dataframe(df_th)
 
     else:
         st.warning("Không có dữ liệu phù hợp để hiển thị.")
 
-with st.expander("⚡ Tổn thất trung thế"):
-    st.header("Phân tích dữ liệu TBA Trung thế")
+lazy_section("⚡ Tổn thất hạ thế", "exp_ha", section_ha)
 
-    FOLDER_ID_TRUNG = '1-Ph2auxlinL5Y3bxE7AeeAeYE2KDALJT'
+@st.fragment
+@timed_section("trung")
+def section_trung():
+    """Phân tích tổn thất trung thế."""
+    st.header("Phân tích dữ liệu TBA Trung thế")
 
-    @st.cache_data
     def list_excel_files_trung():
-        service = get_drive_service()
-        if not service:
-            return {}
-        query = f"'{FOLDER_ID_TRUNG}' in parents and mimeType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'"
         try:
-            results = service.files().list(q=query, fields="files(id, name)").execute()
-            return {f['name']: f['id'] for f in results.get('files', [])}
+            return list_folder_files(FOLDER_ID_TRUNG)
         except Exception as e:
             st.error(f"Lỗi liệt kê file trung thế: {e}")
             return {}
@@ -398,209 +464,91 @@ with st.expander("⚡ Tổn thất trung thế"):
     loai_bc = st.radio("Loại báo cáo", ["Tháng", "Lũy kế"], horizontal=True, key="trung_loai_bc")
     thang = st.selectbox("Chọn tháng", list(range(1, 13)), index=0, key="trung_thang")
 
-    months = list(range(1, 13))
-    df_th = pd.DataFrame({"Tháng": months, "Tỷ lệ": [None]*12})
-    df_ck = pd.DataFrame({"Tháng": months, "Tỷ lệ": [None]*12})
-
-    tong_ton_that = 0
-    tong_thuong_pham = 0
-
-    for i in range(1, 13):
-        fname = f"TA_{nam}_{i:02}.xlsx"
-        file_id = all_files_trung.get(fname)
-
-        if file_id and i <= thang:
-            df = download_excel(file_id)
-            if not df.empty and df.shape[0] >= 1:
-                try:
-                    ty_le_th = float(str(df.iloc[0, 4]).replace(",", "."))
-                    ton_that = float(str(df.iloc[0, 3]).replace(",", "."))
-                    thuong_pham = float(str(df.iloc[0, 1]).replace(",", "."))
-
-                    if loai_bc == "Lũy kế":
-                        tong_ton_that += ton_that
-                        tong_thuong_pham += thuong_pham
-                        ty_le_lk = (tong_ton_that / tong_thuong_pham) * 100 if tong_thuong_pham > 0 else 0
-                        df_th.loc[df_th["Tháng"] == i, "Tỷ lệ"] = ty_le_lk
-                    else:
-                        df_th.loc[df_th["Tháng"] == i, "Tỷ lệ"] = ty_le_th
-                except:
-                    st.warning(f"Lỗi đọc file: {fname}")
-
-        fname_ck = f"TA_{nam - 1}_{i:02}.xlsx"
-        file_id_ck = all_files_trung.get(fname_ck)
-        if file_id_ck:
-            df_ck_file = download_excel(file_id_ck)
-            if not df_ck_file.empty and df_ck_file.shape[0] >= 1:
-                try:
-                    ty_le_ck = float(str(df_ck_file.iloc[0, 4]).replace(",", "."))
-                    df_ck.loc[df_ck["Tháng"] == i, "Tỷ lệ"] = ty_le_ck
-                except:
-                    pass
+    df_th, df_ck, loi = level_results("trung", all_files_trung, nam, thang, loai_bc)
+    for i in loi:
+        st.warning(f"Lỗi đọc file: TA_{nam}_{i:02}.xlsx")
 
     if df_th["Tỷ lệ"].notna().any():
-        fig, ax = plt.subplots(figsize=(6, 3), dpi=600)
-
-        ax.plot(df_th["Tháng"], df_th["Tỷ lệ"], color='#1f77b4', label='Thực hiện', linewidth=1, markersize=3, marker='o')
-        if df_ck["Tỷ lệ"].notna().any():
-            ax.plot(df_ck["Tháng"], df_ck["Tỷ lệ"], color='#ff7f0e', label='Cùng kỳ', linewidth=1, markersize=3, marker='o')
-
-        for i, v in df_th.dropna(subset=["Tỷ lệ"]).iterrows():
-            ax.text(v["Tháng"], v["Tỷ lệ"] + 0.05, f"{v['Tỷ lệ']:.2f}", ha='center', fontsize=6, color='black')
-
-        if df_ck["Tỷ lệ"].notna().any():
-            for i, v in df_ck.dropna(subset=["Tỷ lệ"]).iterrows():
-                ax.text(v["Tháng"], v["Tỷ lệ"] + 0.05, f"{v['Tỷ lệ']:.2f}", ha='center', fontsize=6, color='black')
-
-        ax.set_ylabel("Tỷ lệ (%)", fontsize=7, color='black')
-        ax.set_xlabel("Tháng", fontsize=7, color='black')
-        ax.set_xticks(months)
-        ax.tick_params(axis='both', colors='black', labelsize=6)
-        ax.grid(True, linestyle='--', linewidth=0.5, alpha=0.7)
-        ax.set_title("Biểu đồ tỷ lệ tổn thất trung thế", fontsize=9, color='black')
-        ax.legend(fontsize=7, frameon=False)
-
-        st.pyplot(fig)
+        show_chart(draw_loss_trend, df_th, df_ck, title=LOSS_TREND_TITLES["trung"], export_name=f"TA_{nam}_{thang:02}.png")
         st.dataframe(df_th)
 
     else:
         st.warning("Không có dữ liệu phù hợp để hiển thị.")
-FOLDER_ID_DY = '1ESynjLXJrw8TaF3zwlQm-BR3mFf4LIi9'
-
-@st.cache_data
-def get_drive_service():
-    credentials = service_account.Credentials.from_service_account_info(
-        st.secrets["google"],
-        scopes=["https://www.googleapis.com/auth/drive.readonly"]
-    )
-    return build('drive', 'v3', credentials=credentials)
-
-@st.cache_data
-def list_excel_files():
-    service = get_drive_service()
-    query = f"'{FOLDER_ID_DY}' in parents and mimeType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'"
-    results = service.files().list(q=query, fields="files(id, name)").execute()
-    return {f['name']: f['id'] for f in results.get('files', [])}
-
-@st.cache_data
-def download_excel(file_id):
-    service = get_drive_service()
-    request = service.files().get_media(fileId=file_id)
-    fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, request)
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
-    fh.seek(0)
-    return pd.read_excel(fh, sheet_name=0)
-
-st.set_page_config(layout="wide", page_title="Báo cáo tổn thất Đường dây Trung thế")
-
-with st.expander("⚡ Tổn thất các đường dây trung thế"):
-    st.header("Phân tích dữ liệu tổn thất đường dây trung thế")
-
-    all_files = list_excel_files()
-
-    all_years = sorted({int(fname.split("_")[1]) for fname in all_files.keys() if "_" in fname})
-
-    selected_year = st.selectbox("Chọn năm", all_years)
-    include_cungkỳ = st.checkbox("So sánh cùng kỳ năm trước", value=True)
-    mode = st.radio("Chọn chế độ báo cáo", ["Tháng", "Lũy kế"], horizontal=True)
-    chart_type = st.radio("Chọn kiểu biểu đồ", ["Cột", "Đường line"], horizontal=True)
-
-    data_list = []
-
-    for fname, file_id in all_files.items():
-        try:
-            year = int(fname.split("_")[1])
-            month = int(fname.split("_")[2].split(".")[0])
-        except:
-            continue
 
-        if year == selected_year or (include_cungkỳ and year == selected_year - 1):
-            df = download_excel(file_id)
+lazy_section("⚡ Tổn thất trung thế", "exp_trung", section_trung)
 
-            for idx, row in df.iterrows():
-                ten_dd = str(row.iloc[1]).strip()
-                dien_ton_that = row.iloc[5]
-                thuong_pham = row.iloc[2]
-                ky = "Cùng kỳ" if year == selected_year - 1 else "Thực hiện"
+def list_excel_files_dy():
+    return list_folder_files(FOLDER_ID_DY)
 
-                data_list.append({
-                    "Năm": year,
-                    "Tháng": month,
-                    "Đường dây": ten_dd,
-                    "Điện tổn thất": dien_ton_that,
-                    "Thương phẩm": thuong_pham,
-                    "Kỳ": ky
-                })
 
-    df_all = pd.DataFrame(data_list)
-
-    if not df_all.empty:
-        duong_day_list = df_all["Đường dây"].unique()
-
-        for dd in duong_day_list:
-            df_dd = df_all[df_all["Đường dây"] == dd]
-
-            df_dd = df_dd.sort_values("Tháng")
+@st.fragment
+@timed_section("dy")
+def section_dy():
+    """Phân tích tổn thất các đường dây trung thế."""
+    from loss_calc import FEEDER_READ, feeder_charts, feeder_files, feeder_frame, feeder_loss_table
+    st.header("Phân tích dữ liệu tổn thất đường dây trung thế")
 
-            if mode == "Lũy kế":
-                df_dd["Tổng Điện tổn thất"] = df_dd.groupby(["Kỳ"])["Điện tổn thất"].cumsum()
-                df_dd["Tổng Thương phẩm"] = df_dd.groupby(["Kỳ"])["Thương phẩm"].cumsum()
-                df_dd["Tổn thất (%)"] = (df_dd["Tổng Điện tổn thất"] / df_dd["Tổng Thương phẩm"] * 100).round(2)
-            else:
-                df_dd["Tổn thất (%)"] = (df_dd["Điện tổn thất"] / df_dd["Thương phẩm"] * 100).round(2)
+    all_files = list_excel_files_dy()
 
-            pivot_df = df_dd.pivot(index="Tháng", columns="Kỳ", values="Tổn thất (%)").reindex(range(1, 13)).fillna(0)
+    all_years = sorted({int(fname.split("_")[1]) for fname in all_files.keys() if "_" in fname})
 
+    selected_year = st.selectbox("Chọn năm", all_years, key="dy_nam")
+    if selected_year is None:
+        # Thư mục đường dây chưa có file nào
+        st.warning("Không có dữ liệu để hiển thị cho năm đã chọn.")
+        return
+    if interactive_charts():
+        # Kiểu biểu đồ và cùng kỳ đổi bằng nút trong hình; luôn nạp cùng kỳ để trình duyệt tự ẩn/hiện
+        show_cungky = st.session_state.get("dy_cungky", True)
+        include_cungkỳ, chart_type = True, st.session_state.get("dy_chart_type", "Cột")
+    else:
+        include_cungkỳ = show_cungky = st.checkbox("So sánh cùng kỳ năm trước", value=True, key="dy_cungky")
+    mode = st.radio("Chọn chế độ báo cáo", ["Tháng", "Lũy kế"], horizontal=True, key="dy_mode")
+    if not interactive_charts():
+        chart_type = st.radio("Chọn kiểu biểu đồ", ["Cột", "Đường line"], horizontal=True, key="dy_chart_type")
+
+    years = (selected_year, selected_year - 1) if include_cungkỳ else (selected_year,)
+
+    def compute():
+        # Có kho dữ liệu: tổng theo (đường dây, tháng) lấy từ SQL thay vì đọc từng workbook
+        totals = warehouse_query(lambda wh: wh.feeder_frame(selected_year, include_cungkỳ), "dy", all_files, lambda year, month: year in years)
+        if totals is not None and not totals.empty:
+            parts = [totals]
+        else:
+            selected_files = feeder_files(all_files, selected_year, include_cungkỳ)
+            frames = download_excel_batch([file for _, _, file in selected_files], **FEEDER_READ)
+            # Chỉ đọc 3 cột cần dùng của từng workbook rồi tính cho tất cả đường dây trong một lần groupby
+            parts = [feeder_frame(df, year, month, "Cùng kỳ" if year == selected_year - 1 else "Thực hiện") for (year, month, _), df in zip(selected_files, frames)]
+        with stage("aggregation"):
+            return feeder_charts(feeder_loss_table(parts, luy_ke=(mode == "Lũy kế")))
+
+    # So sánh cùng kỳ nhớ trong ô *_ck_dy, chỉ năm đã chọn nhớ theo chế độ Tháng / Lũy kế
+    version = files_version(all_files, years=years)
+    charts_dy = remember("dy", "Cùng kỳ" if include_cungkỳ else mode, (selected_year, 1, 12, mode, version), compute)
+
+    if charts_dy:
+        for dd, pivot_df in charts_dy:
             st.write(f"### Biểu đồ tỷ lệ tổn thất - Đường dây {dd}")
 
-            fig, ax = plt.subplots(figsize=(10, 4), dpi=150)
-
-            if chart_type == "Cột":
-                pivot_df.plot(kind="bar", ax=ax)
-                ax.set_xticklabels(pivot_df.index, rotation=0, ha='center') # Changed rotation to 0, ha='center'
-                ax.tick_params(axis='y', labelrotation=0) # Ensure y-axis labels are not rotated
-                for container in ax.containers:
-                    for bar in container:
-                        height = bar.get_height()
-                        if height > 0:
-                            ax.text(bar.get_x() + bar.get_width()/2, height + 0.2, f"{height:.2f}", ha='center', fontsize=7)
-            else:
-                for col in pivot_df.columns:
-                    valid_data = pivot_df[col].replace(0, pd.NA).dropna()
-                    ax.plot(valid_data.index, valid_data.values, marker='o', label=col)
-                    for x, y in zip(valid_data.index, valid_data.values):
-                        ax.text(x, y + 0.2, f"{y:.2f}", ha='center', fontsize=7)
-                ax.set_xticks(range(1, 13))
-                ax.set_xticklabels(range(1, 13), rotation=0, ha='center') # Changed rotation to 0, ha='center'
-                ax.tick_params(axis='y', labelrotation=0) # Ensure y-axis labels are not rotated
-
-            ax.set_xlabel("Tháng")
-            ax.set_ylabel("Tổn thất (%)")
-            ax.set_title(f"Đường dây {dd} - Năm {selected_year}")
-            ax.legend()
-            ax.grid(axis='y', linestyle='--', alpha=0.7)
-
-            st.pyplot(fig, use_container_width=True)
+            show_chart(
+                draw_feeder, pivot_df, dd=dd, selected_year=selected_year, chart_type=chart_type,
+                export_name=f"DY_{dd}_{selected_year}.png", plotly_options={"show_cungky": show_cungky},
+            )
 
     else:
         st.warning("Không có dữ liệu để hiển thị cho năm đã chọn.")
-with st.expander("⚡ Tổn thất toàn đơn vị"):
-    st.header("Phân tích dữ liệu toàn đơn vị")
 
-    FOLDER_ID_TOAN_DON_VI = '1bPmINKlAHJMWUcxonMSnuLGz9ErlPEUi'
+lazy_section("⚡ Tổn thất các đường dây trung thế", "exp_dy", section_dy)
+
+@st.fragment
+@timed_section("dv")
+def section_dv():
+    """Phân tích tổn thất toàn đơn vị."""
+    st.header("Phân tích dữ liệu toàn đơn vị")
 
-    @st.cache_data
     def list_excel_files_toan_don_vi():
-        service = get_drive_service()
-        if not service:
-            return {}
-        query = f"'{FOLDER_ID_TOAN_DON_VI}' in parents and mimeType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'"
         try:
-            results = service.files().list(q=query, fields="files(id, name)").execute()
-            return {f['name']: f['id'] for f in results.get('files', [])}
+            return list_folder_files(FOLDER_ID_TOAN_DON_VI)
         except Exception as e:
             st.error(f"Lỗi liệt kê file toàn đơn vị: {e}")
             return {}
@@ -610,70 +558,50 @@ with st.expander("⚡ Tổn thất toàn đơn vị"):
     loai_bc = st.radio("Loại báo cáo", ["Tháng", "Lũy kế"], horizontal=True, key="dv_loai_bc")
     thang = st.selectbox("Chọn tháng", list(range(1, 13)), index=0, key="dv_thang")
 
-    months = list(range(1, 13))
-    df_th = pd.DataFrame({"Tháng": months, "Tỷ lệ": [None]*12})
-    df_ck = pd.DataFrame({"Tháng": months, "Tỷ lệ": [None]*12})
-
-    tong_ton_that = 0
-    tong_thuong_pham = 0
-
-    for i in range(1, 13):
-        fname = f"DV_{nam}_{i:02}.xlsx"
-        file_id = all_files_toan_don_vi.get(fname)
-
-        if file_id and i <= thang:
-            df = download_excel(file_id)
-            if not df.empty and df.shape[0] >= 1:
-                try:
-                    ty_le_th = float(str(df.iloc[0, 4]).replace(",", "."))
-                    ton_that = float(str(df.iloc[0, 3]).replace(",", "."))
-                    thuong_pham = float(str(df.iloc[0, 1]).replace(",", "."))
-
-                    if loai_bc == "Lũy kế":
-                        tong_ton_that += ton_that
-                        tong_thuong_pham += thuong_pham
-                        ty_le_lk = (tong_ton_that / tong_thuong_pham) * 100 if tong_thuong_pham > 0 else 0
-                        df_th.loc[df_th["Tháng"] == i, "Tỷ lệ"] = ty_le_lk
-                    else:
-                        df_th.loc[df_th["Tháng"] == i, "Tỷ lệ"] = ty_le_th
-                except:
-                    st.warning(f"Lỗi đọc file: {fname}")
-
-        fname_ck = f"DV_{nam - 1}_{i:02}.xlsx"
-        file_id_ck = all_files_toan_don_vi.get(fname_ck)
-        if file_id_ck:
-            df_ck_file = download_excel(file_id_ck)
-            if not df_ck_file.empty and df_ck_file.shape[0] >= 1:
-                try:
-                    ty_le_ck = float(str(df_ck_file.iloc[0, 4]).replace(",", "."))
-                    df_ck.loc[df_ck["Tháng"] == i, "Tỷ lệ"] = ty_le_ck
-                except:
-                    pass
+    df_th, df_ck, loi = level_results("dv", all_files_toan_don_vi, nam, thang, loai_bc)
+    for i in loi:
+        st.warning(f"Lỗi đọc file: DV_{nam}_{i:02}.xlsx")
 
     if df_th["Tỷ lệ"].notna().any():
-        fig, ax = plt.subplots(figsize=(6, 3), dpi=600)
-
-        ax.plot(df_th["Tháng"], df_th["Tỷ lệ"], color='#1f77b4', label='Thực hiện', linewidth=1, markersize=3, marker='o')
-        if df_ck["Tỷ lệ"].notna().any():
-            ax.plot(df_ck["Tháng"], df_ck["Tỷ lệ"], color='#ff7f0e', label='Cùng kỳ', linewidth=1, markersize=3, marker='o')
-
-        for i, v in df_th.dropna(subset=["Tỷ lệ"]).iterrows():
-            ax.text(v["Tháng"], v["Tỷ lệ"] + 0.05, f"{v['Tỷ lệ']:.2f}", ha='center', fontsize=6, color='black')
-
-        if df_ck["Tỷ lệ"].notna().any():
-            for i, v in df_ck.dropna(subset=["Tỷ lệ"]).iterrows():
-                ax.text(v["Tháng"], v["Tỷ lệ"] + 0.05, f"{v['Tỷ lệ']:.2f}", ha='center', fontsize=6, color='black')
-
-        ax.set_ylabel("Tỷ lệ (%)", fontsize=7, color='black')
-        ax.set_xlabel("Tháng", fontsize=7, color='black')
-        ax.set_xticks(months)
-        ax.tick_params(axis='both', colors='black', labelsize=6)
-        ax.grid(True, linestyle='--', linewidth=0.5, alpha=0.7)
-        ax.set_title("Biểu đồ tỷ lệ tổn thất toàn đơn vị", fontsize=9, color='black')
-        ax.legend(fontsize=7, frameon=False)
-
-        st.pyplot(fig)
+        show_chart(draw_loss_trend, df_th, df_ck, title=LOSS_TREND_TITLES["dv"], export_name=f"DV_{nam}_{thang:02}.png")
         st.dataframe(df_th)
 
     else:
-        st.warning("Không có dữ liệu phù hợp để hiển thị.")
\ No newline at end of file
+        st.warning("Không có dữ liệu phù hợp để hiển thị.")
+
+lazy_section("⚡ Tổn thất toàn đơn vị", "exp_dv", section_dv)
+
+# --- Dịch vụ nền (sau khi giao diện chính đã hiển thị) và báo cáo thời gian khởi động ---
+FIRST_RENDER_SECONDS = time.perf_counter() - SCRIPT_STARTED
+
+@st.cache_resource(show_spinner=False)
+def get_prefetcher():
+    """Luồng nền tải trước file mới và vẽ sẵn các view mặc định, một luồng cho cả tiến trình.
+
+    Tắt bằng PREFETCH_INTERVAL_SECONDS=0 (ví dụ khi đã chạy `python prefetch.py` riêng).
+    Nhóm client được lấy ở đây, trong luồng script; luồng nền chỉ dùng pool.client.
+    """
+    from prefetch import PREFETCH_SECONDS, Prefetcher
+    prefetcher = Prefetcher(drive_pool().client, get_folder_index(), get_loss_facts(), figures=get_figure_cache())
+    if PREFETCH_SECONDS > 0:
+        prefetcher.start()
+    return prefetcher
+
+@st.cache_resource(show_spinner=False)
+def start_metrics_server():
+    """Mở endpoint Prometheus /metrics (một lần cho cả tiến trình) khi có biến METRICS_PORT."""
+    return metrics.serve(METRICS_PORT) if METRICS_PORT else None
+
+services_started = time.perf_counter()
+try:
+    get_prefetcher()
+except RuntimeError:
+    # Chưa xác thực được Drive (các phần phân tích đã báo lỗi); lần chạy sau thử lại
+    pass
+start_metrics_server()
+startup = metrics.startup(IMPORT_SECONDS, FIRST_RENDER_SECONDS, time.perf_counter() - services_started)
+if st.session_state.get("perf_debug"):
+    st.sidebar.caption(
+        f"🚀 Khởi động ({'lần đầu của tiến trình' if startup['cold'] else 'đã nạp sẵn'}): "
+        f"import {startup['import']:.2f}s · hiển thị {startup['first_render']:.2f}s · dịch vụ nền {startup['services']:.2f}s"
+    )
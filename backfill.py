@@ -0,0 +1,306 @@
+"""Nạp toàn bộ workbook lịch sử (từ 2020) vào kho cột Parquet cục bộ, đọc song song trên nhiều tiến trình.
+
+    python backfill.py --since 2020
+    python backfill.py --since 2020 --local du_lieu --workers 8 --store .cache/history
+
+Nguồn là năm thư mục Drive trong config.py, hoặc một thư mục cục bộ có các thư mục con
+tba / ha / trung / dy / dv (tên ngắn trong config.FOLDER_NAMES). Mỗi file TBA_/HA_/TA_/DV_
+và đường dây được tải, đọc, kiểm tra bố cục cột và chuẩn hóa ngay trong tiến trình con rồi
+ghi thành một file Parquet; tiến trình cha chỉ ghi checkpoint nên thời gian chạy giảm gần
+tuyến tính theo số lõi. Checkpoint ghi sau từng file: chạy lại chỉ xử lý file mới, file đã
+đổi hoặc file lần trước tải lỗi.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import re
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import metrics
+from config import FOLDER_NAMES
+from disk_cache import CACHE_DIR
+from excel_reader import read_sheet
+from loss_calc import FEEDER_READ, TBA_NAME_COLUMN, compact_frame, concat_compact, feeder_frame
+from loss_facts import LEVEL_PREFIX, SCALAR_READ, extract_scalars, parse_filename
+
+STORE_DIR = os.environ.get("BACKFILL_STORE_DIR", os.path.join(os.path.dirname(CACHE_DIR), "history"))
+BACKFILL_WORKERS = int(os.environ.get("BACKFILL_WORKERS", str(os.cpu_count() or 2)))
+SINCE_YEAR = 2020
+
+# Loại dữ liệu (tên ngắn của thư mục) -> tiền tố tên file; đường dây đặt tên tự do dạng *_YYYY_MM.xlsx
+KINDS = {"tba": "TBA", **LEVEL_PREFIX, "dy": None}
+FOLDERS = {name: folder_id for folder_id, name in FOLDER_NAMES.items()}
+
+TBA_REQUIRED = [TBA_NAME_COLUMN, "Tỷ lệ tổn thất"]
+# Sai lệch cho phép (điểm %) giữa tỷ lệ ghi trong file hạ thế / trung thế / đơn vị và tổn thất / thương phẩm
+RATIO_TOLERANCE = 0.1
+LEVEL_COLUMNS = ["level", "year", "month", "thuong_pham", "ton_that", "ty_le"]
+
+logger = logging.getLogger(__name__)
+
+_drive = None  # DriveClientPool riêng của mỗi tiến trình con khi đọc từ Drive
+
+
+class LayoutError(ValueError):
+    """Workbook không đúng bố cục cột của loại dữ liệu."""
+
+
+def file_period(kind, name):
+    """(năm, tháng) từ tên file của loại kind, None nếu tên không đúng mẫu."""
+    if KINDS[kind]:
+        period = parse_filename(name, KINDS[kind])
+    else:
+        m = re.fullmatch(r"[^_]*_(\d{4})_(\d{1,2})\.xlsx", name)
+        period = (int(m.group(1)), int(m.group(2))) if m else None
+    return period if period and 1 <= period[1] <= 12 else None
+
+
+def store_path(store, kind, year, name):
+    return os.path.join(store, kind, str(year), os.path.splitext(name)[0] + ".parquet")
+
+
+def normalize(kind, source, year, month):
+    """Đọc và chuẩn hóa một workbook; ném LayoutError nếu bố cục cột không đúng.
+
+    tba: cả sheet (thu gọn kiểu) kèm "Năm", "Tháng"; ha / trung / dv: một dòng LEVEL_COLUMNS;
+    dy: các cột của feeder_frame (không có "Kỳ").
+    """
+    if kind == "tba":
+        df = read_sheet(source)
+        missing = [c for c in TBA_REQUIRED if c not in df.columns]
+        if missing:
+            raise LayoutError(f"thiếu cột {missing}")
+        df = compact_frame(df)
+        df["Năm"], df["Tháng"] = year, month
+        return df
+    if kind == "dy":
+        df = read_sheet(source, **FEEDER_READ)
+        if df.shape[1] < len(FEEDER_READ["usecols"]):
+            raise LayoutError(f"cần {max(FEEDER_READ['usecols']) + 1} cột, chỉ có {df.shape[1]}")
+        part = feeder_frame(df, year, month, None).drop(columns="Kỳ")
+        part = part[part["Thương phẩm"].notna() & part["Đường dây"].ne("nan")]
+        if part.empty:
+            raise LayoutError("không có dòng đường dây nào có số thương phẩm")
+        return part.reset_index(drop=True)
+
+    df = read_sheet(source, **SCALAR_READ)
+    scalars = extract_scalars(df)
+    if df.shape[1] < len(SCALAR_READ["usecols"]) or all(pd.isna(v) for v in scalars):
+        raise LayoutError("dòng đầu không có thương phẩm / tổn thất / tỷ lệ ở các cột 1, 3, 4")
+    check_scalars(*scalars)
+    return pd.DataFrame([(kind, year, month, *scalars)], columns=LEVEL_COLUMNS)
+
+
+def check_scalars(thuong_pham, ton_that, ty_le):
+    """Ném LayoutError nếu số liệu dòng đầu không phải (thương phẩm, tổn thất, tỷ lệ %), ví dụ file đặt nhầm thư mục.
+
+    Tỷ lệ phải là phần trăm (-100..100); có đủ thương phẩm và tổn thất thì thương phẩm phải dương
+    và tỷ lệ phải khớp tổn thất / thương phẩm * 100 (sai lệch tối đa RATIO_TOLERANCE điểm % hoặc 2%).
+    """
+    if pd.isna(ty_le) or not -100 <= ty_le <= 100:
+        raise LayoutError(f"cột 4 không phải tỷ lệ tổn thất (%): {ty_le}")
+    if pd.isna(thuong_pham) or pd.isna(ton_that):
+        return
+    if thuong_pham <= 0:
+        raise LayoutError(f"thương phẩm ở cột 1 không dương: {thuong_pham}")
+    ratio = ton_that / thuong_pham * 100
+    if abs(ratio - ty_le) > max(RATIO_TOLERANCE, 0.02 * abs(ty_le)):
+        raise LayoutError(f"tỷ lệ {ty_le} không khớp tổn thất / thương phẩm ({ratio:.2f}%)")
+
+
+def _storable(df):
+    """Cột category lẫn số và chữ (dòng tổng, ghi chú) được đổi sang chuỗi để ghi được Parquet."""
+    for col in df.columns:
+        s = df[col]
+        if isinstance(s.dtype, pd.CategoricalDtype) and pd.api.types.infer_dtype(s.cat.categories) != "string":
+            df[col] = s.astype(object).where(s.isna(), s.astype(str)).astype("category")
+    df.columns = [str(c) for c in df.columns]
+    return df
+
+
+def _init_worker(service_account_info):
+    global _drive
+    if service_account_info is not None:
+        from drive_client import DriveClientPool
+
+        _drive = DriveClientPool(service_account_info, size=1)
+
+
+def _download(file_id):
+    import io
+
+    from googleapiclient.http import MediaIoBaseDownload
+
+    fh = io.BytesIO()
+    with _drive.client() as service:
+        downloader = MediaIoBaseDownload(fh, service.files().get_media(fileId=file_id))
+        done = False
+        while not done:
+            _, done = downloader.next_chunk()
+    fh.seek(0)
+    return fh
+
+
+def process_file(task):
+    """Chạy trong tiến trình con: tải (nếu từ Drive), đọc, chuẩn hóa và ghi một file vào kho.
+
+    Trả về (khóa checkpoint, bản ghi checkpoint); lỗi bố cục được ghi nhận là "invalid",
+    lỗi tải / đọc khác là "error" (lần chạy sau thử lại).
+    """
+    key, kind, name, source, version, store = task
+    year, month = file_period(kind, name)
+    entry = {"version": version, "year": year, "month": month}
+    try:
+        df = normalize(kind, _download(source) if _drive is not None else source, year, month)
+        path = store_path(store, kind, year, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            _storable(df).to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        entry.update(status="ok", rows=len(df), path=os.path.relpath(path, store))
+    except LayoutError as e:
+        entry.update(status="invalid", error=str(e))
+    except Exception as e:
+        entry.update(status="error", error=f"{type(e).__name__}: {e}")
+    return key, entry
+
+
+class Checkpoint:
+    """Trạng thái từng file nguồn đã xử lý ({khóa: bản ghi}), ghi lại file JSON sau mỗi lần cập nhật."""
+
+    def __init__(self, store):
+        self.path = os.path.join(store, "checkpoint.json")
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                self.entries = json.load(fh)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def done(self, key, version, store):
+        """File đã xử lý xong với phiên bản này (bỏ qua khi chạy lại)."""
+        entry = self.entries.get(key)
+        if not entry or entry["version"] != version:
+            return False
+        if entry["status"] == "ok":
+            return os.path.exists(os.path.join(store, entry["path"]))
+        return entry["status"] == "invalid"
+
+    def update(self, key, entry):
+        self.entries[key] = entry
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(self.entries, fh, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+def local_sources(root):
+    """{loại: [(tên file, đường dẫn, phiên bản, kích thước)]} từ các thư mục con tba / ha / trung / dy / dv."""
+    sources = {}
+    for kind in KINDS:
+        folder = os.path.join(root, kind)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            if name.endswith(".xlsx") and os.path.isfile(path):
+                st_ = os.stat(path)
+                sources.setdefault(kind, []).append((name, os.path.abspath(path), f"{st_.st_mtime_ns}-{st_.st_size}", st_.st_size))
+    return sources
+
+
+def drive_sources(client):
+    """Như local_sources nhưng đọc chỉ mục các thư mục Drive; nguồn là file ID, phiên bản là modifiedTime."""
+    from folder_index import FolderIndex
+
+    index = FolderIndex(client, FOLDERS.values())
+    return {
+        kind: [(name, f["id"], f.get("modifiedTime") or "", f.get("size") or 0) for name, f in sorted(index.files(FOLDERS[kind]).items())]
+        for kind in KINDS
+    }
+
+
+def backfill(sources, store=STORE_DIR, since=SINCE_YEAR, until=None, workers=BACKFILL_WORKERS, service_account_info=None, full=False):
+    """Xử lý các file nguồn của các năm since..until chưa có trong checkpoint; trả về số file theo trạng thái.
+
+    sources là kết quả của local_sources / drive_sources; service_account_info khác None thì
+    nguồn là file ID trên Drive và mỗi tiến trình con tự tạo client Drive riêng.
+    full: bỏ qua checkpoint, xử lý lại tất cả.
+    """
+    checkpoint = Checkpoint(store)
+    tasks, counts = [], {"ok": 0, "invalid": 0, "error": 0, "skipped": 0}
+    for kind, files in sources.items():
+        for name, source, version, size in files:
+            period = file_period(kind, name)
+            if not period or period[0] < since or (until and period[0] > until):
+                continue
+            key = f"{kind}/{name}"
+            if not full and checkpoint.done(key, version, store):
+                counts["skipped"] += 1
+                continue
+            tasks.append((size, (key, kind, name, source, version, store)))
+    # File lớn trước để các tiến trình xong gần cùng lúc
+    tasks = [task for _, task in sorted(tasks, key=lambda t: t[0], reverse=True)]
+
+    with metrics.section("backfill") as run:
+        if tasks:
+            # spawn: tiến trình con không thừa hưởng luồng / khóa của tiến trình cha
+            with ProcessPoolExecutor(max(1, min(workers, len(tasks))), mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=_init_worker, initargs=(service_account_info,)) as pool:
+                for future in as_completed([pool.submit(process_file, task) for task in tasks]):
+                    key, entry = future.result()
+                    checkpoint.update(key, entry)
+                    counts[entry["status"]] += 1
+                    if entry["status"] != "ok":
+                        logger.warning("%s: %s (%s)", key, entry["error"], entry["status"])
+    logger.info("Backfill %s: %s, %.1fs", store, counts, run.seconds)
+    return counts
+
+
+def read_store(kind, years=None, store=STORE_DIR):
+    """Bảng đã chuẩn hóa của loại kind (các năm years, None = tất cả) từ kho, sắp theo năm / tháng."""
+    root = os.path.join(store, kind)
+    frames = []
+    for year in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+        if years is None or int(year) in years:
+            folder = os.path.join(root, year)
+            frames += [pd.read_parquet(os.path.join(folder, name)) for name in sorted(os.listdir(folder)) if name.endswith(".parquet")]
+    return concat_compact(frames)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Nạp workbook lịch sử vào kho Parquet cục bộ (song song nhiều tiến trình, chạy lại được).")
+    parser.add_argument("--since", type=int, default=SINCE_YEAR, help="năm đầu tiên cần nạp")
+    parser.add_argument("--until", type=int, help="năm cuối cùng (mặc định: tất cả)")
+    parser.add_argument("--local", help="đọc từ thư mục cục bộ có các thư mục con tba / ha / trung / dy / dv thay cho Drive")
+    parser.add_argument("--kinds", nargs="+", choices=list(KINDS), default=list(KINDS))
+    parser.add_argument("--store", default=STORE_DIR, help="thư mục kho Parquet và checkpoint")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="số tiến trình đọc file")
+    parser.add_argument("--full", action="store_true", help="bỏ qua checkpoint, nạp lại tất cả")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.local:
+        sources, info = local_sources(args.local), None
+    else:
+        from drive_client import DriveClientPool, load_service_account_info
+
+        info = load_service_account_info()
+        sources = drive_sources(DriveClientPool(info).client)
+    sources = {kind: files for kind, files in sources.items() if kind in args.kinds}
+
+    counts = backfill(sources, args.store, args.since, args.until, args.workers, info, args.full)
+    print(", ".join(f"{status}: {n}" for status, n in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
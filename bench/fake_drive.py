@@ -0,0 +1,123 @@
+"""Google Drive giả chạy cục bộ cho benchmark: files().list, get_media và changes API với độ trễ cấu hình được.
+
+FakeHttp đóng vai transport httplib2 nên client Drive thật (googleapiclient, discovery tĩnh)
+và MediaIoBaseDownload chạy nguyên vẹn; chỉ phần mạng được thay bằng dữ liệu trong bộ nhớ.
+"""
+import json
+import re
+import threading
+import time
+from collections import Counter
+from urllib.parse import parse_qs, urlsplit
+
+import httplib2
+from googleapiclient.discovery import build_from_document
+
+from config import XLSX_MIME
+from drive_client import DriveClientPool, drive_discovery
+
+
+class FakeDriveStore:
+    """Các thư mục và file Excel trong bộ nhớ, đếm số lần gọi theo loại request."""
+
+    def __init__(self, latency=0.0, bandwidth=None, modified_time="2026-01-01T00:00:00.000Z"):
+        self.latency = latency          # giây cho mỗi request
+        self.bandwidth = bandwidth      # byte/giây khi tải file, None = không giới hạn
+        self.modified_time = modified_time
+        self.calls = Counter()
+        self._files = {}                # id -> (tên, thư mục, bytes)
+        self._lock = threading.Lock()
+
+    def add(self, folder_id, name, content):
+        with self._lock:
+            file_id = f"fake{len(self._files):06d}"
+            self._files[file_id] = (name, folder_id, content)
+            return file_id
+
+    def without(self, folder_id):
+        """Bản sao của kho (cùng độ trễ, băng thông) bỏ hết các file trong thư mục folder_id."""
+        copy = FakeDriveStore(self.latency, self.bandwidth, self.modified_time)
+        with self._lock:
+            copy._files = {fid: entry for fid, entry in self._files.items() if entry[1] != folder_id}
+        return copy
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls.clear()
+
+    def _count(self, kind):
+        with self._lock:
+            self.calls[kind] += 1
+
+    def list(self, params):
+        self._count("list")
+        folder_id = re.search(r"'([^']+)' in parents", params["q"][0]).group(1)
+        page_size = int(params.get("pageSize", ["100"])[0])
+        offset = int(params.get("pageToken", ["0"])[0])
+        with self._lock:
+            entries = [(fid, name, len(data)) for fid, (name, parent, data) in self._files.items() if parent == folder_id]
+        page = entries[offset:offset + page_size]
+        result = {
+            "files": [
+                {"id": fid, "name": name, "mimeType": XLSX_MIME, "parents": [folder_id], "modifiedTime": self.modified_time, "size": str(size), "trashed": False}
+                for fid, name, size in page
+            ]
+        }
+        if offset + page_size < len(entries):
+            result["nextPageToken"] = str(offset + page_size)
+        return result
+
+    def media(self, file_id, headers):
+        self._count("media")
+        with self._lock:
+            data = self._files[file_id][2]
+        start, end = 0, len(data) - 1
+        m = re.match(r"bytes=(\d+)-(\d+)", headers.get("range", ""))
+        if m:
+            start, end = int(m.group(1)), min(int(m.group(2)), len(data) - 1)
+        chunk = data[start:end + 1]
+        if self.bandwidth:
+            time.sleep(len(chunk) / self.bandwidth)
+        return chunk, f"bytes {start}-{end}/{len(data)}"
+
+
+class FakeHttp:
+    """Thay cho httplib2.Http: định tuyến request của client Drive v3 tới FakeDriveStore."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        if self.store.latency:
+            time.sleep(self.store.latency)
+        url = urlsplit(uri)
+        params = parse_qs(url.query)
+        path = url.path.split("/drive/v3/", 1)[1]
+        if path == "files":
+            return self._json(self.store.list(params))
+        if path == "changes/startPageToken":
+            self.store._count("changes")
+            return self._json({"startPageToken": "1"})
+        if path == "changes":
+            # Dữ liệu giả không thay đổi trong lúc chạy benchmark
+            self.store._count("changes")
+            return self._json({"changes": [], "newStartPageToken": params.get("pageToken", ["1"])[0]})
+        if path.startswith("files/") and params.get("alt") == ["media"]:
+            content, content_range = self.store.media(path.split("/", 1)[1], headers or {})
+            return httplib2.Response({"status": "206", "content-range": content_range}), content
+        return httplib2.Response({"status": "404"}), b"{}"
+
+    def _json(self, payload):
+        return httplib2.Response({"status": "200", "content-type": "application/json"}), json.dumps(payload).encode("utf-8")
+
+
+class FakeDrivePool(DriveClientPool):
+    """DriveClientPool dùng FakeHttp thay cho kết nối thật (bỏ qua thông tin service account)."""
+
+    store = None  # gán trước khi dashboard khởi tạo nhóm client
+
+    def _make_credentials(self, service_account_info):
+        return None
+
+    def _new_client(self):
+        return build_from_document(drive_discovery(), http=FakeHttp(self.store))
@@ -0,0 +1,201 @@
+"""Chạy các kịch bản benchmark của dashboard trên Google Drive giả.
+
+    python -m bench.run                                # 1k dòng TBA, 10 đường dây, trễ 50 ms
+    python -m bench.run --tba-rows 200000 --feeders 500 --latency 0.1
+    python -m bench.run --only tba --json bench_output.json
+
+Mỗi kịch bản mở một expander với một chế độ báo cáo, chạy app.py bằng streamlit.testing
+hai lần: lần lạnh (xóa mọi cache trong bộ nhớ và trên đĩa) và lần nóng (giữ cache).
+Báo cáo thời gian, bộ nhớ đỉnh (RSS tăng thêm trong lúc chạy) và số lần gọi Drive.
+Kịch bản dy/thu-muc-rong chạy với thư mục đường dây rỗng và chỉ kiểm tra app hiện cảnh báo thay vì lỗi.
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+WORKDIR = tempfile.mkdtemp(prefix="loss-bench-")
+# Cache của dashboard nằm trong thư mục tạm riêng; tắt luồng làm nóng để số liệu ổn định
+os.environ.update({
+    "EXCEL_CACHE_DIR": os.path.join(WORKDIR, "excel"),
+    "LOSS_FACTS_PATH": os.path.join(WORKDIR, "loss_facts.parquet"),
+    "DRIVE_INDEX_PATH": os.path.join(WORKDIR, "drive_index.json"),
+    "PREFETCH_INTERVAL_SECONDS": "0",
+    "METRICS_PORT": "0",
+})
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import charts
+import disk_cache
+import drive_client
+from config import FOLDER_ID_DY
+from bench.fake_drive import FakeDrivePool, FakeDriveStore
+from bench.workbooks import generate
+
+# Bỏ các cảnh báo "missing ScriptRunContext" / "No runtime found" khi chạy app ngoài server Streamlit
+for _name in ("streamlit.runtime.scriptrunner_utils.script_run_context", "streamlit.runtime.caching.cache_data_api", "streamlit.runtime.caching.cache_resource_api"):
+    logging.getLogger(_name).disabled = True
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+YEAR = datetime.now().year
+
+
+def scenarios(month):
+    """(tên, expander, session_state) cho từng expander và chế độ báo cáo."""
+    items = [
+        ("tba/theo-thang", "exp_tba", {"tba_mode": "Theo tháng", "tba_thang_from": month}),
+        ("tba/luy-ke", "exp_tba", {"tba_mode": "Lũy kế", "tba_thang_from": 1, "tba_thang_to": month}),
+        ("tba/so-sanh-cung-ky", "exp_tba", {"tba_mode": "So sánh cùng kỳ", "tba_thang_from": month}),
+        ("tba/luy-ke-cung-ky", "exp_tba", {"tba_mode": "Lũy kế cùng kỳ", "tba_thang_from": 1, "tba_thang_to": month}),
+    ]
+    for level in ("ha", "trung", "dv"):
+        for mode, slug in (("Tháng", "thang"), ("Lũy kế", "luy-ke")):
+            items.append((f"{level}/{slug}", f"exp_{level}", {f"{level}_nam": YEAR, f"{level}_thang": month, f"{level}_loai_bc": mode}))
+    for mode, slug in (("Tháng", "thang"), ("Lũy kế", "luy-ke")):
+        items.append((f"dy/{slug}", "exp_dy", {"dy_nam": YEAR, "dy_mode": mode, "dy_cungky": True}))
+    return items
+
+
+class RssSampler:
+    """Lấy mẫu RSS của tiến trình (Linux /proc) để tính bộ nhớ đỉnh tăng thêm trong một lần chạy."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.page = resource.getpagesize()
+
+    def rss(self):
+        try:
+            with open("/proc/self/statm") as fh:
+                return int(fh.read().split()[1]) * self.page
+        except OSError:
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def __enter__(self):
+        self.base = self.peak = self.rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.rss())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.rss())
+
+    @property
+    def delta_mb(self):
+        return (self.peak - self.base) / 2 ** 20
+
+
+def reset_caches():
+    """Đưa dashboard về trạng thái khởi động lạnh: xóa cache Streamlit, ảnh biểu đồ và cache trên đĩa."""
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    for name in ("excel", "loss_facts.parquet", "drive_index.json"):
+        path = os.path.join(WORKDIR, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+    disk_cache._default = None
+    charts._default = None
+
+
+def run_once(store, expander, state):
+    at = AppTest.from_file(APP, default_timeout=1800)
+    at.secrets["google"] = {"type": "service_account"}
+    at.session_state[expander] = True
+    for key, value in state.items():
+        at.session_state[key] = value
+    store.reset_calls()
+    with RssSampler() as mem:
+        started = time.perf_counter()
+        at.run()
+        seconds = time.perf_counter() - started
+    errors = [e.message for e in at.exception] + [e.value for e in at.error]
+    warnings = [w.value for w in at.warning]
+    return {"seconds": round(seconds, 3), "peak_mb": round(mem.delta_mb, 1), "drive_calls": dict(store.calls), "errors": errors, "warnings": warnings}
+
+
+def check_empty_feeders(store):
+    """Mở phần đường dây khi thư mục đường dây không có file: phải hiện cảnh báo, không được lỗi."""
+    empty = store.without(FOLDER_ID_DY)
+    FakeDrivePool.store = empty
+    reset_caches()
+    try:
+        result = run_once(empty, "exp_dy", {})
+    finally:
+        FakeDrivePool.store = store
+        reset_caches()
+    if not any("Không có dữ liệu" in w for w in result["warnings"]):
+        result["errors"].append("Không thấy cảnh báo thiếu dữ liệu khi thư mục đường dây rỗng")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark dashboard tổn thất trên Google Drive giả.")
+    parser.add_argument("--tba-rows", type=int, default=1_000, help="số dòng mỗi file TBA")
+    parser.add_argument("--feeders", type=int, default=10, help="số đường dây mỗi file đường dây")
+    parser.add_argument("--latency", type=float, default=0.05, help="độ trễ mỗi request Drive (giây)")
+    parser.add_argument("--bandwidth", type=float, default=None, help="băng thông tải file (MB/s), mặc định không giới hạn")
+    parser.add_argument("--month", type=int, default=6, help="tháng báo cáo trong các kịch bản")
+    parser.add_argument("--only", default="", help="chỉ chạy các kịch bản có tên chứa chuỗi này")
+    parser.add_argument("--json", help="ghi kết quả ra file JSON")
+    parser.add_argument("--workbook-cache", default=os.path.join(".cache", "bench"), help="thư mục lưu workbook đã sinh ('' = không lưu)")
+    args = parser.parse_args(argv)
+
+    store = FakeDriveStore(latency=args.latency, bandwidth=args.bandwidth * 2 ** 20 if args.bandwidth else None)
+    started = time.perf_counter()
+    n = generate(store, [YEAR - 1, YEAR], tba_rows=args.tba_rows, feeders=args.feeders, cache_dir=args.workbook_cache or None)
+    print(f"Sinh {n} workbook ({args.tba_rows} dòng TBA, {args.feeders} đường dây) trong {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    # Dashboard tạo nhóm client qua drive_client.DriveClientPool: thay bằng bản dùng Drive giả
+    FakeDrivePool.store = store
+    drive_client.DriveClientPool = FakeDrivePool
+
+    results = []
+    print(f"{'kịch bản':<24}{'lạnh (s)':>10}{'nóng (s)':>10}{'RSS lạnh (MB)':>15}{'list':>6}{'media':>7}{'media nóng':>12}")
+    try:
+        for name, expander, state in scenarios(args.month):
+            if args.only and args.only not in name:
+                continue
+            reset_caches()
+            cold = run_once(store, expander, state)
+            warm = run_once(store, expander, state)
+            results.append({"scenario": name, "cold": cold, "warm": warm})
+            print(
+                f"{name:<24}{cold['seconds']:>10.2f}{warm['seconds']:>10.2f}{cold['peak_mb']:>15.1f}"
+                f"{cold['drive_calls'].get('list', 0):>6}{cold['drive_calls'].get('media', 0):>7}{warm['drive_calls'].get('media', 0):>12}"
+            )
+            for err in cold["errors"] + warm["errors"]:
+                print(f"  ! {err}", file=sys.stderr)
+        if not args.only or args.only in "dy/thu-muc-rong":
+            check = check_empty_feeders(store)
+            results.append({"scenario": "dy/thu-muc-rong", "cold": check})
+            print(f"{'dy/thu-muc-rong':<24}{check['seconds']:>10.2f}{'':>10}{check['peak_mb']:>15.1f}  {'lỗi' if check['errors'] else 'ok'}")
+            for err in check["errors"]:
+                print(f"  ! {err}", file=sys.stderr)
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+    if args.json:
+        params = {k: v for k, v in vars(args).items() if k != "json"}
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump({"params": params, "results": results}, fh, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Sinh các workbook TBA_/HA_/TA_/DV_ và đường dây giả, cùng bố cục cột với file thật.
+
+- TBA_YYYY_MM.xlsx: mỗi dòng một TBA, cột "Tên TBA" và "Tỷ lệ tổn thất" (chuỗi dấu phẩy thập phân).
+- HA_/TA_/DV_YYYY_MM.xlsx: dòng đầu có thương phẩm (cột 1), tổn thất (cột 3), tỷ lệ (cột 4).
+- Đường dây (DY_YYYY_MM.xlsx): tên đường dây (cột 1), thương phẩm (cột 2), điện tổn thất (cột 5).
+
+Workbook được ghi bằng openpyxl write-only và lưu lại theo tham số để các lần chạy sau không phải sinh lại.
+"""
+import io
+import os
+
+import numpy as np
+from openpyxl import Workbook
+
+from config import FOLDER_ID, FOLDER_ID_DY, FOLDER_ID_HA, FOLDER_ID_TOAN_DON_VI, FOLDER_ID_TRUNG
+
+TBA_HEADER = ["STT", "Tên TBA", "Công suất (kVA)", "Điện nhận", "Thương phẩm", "Điện tổn thất", "Tỷ lệ tổn thất"]
+LEVEL_HEADER = ["Chỉ tiêu", "Thương phẩm", "Điện nhận", "Điện tổn thất", "Tỷ lệ tổn thất"]
+FEEDER_HEADER = ["STT", "Đường dây", "Thương phẩm", "Điện nhận", "Số khách hàng", "Điện tổn thất"]
+
+LEVEL_FOLDERS = {"HA": FOLDER_ID_HA, "TA": FOLDER_ID_TRUNG, "DV": FOLDER_ID_TOAN_DON_VI}
+
+
+def _xlsx(header, rows):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("dữ liệu")
+    ws.append(header)
+    for row in rows:
+        ws.append(row)
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def _comma(values):
+    return [f"{v:.2f}".replace(".", ",") for v in values]
+
+
+def tba_workbook(rng, n_rows):
+    tp = rng.integers(2_000, 80_000, n_rows)
+    ty_le = np.clip(rng.gamma(2.0, 1.8, n_rows), 0, 25)
+    tt = np.round(tp * ty_le / 100)
+    nhan = tp + tt
+    kva = rng.choice([100, 160, 180, 250, 320, 400, 560], n_rows)
+    rows = zip(range(1, n_rows + 1), (f"TBA {i:06d}" for i in range(n_rows)), kva.tolist(), nhan.tolist(), tp.tolist(), tt.tolist(), _comma(ty_le))
+    return _xlsx(TBA_HEADER, rows)
+
+
+def level_workbook(rng):
+    tp = float(rng.integers(5_000_000, 20_000_000))
+    ty_le = float(rng.uniform(2, 8))
+    tt = round(tp * ty_le / 100)
+    return _xlsx(LEVEL_HEADER, [["Toàn đơn vị", f"{tp:.0f}", tp + tt, f"{tt:.0f}", f"{ty_le:.2f}".replace(".", ",")]])
+
+
+def feeder_workbook(rng, n_feeders):
+    tp = rng.integers(100_000, 3_000_000, n_feeders)
+    ty_le = rng.uniform(0.5, 6, n_feeders)
+    tt = np.round(tp * ty_le / 100)
+    names = [f"4{i // 100 % 10}{i % 100:02d}" for i in range(n_feeders)]
+    rows = zip(range(1, n_feeders + 1), names, tp.tolist(), (tp + tt).tolist(), rng.integers(50, 5000, n_feeders).tolist(), tt.tolist())
+    return _xlsx(FEEDER_HEADER, rows)
+
+
+def generate(store, years, months=range(1, 13), tba_rows=1_000, feeders=10, seed=0, cache_dir=None):
+    """Đưa các workbook giả của các năm / tháng đã cho vào FakeDriveStore, trả về số file.
+
+    cache_dir: thư mục lưu workbook đã sinh (bỏ qua nếu None).
+    """
+    count = 0
+    for year in years:
+        for month in months:
+            specs = [(FOLDER_ID, f"TBA_{year}_{month:02}.xlsx", f"tba{tba_rows}", lambda rng: tba_workbook(rng, tba_rows))]
+            specs += [(folder, f"{prefix}_{year}_{month:02}.xlsx", "level", level_workbook) for prefix, folder in LEVEL_FOLDERS.items()]
+            specs.append((FOLDER_ID_DY, f"DY_{year}_{month:02}.xlsx", f"dy{feeders}", lambda rng: feeder_workbook(rng, feeders)))
+            for k, (folder, name, variant, make) in enumerate(specs):
+                # Mỗi file một bộ sinh số riêng: nội dung không phụ thuộc file nào đã có trong cache
+                rng = np.random.default_rng([seed, year, month, k])
+                store.add(folder, name, _cached(cache_dir, f"s{seed}_{variant}_{name}", lambda: make(rng)))
+                count += 1
+    return count
+
+
+def _cached(cache_dir, key, make):
+    if not cache_dir:
+        return make()
+    path = os.path.join(cache_dir, key)
+    try:
+        with open(path, "rb") as fh:
+            return fh.read()
+    except OSError:
+        pass
+    data = make()
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path, "wb") as fh:
+        fh.write(data)
+    return data
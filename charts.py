@@ -0,0 +1,253 @@
+"""Vẽ các biểu đồ tổn thất bằng matplotlib và cache ảnh đã mã hóa theo dữ liệu + tùy chọn.
+
+matplotlib và pandas chỉ được nạp khi vẽ / băm dữ liệu lần đầu, để dashboard khởi động nhanh.
+"""
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from metrics import stage
+
+CHART_CACHE_SIZE = int(os.environ.get("CHART_CACHE_SIZE", "256"))
+# Độ rộng hiển thị mặc định (px) và độ phân giải ảnh xuất file
+TARGET_WIDTH = int(os.environ.get("CHART_TARGET_WIDTH", "1200"))
+EXPORT_DPI = int(os.environ.get("CHART_EXPORT_DPI", "600"))
+MIN_DPI = 50
+
+# Tiêu đề biểu đồ tỷ lệ tổn thất theo cấp báo cáo (dùng chung cho dashboard và làm nóng cache)
+LOSS_TREND_TITLES = {
+    "ha": "Biểu đồ tỷ lệ tổn thất hạ thế",
+    "trung": "Biểu đồ tỷ lệ tổn thất trung thế",
+    "dv": "Biểu đồ tỷ lệ tổn thất toàn đơn vị",
+}
+
+COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728'] # Màu sắc cho các cột
+
+
+def _pyplot():
+    """matplotlib.pyplot với backend Agg (không cần màn hình), nạp ở lần vẽ đầu tiên."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def draw_tba_threshold(pivot_df, pie_data):
+    """Biểu đồ cột số lượng TBA theo ngưỡng và biểu đồ tròn tỷ trọng."""
+    # Độ phân giải do FigureCache.render quyết định khi xuất ảnh
+    plt = _pyplot()
+    fig, (ax_bar, ax_pie) = plt.subplots(1, 2, figsize=(10, 4))
+
+    # Biểu đồ cột
+    x = range(len(pivot_df))
+    width = 0.35
+    colors = COLORS
+    for i, col in enumerate(pivot_df.columns):
+        offset = (i - (len(pivot_df.columns)-1)/2) * width
+        bars = ax_bar.bar([xi + offset for xi in x], pivot_df[col], width, label=col, color=colors[i % len(colors)])
+        for bar in bars:
+            height = bar.get_height()
+            if height > 0:
+                # Adjusted fontsize for bar value labels
+                ax_bar.text(bar.get_x() + bar.get_width()/2, height + 0.5, f'{int(height)}', ha='center', va='bottom', fontsize=7, fontweight='bold', color='black')
+
+    # Adjusted fontsize for y-axis label
+    ax_bar.set_ylabel("Số lượng", fontsize=8)
+    # Adjusted fontsize and weight for title
+    ax_bar.set_title("Số lượng TBA theo ngưỡng tổn thất", fontsize=10, weight='bold')
+    ax_bar.set_xticks(list(x))
+    # Adjusted fontsize for x-axis tick labels
+    ax_bar.set_xticklabels(pivot_df.index, fontsize=7)
+    # Adjusted fontsize for y-axis tick labels
+    ax_bar.tick_params(axis='y', labelsize=7)
+    # Adjusted fontsize for legend
+    ax_bar.legend(title="Kỳ", fontsize=7)
+    # Adjusted gridline properties
+    ax_bar.grid(axis='y', linestyle='--', linewidth=0.7, alpha=0.6)
+
+    # Biểu đồ tròn (Tỷ trọng)
+    if pie_data.sum() > 0:
+        wedges, texts, autotexts = ax_pie.pie(
+            pie_data,
+            labels=pivot_df.index,
+            autopct='%1.1f%%',
+            startangle=90,
+            colors=colors,
+            pctdistance=0.75,
+            wedgeprops={'width': 0.3, 'edgecolor': 'w'}
+        )
+
+        for text in texts:
+            # Adjusted fontsize for pie chart labels
+            text.set_fontsize(6)
+            text.set_fontweight('bold')
+        for autotext in autotexts:
+            autotext.set_color('black')
+            # Adjusted fontsize for autopct values
+            autotext.set_fontsize(6)
+            autotext.set_fontweight('bold')
+
+        # Adjusted fontsize for total TBA text
+        ax_pie.text(0, 0, f"Tổng số TBA\\n{pie_data.sum()}", ha='center', va='center', fontsize=7, fontweight='bold', color='black')
+        # Adjusted fontsize and weight for pie chart title
+        ax_pie.set_title("Tỷ trọng TBA theo ngưỡng tổn thất", fontsize=10, weight='bold')
+    else:
+        # Adjusted fontsize for no data text
+        ax_pie.text(0.5, 0.5, "Không có dữ liệu tỷ trọng phù hợp", horizontalalignment='center', verticalalignment='center', transform=ax_pie.transAxes, fontsize=8)
+        # Adjusted fontsize and weight for pie chart title
+        ax_pie.set_title("Tỷ trọng TBA theo ngưỡng tổn thất", fontsize=10, weight='bold')
+
+    return fig
+
+
+def draw_loss_trend(df_th, df_ck, title):
+    """Biểu đồ đường tỷ lệ tổn thất 12 tháng: Thực hiện và Cùng kỳ (hạ thế, trung thế, toàn đơn vị)."""
+    months = list(range(1, 13))
+    fig, ax = _pyplot().subplots(figsize=(6, 3))
+
+    ax.plot(df_th["Tháng"], df_th["Tỷ lệ"], color='#1f77b4', label='Thực hiện', linewidth=1, markersize=3, marker='o')
+    if df_ck["Tỷ lệ"].notna().any():
+        ax.plot(df_ck["Tháng"], df_ck["Tỷ lệ"], color='#ff7f0e', label='Cùng kỳ', linewidth=1, markersize=3, marker='o')
+
+    for i, v in df_th.dropna(subset=["Tỷ lệ"]).iterrows():
+        ax.text(v["Tháng"], v["Tỷ lệ"] + 0.05, f"{v['Tỷ lệ']:.2f}", ha='center', fontsize=6, color='black')
+
+    if df_ck["Tỷ lệ"].notna().any():
+        for i, v in df_ck.dropna(subset=["Tỷ lệ"]).iterrows():
+            ax.text(v["Tháng"], v["Tỷ lệ"] + 0.05, f"{v['Tỷ lệ']:.2f}", ha='center', fontsize=6, color='black')
+
+    ax.set_ylabel("Tỷ lệ (%)", fontsize=7, color='black')
+    ax.set_xlabel("Tháng", fontsize=7, color='black')
+    ax.set_xticks(months)
+    ax.tick_params(axis='both', colors='black', labelsize=6)
+    ax.grid(True, linestyle='--', linewidth=0.5, alpha=0.7)
+    ax.set_title(title, fontsize=9, color='black')
+    ax.legend(fontsize=7, frameon=False)
+
+    return fig
+
+
+def draw_feeder(pivot_df, dd, selected_year, chart_type):
+    """Biểu đồ tỷ lệ tổn thất theo tháng của một đường dây (cột hoặc đường)."""
+    import pandas as pd
+
+    fig, ax = _pyplot().subplots(figsize=(10, 4))
+
+    if chart_type == "Cột":
+        pivot_df.plot(kind="bar", ax=ax)
+        ax.set_xticklabels(pivot_df.index, rotation=0, ha='center') # Changed rotation to 0, ha='center'
+        ax.tick_params(axis='y', labelrotation=0) # Ensure y-axis labels are not rotated
+        for container in ax.containers:
+            for bar in container:
+                height = bar.get_height()
+                if height > 0:
+                    ax.text(bar.get_x() + bar.get_width()/2, height + 0.2, f"{height:.2f}", ha='center', fontsize=7)
+    else:
+        for col in pivot_df.columns:
+            valid_data = pivot_df[col].replace(0, pd.NA).dropna()
+            ax.plot(valid_data.index, valid_data.values, marker='o', label=col)
+            for x, y in zip(valid_data.index, valid_data.values):
+                ax.text(x, y + 0.2, f"{y:.2f}", ha='center', fontsize=7)
+        ax.set_xticks(range(1, 13))
+        ax.set_xticklabels(range(1, 13), rotation=0, ha='center') # Changed rotation to 0, ha='center'
+        ax.tick_params(axis='y', labelrotation=0) # Ensure y-axis labels are not rotated
+
+    ax.set_xlabel("Tháng")
+    ax.set_ylabel("Tổn thất (%)")
+    ax.set_title(f"Đường dây {dd} - Năm {selected_year}")
+    ax.legend()
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+
+    return fig
+
+
+def dpi_for_width(fig_width_in, target_px):
+    """Chọn DPI để ảnh raster rộng khoảng target_px điểm ảnh (không vượt EXPORT_DPI)."""
+    return max(MIN_DPI, min(EXPORT_DPI, round(target_px / fig_width_in)))
+
+
+def data_hash(*objs):
+    """Băm nội dung các DataFrame/Series (cả index và tên cột) cùng các giá trị khác."""
+    import pandas as pd
+
+    h = hashlib.sha1()
+    for obj in objs:
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            h.update(repr(list(obj.columns) if isinstance(obj, pd.DataFrame) else obj.name).encode("utf-8"))
+            h.update(repr(list(obj.index)).encode("utf-8"))
+            h.update(pd.util.hash_pandas_object(obj, index=False).to_numpy().tobytes())
+        else:
+            h.update(repr(obj).encode("utf-8"))
+        h.update(b"|")
+    return h.hexdigest()
+
+
+class FigureCache:
+    """Cache LRU các ảnh biểu đồ đã mã hóa (PNG/SVG), khóa theo hàm vẽ + dữ liệu + tùy chọn."""
+
+    def __init__(self, max_items=CHART_CACHE_SIZE):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        # pyplot không an toàn đa luồng: mỗi lần chỉ vẽ một hình
+        self._draw_lock = threading.Lock()
+
+    def render(self, draw, *data, fmt="png", dpi=None, target_width=None, **options):
+        """Trả về bytes ảnh của draw(*data, **options); lần gọi lại với cùng dữ liệu không chạm đến matplotlib.
+
+        fmt="svg" cho ảnh vector (không phụ thuộc DPI). Với ảnh raster, dpi cố định độ phân giải
+        (dùng khi xuất file); nếu không, DPI được chọn theo target_width (px) của vùng hiển thị.
+        fmt="plotly": draw dựng hình plotly (charts_plotly), cache giữ nguyên đối tượng hình.
+        """
+        if fmt in ("svg", "plotly"):
+            dpi = target_width = None
+        elif dpi is not None:
+            target_width = None
+        else:
+            target_width = target_width or TARGET_WIDTH
+        with stage("render") as m:
+            key = (draw.__name__, fmt, dpi, target_width, data_hash(*data, sorted(options.items())))
+            with self._lock:
+                if key in self._items:
+                    self._items.move_to_end(key)
+                    m["cache"] = "hit"
+                    return self._items[key]
+
+            m["cache"] = "miss"
+            if fmt == "plotly":
+                image = draw(*data, **options)
+            else:
+                image = self._encode(draw, data, options, fmt, dpi, target_width)
+
+        with self._lock:
+            self._items[key] = image
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return image
+
+    def _encode(self, draw, data, options, fmt, dpi, target_width):
+        """Vẽ bằng matplotlib rồi mã hóa PNG/SVG."""
+        with self._draw_lock:
+            fig = draw(*data, **options)
+            try:
+                if target_width:
+                    dpi = dpi_for_width(fig.get_figwidth(), target_width)
+                buf = io.BytesIO()
+                fig.savefig(buf, format=fmt, dpi=dpi or "figure", bbox_inches="tight")
+            finally:
+                _pyplot().close(fig)
+        return buf.getvalue()
+
+
+_default = None
+
+
+def get_figure_cache():
+    """Cache ảnh biểu đồ dùng chung trong tiến trình."""
+    global _default
+    if _default is None:
+        _default = FigureCache()
+    return _default
@@ -0,0 +1,147 @@
+"""Biểu đồ tổn thất tương tác (plotly): đổi kiểu biểu đồ, ẩn/hiện cùng kỳ và làm nổi ngưỡng ngay trên trình duyệt.
+
+Dữ liệu đã tổng hợp được gửi một lần cùng hình; các nút trong hình (updatemenus) chỉ gọi
+restyle phía trình duyệt nên không chạy lại script Streamlit.
+"""
+import math
+
+import plotly.graph_objects as go
+
+from charts import COLORS
+
+DIM_OPACITY = 0.25
+BUTTON_STYLE = {"type": "buttons", "direction": "right", "showactive": True, "yanchor": "bottom", "y": 1.12, "pad": {"r": 6, "t": 0}}
+
+
+def _values(series, zero_as_gap=False):
+    """Danh sách số cho plotly: NaN (và 0 khi vẽ đường) thành None."""
+    return [None if v is None or (isinstance(v, float) and math.isnan(v)) or (zero_as_gap and v == 0) else float(v) for v in series]
+
+
+def _labels(values):
+    return [f"{v:.2f}" if v is not None else "" for v in values]
+
+
+def _highlight(labels, target):
+    """(độ mờ từng cột, độ tách từng lát bánh) khi làm nổi ngưỡng target ("(All)" = không làm nổi)."""
+    opacity = [1.0 if target in ("(All)", lab) else DIM_OPACITY for lab in labels]
+    pull = [0.08 if lab == target else 0 for lab in labels]
+    return opacity, pull
+
+
+def tba_threshold_figure(pivot_df, pie_data, highlight="(All)"):
+    """Cột số lượng TBA theo ngưỡng x Kỳ và vành khuyên tỷ trọng; nút chọn ngưỡng để làm nổi."""
+    labels = [str(i) for i in pivot_df.index]
+    opacity, pull = _highlight(labels, highlight)
+    total = int(pie_data.sum())
+
+    fig = go.Figure()
+    for i, col in enumerate(pivot_df.columns):
+        fig.add_trace(go.Bar(
+            x=labels, y=pivot_df[col].tolist(), name=str(col), text=pivot_df[col].tolist(), textposition="outside",
+            marker={"color": COLORS[i % len(COLORS)], "opacity": opacity},
+        ))
+    if total > 0:
+        fig.add_trace(go.Pie(
+            labels=labels, values=pie_data.tolist(), hole=0.7, sort=False, direction="clockwise", pull=pull,
+            marker={"colors": COLORS}, textinfo="label+percent", showlegend=False, domain={"x": [0.62, 1.0]},
+        ))
+
+    # Mỗi mục của danh sách chọn đặt lại độ mờ cột và độ tách lát bánh (cột: các trace Bar, bánh: trace cuối)
+    n_bar = len(pivot_df.columns)
+    options = ["(All)"] + labels
+    buttons = []
+    for o in options:
+        o_opacity, o_pull = _highlight(labels, o)
+        args = {"marker.opacity": [o_opacity] * n_bar + ([None] if total > 0 else [])}
+        if total > 0:
+            args["pull"] = [None] * n_bar + [o_pull]
+        buttons.append({"label": f"Ngưỡng: {o}", "method": "restyle", "args": [args]})
+
+    fig.update_layout(
+        xaxis={"domain": [0, 0.55]},
+        yaxis={"title": "Số lượng", "gridcolor": "rgba(0,0,0,0.15)", "griddash": "dash"},
+        legend={"title": "Kỳ", "x": 0.45, "y": 1},
+        barmode="group",
+        margin={"t": 90},
+        title={"text": "Số lượng và tỷ trọng TBA theo ngưỡng tổn thất", "font": {"size": 14}},
+        annotations=[{"text": f"Tổng số TBA<br>{total}", "x": 0.81, "y": 0.5, "xref": "paper", "yref": "paper", "showarrow": False}] if total > 0 else [],
+        updatemenus=[{
+            "type": "dropdown", "x": 0, "xanchor": "left", "y": 1.12, "yanchor": "bottom",
+            "active": options.index(highlight) if highlight in options else 0, "buttons": buttons,
+        }],
+    )
+    return fig
+
+
+def loss_trend_figure(df_th, df_ck, title):
+    """Đường tỷ lệ tổn thất 12 tháng: Thực hiện và Cùng kỳ (bấm chú thích để ẩn/hiện)."""
+    fig = go.Figure()
+    for df, name, color in ((df_th, "Thực hiện", COLORS[0]), (df_ck, "Cùng kỳ", COLORS[1])):
+        y = _values(df["Tỷ lệ"])
+        if any(v is not None for v in y):
+            fig.add_trace(go.Scatter(
+                x=df["Tháng"].tolist(), y=y, name=name, mode="lines+markers+text", line={"color": color, "width": 1.5},
+                text=_labels(y), textposition="top center", textfont={"size": 10}, connectgaps=False,
+            ))
+    fig.update_layout(
+        title={"text": title, "font": {"size": 14}},
+        xaxis={"title": "Tháng", "tickmode": "array", "tickvals": list(range(1, 13)), "range": [0.5, 12.5]},
+        yaxis={"title": "Tỷ lệ (%)", "gridcolor": "rgba(0,0,0,0.15)", "griddash": "dash"},
+        legend={"orientation": "h", "y": -0.2},
+    )
+    return fig
+
+
+def feeder_figure(pivot_df, dd, selected_year, chart_type="Cột", show_cungky=True):
+    """Tỷ lệ tổn thất theo tháng của một đường dây; nút đổi Cột / Đường line và ẩn/hiện Cùng kỳ.
+
+    pivot_df là bảng Tháng x Kỳ từ feeder_charts. Cả hai kiểu đều nằm sẵn trong hình
+    (chế độ đường bỏ các tháng bằng 0 như bản matplotlib).
+    """
+    columns = [str(c) for c in pivot_df.columns]
+    bar_y = [_values(pivot_df[c]) for c in pivot_df.columns]
+    line_y = [_values(pivot_df[c], zero_as_gap=True) for c in pivot_df.columns]
+    as_bar = chart_type == "Cột"
+
+    fig = go.Figure()
+    for i, col in enumerate(columns):
+        y = bar_y[i] if as_bar else line_y[i]
+        trace = go.Bar if as_bar else go.Scatter
+        extra = {"textposition": "outside"} if as_bar else {"mode": "lines+markers+text", "textposition": "top center"}
+        fig.add_trace(trace(
+            x=pivot_df.index.tolist(), y=y, name=col, text=_labels(y), marker_color=COLORS[i % len(COLORS)],
+            visible=True if show_cungky or col != "Cùng kỳ" else "legendonly", **extra,
+        ))
+
+    bar_args = {"type": "bar", "y": bar_y, "text": [_labels(y) for y in bar_y], "textposition": "outside"}
+    line_args = {"type": "scatter", "mode": "lines+markers+text", "y": line_y, "text": [_labels(y) for y in line_y], "textposition": "top center"}
+    visible_ck = [True] * len(columns)
+    hidden_ck = ["legendonly" if c == "Cùng kỳ" else True for c in columns]
+    menus = [{**BUTTON_STYLE, "x": 0, "xanchor": "left", "active": 0 if as_bar else 1, "buttons": [
+        {"label": "Cột", "method": "restyle", "args": [bar_args]},
+        {"label": "Đường line", "method": "restyle", "args": [line_args]},
+    ]}]
+    if "Cùng kỳ" in columns:
+        menus.append({**BUTTON_STYLE, "x": 1, "xanchor": "right", "active": 0 if show_cungky else 1, "buttons": [
+            {"label": "So sánh cùng kỳ", "method": "restyle", "args": [{"visible": visible_ck}]},
+            {"label": "Chỉ thực hiện", "method": "restyle", "args": [{"visible": hidden_ck}]},
+        ]})
+
+    fig.update_layout(
+        title={"text": f"Đường dây {dd} - Năm {selected_year}", "font": {"size": 14}},
+        xaxis={"title": "Tháng", "tickmode": "array", "tickvals": list(range(1, 13))},
+        yaxis={"title": "Tổn thất (%)", "gridcolor": "rgba(0,0,0,0.15)", "griddash": "dash"},
+        barmode="group",
+        margin={"t": 90},
+        updatemenus=menus,
+    )
+    return fig
+
+
+# Hình tương tác tương ứng với từng hàm vẽ matplotlib của charts.py
+FIGURES = {
+    "draw_tba_threshold": tba_threshold_figure,
+    "draw_loss_trend": loss_trend_figure,
+    "draw_feeder": feeder_figure,
+}
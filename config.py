@@ -0,0 +1,14 @@
+"""Cấu hình chung: ID các thư mục Google Drive chứa file Excel báo cáo tổn thất."""
+
+FOLDER_ID = '165Txi8IyqG50uFSFHzWidSZSG9qpsbaq' # TBA công cộng (TBA_YYYY_MM.xlsx)
+FOLDER_ID_HA = '1_rAY5T-unRyw20YwMgKuG1C0y7oq6GkK' # Hạ thế (HA_YYYY_MM.xlsx)
+FOLDER_ID_TRUNG = '1-Ph2auxlinL5Y3bxE7AeeAeYE2KDALJT' # Trung thế (TA_YYYY_MM.xlsx)
+FOLDER_ID_DY = '1ESynjLXJrw8TaF3zwlQm-BR3mFf4LIi9' # Đường dây trung thế
+FOLDER_ID_TOAN_DON_VI = '1bPmINKlAHJMWUcxonMSnuLGz9ErlPEUi' # Toàn đơn vị (DV_YYYY_MM.xlsx)
+
+# Tên ngắn của từng thư mục, dùng làm nhãn khi đo thời gian
+FOLDER_NAMES = {FOLDER_ID: "tba", FOLDER_ID_HA: "ha", FOLDER_ID_TRUNG: "trung", FOLDER_ID_DY: "dy", FOLDER_ID_TOAN_DON_VI: "dv"}
+
+ALL_FOLDER_IDS = [FOLDER_ID, FOLDER_ID_HA, FOLDER_ID_TRUNG, FOLDER_ID_DY, FOLDER_ID_TOAN_DON_VI]
+
+XLSX_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
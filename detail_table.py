@@ -0,0 +1,81 @@
+"""Chỉ mục cho bảng chi tiết lớn: lọc theo nhóm, tìm theo tên, sắp xếp và cắt trang mà không quét lại bảng.
+
+Nhóm (ngưỡng tổn thất) -> vị trí dòng và mã tên -> tên viết thường được dựng một lần khi tạo
+chỉ mục; thứ tự sắp xếp của từng cột chỉ tính khi cần rồi giữ lại. Kết quả mỗi truy vấn
+(nhóm, chuỗi tìm, cột sắp xếp) được nhớ nên đổi trang chỉ cắt mảng vị trí và lấy đúng các dòng của trang.
+"""
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+QUERY_CACHE_SIZE = 32
+
+
+class DetailIndex:
+    """Chỉ mục trên bảng df theo cột nhóm group_col và cột tên name_col."""
+
+    def __init__(self, df, name_col, group_col):
+        self.df = df.reset_index(drop=True)
+        self.name_col = name_col
+        self.group_col = group_col
+        self.groups = {label: pos for label, pos in self.df.groupby(group_col, observed=True, sort=False).indices.items()}
+        names = self.df[name_col].astype("category")
+        self._name_codes = names.cat.codes.to_numpy()
+        self._names_lower = names.cat.categories.astype(str).str.lower()
+        self._orders = {}
+        self._queries = OrderedDict()
+
+    def __len__(self):
+        return len(self.df)
+
+    def positions(self, group=None, search="", sort_by=None, ascending=True):
+        """Mảng vị trí dòng thỏa (nhóm, tên chứa search) theo thứ tự sắp xếp đã chọn."""
+        search = search.strip().lower()
+        key = (group, search, sort_by, ascending)
+        if key in self._queries:
+            self._queries.move_to_end(key)
+            return self._queries[key]
+
+        if group is not None:
+            rows = self.groups.get(group, np.empty(0, dtype=np.intp))
+        else:
+            rows = np.arange(len(self.df))
+        if search:
+            # Tìm trên danh sách tên không trùng, rồi đổi mã tên khớp thành dòng
+            matched = np.flatnonzero(self._names_lower.str.contains(search, regex=False))
+            rows = rows[np.isin(self._name_codes[rows], matched)]
+        if sort_by:
+            order = self._order(sort_by)
+            keep = np.zeros(len(self.df), dtype=bool)
+            keep[rows] = True
+            rows = order[keep[order]]
+            if not ascending:
+                rows = self._descending(sort_by, rows)
+        else:
+            rows = np.sort(rows)
+
+        self._queries[key] = rows
+        while len(self._queries) > QUERY_CACHE_SIZE:
+            self._queries.popitem(last=False)
+        return rows
+
+    def page(self, positions, page, page_size, columns=None):
+        """Các dòng của trang page (đếm từ 1), chỉ gồm các cột columns."""
+        start = (page - 1) * page_size
+        frame = self.df.iloc[positions[start:start + page_size]]
+        return frame[columns] if columns else frame
+
+    def _order(self, column):
+        """Vị trí dòng theo cột tăng dần (ổn định, ô trống cuối); cột chữ so theo thứ tự chữ cái."""
+        if column not in self._orders:
+            s = self.df[column]
+            if isinstance(s.dtype, pd.CategoricalDtype) and not s.cat.ordered:
+                s = s.cat.reorder_categories(s.cat.categories.sort_values())
+            self._orders[column] = s.sort_values(kind="stable", na_position="last").index.to_numpy()
+        return self._orders[column]
+
+    def _descending(self, column, rows):
+        """Đảo thứ tự nhưng vẫn để các ô trống ở cuối."""
+        missing = self.df[column].isna().to_numpy()[rows]
+        return np.concatenate([rows[~missing][::-1], rows[missing]])
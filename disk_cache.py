@@ -0,0 +1,217 @@
+"""Cache trên đĩa cho các sheet Excel đã đọc, lưu dạng Parquet theo (file ID, modifiedTime).
+
+Thư mục cache dùng chung cho mọi tiến trình Streamlit trên cùng máy. Khi nhiều phiên / tiến trình
+cùng cần một file chưa có trong cache, SingleFlight bảo đảm chỉ một nơi tải và đọc file,
+các nơi khác chờ rồi lấy kết quả từ cache.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ khóa giữa các luồng trong tiến trình
+    fcntl = None
+
+CACHE_DIR = os.environ.get("EXCEL_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "excel"))
+CACHE_MAX_MB = int(os.environ.get("EXCEL_CACHE_MAX_MB", "512"))
+# Thời gian tối đa (giây) chờ nơi khác tải xong cùng một file trước khi tự tải
+LOCK_TIMEOUT = float(os.environ.get("EXCEL_CACHE_LOCK_TIMEOUT", "300"))
+
+
+def _safe_name(key):
+    return re.sub(r"[^A-Za-z0-9_-]", "_", str(key))
+
+
+def _to_storable(df):
+    """Chuẩn hóa DataFrame để ghi được Parquet: tên cột dạng chuỗi, cột object không lẫn kiểu."""
+    df = df.copy()
+    df.columns = [str(c) for c in df.columns]
+    for col in df.columns:
+        s = df[col]
+        if s.dtype != object:
+            continue
+        kind = pd.api.types.infer_dtype(s, skipna=True)
+        if kind in ("integer", "floating", "mixed-integer-float", "decimal"):
+            df[col] = pd.to_numeric(s, errors="coerce")
+        elif kind not in ("string", "empty", "boolean", "datetime", "date", "bytes"):
+            # Cột lẫn số và chữ (dòng tiêu đề, ghi chú...) được lưu dạng chuỗi
+            df[col] = s.where(s.isna(), s.astype(str))
+    return df
+
+
+class SingleFlight:
+    """Khóa theo khóa chuỗi, giữa các luồng (threading.Lock) và giữa các tiến trình (fcntl.flock).
+
+    Dùng `with flight(key):` quanh phần việc chỉ nên làm một lần cho mỗi key; nơi đến sau chờ
+    cho đến khi nơi đang làm xong (tối đa timeout giây, quá hạn thì làm tiếp không khóa).
+    """
+
+    def __init__(self, lock_dir, timeout=LOCK_TIMEOUT):
+        self.lock_dir = lock_dir
+        self.timeout = timeout
+        self._guard = threading.Lock()
+        self._locks = {}  # key -> [Lock, số luồng đang giữ / chờ]
+        os.makedirs(lock_dir, exist_ok=True)
+
+    @contextmanager
+    def __call__(self, key):
+        with self._guard:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        deadline = time.monotonic() + self.timeout
+        acquired = entry[0].acquire(timeout=self.timeout)
+        try:
+            with self._file_lock(key, deadline):
+                yield
+        finally:
+            if acquired:
+                entry[0].release()
+            with self._guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+    @contextmanager
+    def _file_lock(self, key, deadline):
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(os.path.join(self.lock_dir, _safe_name(key) + ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        locked = False
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    locked = True
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        break
+                    time.sleep(0.05)
+            yield
+        finally:
+            if locked:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+
+class ParquetCache:
+    """Thư mục các file Parquet, mỗi file Drive giữ một phiên bản, giới hạn dung lượng theo LRU."""
+
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_MB * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.flight = SingleFlight(os.path.join(root, "locks"))
+
+    def _prefix(self, file_id):
+        return _safe_name(file_id)
+
+    def _version(self, modified_time):
+        return hashlib.sha1(str(modified_time).encode("utf-8")).hexdigest()[:12]
+
+    def _path(self, file_id, modified_time, variant=""):
+        name = f"{self._prefix(file_id)}__{self._version(modified_time)}"
+        if variant:
+            name += "__" + _safe_name(variant)
+        return os.path.join(self.root, name + ".parquet")
+
+    def get(self, file_id, modified_time, variant=""):
+        """Trả về DataFrame đã cache, hoặc None nếu chưa có / file trên Drive đã đổi.
+
+        variant phân biệt các cách đọc khác nhau của cùng một file (ví dụ chỉ đọc vài cột).
+        """
+        path = self._path(file_id, modified_time, variant)
+        try:
+            df = pd.read_parquet(path)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # File cache hỏng: bỏ đi để lần sau tải lại
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)  # Đánh dấu vừa dùng cho LRU
+        except OSError:
+            pass
+        return df
+
+    def get_or_load(self, file_id, modified_time, load, variant=""):
+        """Trả về bản đã cache, hoặc gọi load() (chỉ một nơi trên cả máy cho mỗi phiên bản file) rồi ghi cache.
+
+        Trả về (DataFrame, True nếu lấy từ cache).
+        """
+        df = self.get(file_id, modified_time, variant)
+        if df is not None:
+            return df, True
+        with self.flight(os.path.basename(self._path(file_id, modified_time, variant))):
+            # Nơi khác có thể vừa tải xong trong lúc chờ khóa
+            df = self.get(file_id, modified_time, variant)
+            if df is not None:
+                return df, True
+            df = load()
+            self.put(file_id, modified_time, df, variant)
+            return df, False
+
+    def put(self, file_id, modified_time, df, variant=""):
+        """Ghi DataFrame vào cache, xóa các phiên bản cũ của cùng file ID. Trả về True nếu ghi được."""
+        path = self._path(file_id, modified_time, variant)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            _to_storable(df).to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+        except Exception:
+            self._remove(tmp)
+            return False
+
+        prefix = self._prefix(file_id) + "__"
+        current = prefix + self._version(modified_time)
+        for name in os.listdir(self.root):
+            if name.startswith(prefix) and name.endswith(".parquet") and not name.startswith(current):
+                self._remove(os.path.join(self.root, name))
+        self.evict()
+        return True
+
+    def evict(self):
+        """Xóa các file ít được dùng nhất cho đến khi tổng dung lượng không vượt giới hạn."""
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.root):
+                if not name.endswith(".parquet"):
+                    continue
+                try:
+                    st_ = os.stat(os.path.join(self.root, name))
+                except OSError:
+                    continue
+                entries.append((st_.st_mtime, st_.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(os.path.join(self.root, name))
+                total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_default = None
+
+
+def get_cache():
+    """Cache dùng chung trong tiến trình (thư mục và dung lượng lấy từ biến môi trường)."""
+    global _default
+    if _default is None:
+        _default = ParquetCache()
+    return _default
@@ -0,0 +1,101 @@
+"""Nhóm client Google Drive dùng chung: một bộ credentials, mỗi client một kết nối HTTP keep-alive riêng.
+
+httplib2.Http không an toàn khi nhiều luồng dùng chung, nên mỗi luồng mượn một client
+(đối tượng service + AuthorizedHttp riêng) trong lúc gọi API rồi trả lại nhóm. Client
+được tạo dần khi cần, tối đa DRIVE_POOL_SIZE; kết nối TLS được giữ lại cho lần mượn sau.
+"""
+import functools
+import json
+import os
+import queue
+import threading
+import tomllib
+from contextlib import contextmanager
+
+import httplib2
+from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+
+# Số client tối đa, timeout (giây) cho mỗi request HTTP và thời gian chờ mượn client
+POOL_SIZE = int(os.environ.get("DRIVE_POOL_SIZE", "8"))
+HTTP_TIMEOUT = float(os.environ.get("DRIVE_HTTP_TIMEOUT", "60"))
+ACQUIRE_TIMEOUT = float(os.environ.get("DRIVE_POOL_ACQUIRE_TIMEOUT", "120"))
+
+SCOPES = ["https://www.googleapis.com/auth/drive.readonly"] # Chỉ cần quyền đọc
+
+SECRETS_PATH = os.environ.get("STREAMLIT_SECRETS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".streamlit", "secrets.toml"))
+
+
+def load_service_account_info():
+    """Đọc thông tin service account khi chạy ngoài Streamlit (CLI, tiến trình nền).
+
+    Ưu tiên biến môi trường GOOGLE_SERVICE_ACCOUNT_JSON (nội dung JSON hoặc đường dẫn file JSON),
+    sau đó mục [google] trong secrets.toml của Streamlit.
+    """
+    raw = os.environ.get("GOOGLE_SERVICE_ACCOUNT_JSON")
+    if raw:
+        if raw.lstrip().startswith("{"):
+            return json.loads(raw)
+        with open(raw, encoding="utf-8") as fh:
+            return json.load(fh)
+    try:
+        with open(SECRETS_PATH, "rb") as fh:
+            return tomllib.load(fh)["google"]
+    except (OSError, KeyError) as e:
+        raise RuntimeError(f"Không tìm thấy thông tin service account (GOOGLE_SERVICE_ACCOUNT_JSON hoặc [google] trong {SECRETS_PATH})") from e
+
+
+@functools.lru_cache(maxsize=None)
+def drive_discovery():
+    """Tài liệu discovery Drive v3 đóng gói sẵn trong google-api-python-client: tạo client không cần mạng.
+
+    Giữ dạng chuỗi vì build_from_document sửa trực tiếp dict đã phân tích, mỗi client phải có bản riêng.
+    """
+    doc = discovery_cache.get_static_doc("drive", "v3")
+    if doc is None:
+        raise RuntimeError("google-api-python-client không có tài liệu discovery tĩnh cho Drive v3 (cần bản >= 2.0)")
+    return doc
+
+
+class DriveClientPool:
+    """Nhóm client Drive v3 an toàn đa luồng, dùng qua `with pool.client() as service:`."""
+
+    def __init__(self, service_account_info, size=POOL_SIZE, http_timeout=HTTP_TIMEOUT, acquire_timeout=ACQUIRE_TIMEOUT):
+        self.credentials = self._make_credentials(service_account_info)
+        self.size = max(1, size)
+        self.http_timeout = http_timeout
+        self.acquire_timeout = acquire_timeout
+        self._idle = queue.LifoQueue()  # LIFO: ưu tiên client vừa dùng, kết nối còn "nóng"
+        self._slots = threading.BoundedSemaphore(self.size)
+
+    def _make_credentials(self, service_account_info):
+        return service_account.Credentials.from_service_account_info(dict(service_account_info), scopes=SCOPES)
+
+    def _new_client(self):
+        http = AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=self.http_timeout))
+        return build_from_document(drive_discovery(), http=http)
+
+    @contextmanager
+    def client(self):
+        """Mượn một client cho luồng hiện tại; client lỗi kết nối bị bỏ, lần sau tạo mới."""
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError(f"Không mượn được Drive client sau {self.acquire_timeout:g} giây")
+        try:
+            try:
+                service = self._idle.get_nowait()
+            except queue.Empty:
+                service = self._new_client()
+            broken = False
+            try:
+                yield service
+            except (OSError, httplib2.HttpLib2Error):
+                # Lỗi mạng: kết nối có thể ở trạng thái dở dang, không trả client này về nhóm
+                broken = True
+                raise
+            finally:
+                if not broken:
+                    self._idle.put(service)
+        finally:
+            self._slots.release()
@@ -0,0 +1,142 @@
+"""Tải song song nhiều file từ Google Drive với thread pool giới hạn, timeout và retry."""
+import contextvars
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
+from googleapiclient.http import MediaIoBaseDownload
+
+from disk_cache import get_cache
+from excel_reader import read_sheet
+from loss_calc import compact_frame
+from metrics import record, stage
+
+# Số luồng tải đồng thời, timeout (giây) cho mỗi lần tải một file, số lần thử lại
+MAX_WORKERS = int(os.environ.get("DRIVE_FETCH_WORKERS", "8"))
+FILE_TIMEOUT = float(os.environ.get("DRIVE_FETCH_TIMEOUT", "60"))
+RETRIES = int(os.environ.get("DRIVE_FETCH_RETRIES", "2"))
+BACKOFF = float(os.environ.get("DRIVE_FETCH_BACKOFF", "0.5"))
+
+
+class FetchTimeout(Exception):
+    """Một lần tải vượt quá thời gian cho phép."""
+
+
+def fetch_many(keys, fetch_one, max_workers=MAX_WORKERS, timeout=FILE_TIMEOUT, retries=RETRIES, backoff=BACKOFF):
+    """Gọi fetch_one(key) song song cho từng key, trả về (results, errors).
+
+    results có cùng thứ tự với keys; key None hoặc key lỗi sau khi hết số lần thử
+    cho kết quả None, lỗi cuối cùng được ghi trong errors[key]. Key trùng chỉ tải một lần.
+    Mỗi lần tải chạy quá timeout giây (tính từ lúc gửi) bị bỏ và thử lại ngay trên luồng khác,
+    nên một key chờ tối đa khoảng (retries + 1) * timeout giây cộng thời gian chờ giữa các lần thử.
+    """
+    keys = list(keys)
+    unique = list(dict.fromkeys(k for k in keys if k is not None))
+    done_results, errors = {}, {}
+    if not unique:
+        return [None] * len(keys), errors
+
+    limit = max(1, min(max_workers, len(unique)))
+    queued = [(key, 0) for key in unique]   # (key, attempt) chờ chỗ trống
+    pending = {}   # future -> (key, attempt, thời điểm gửi)
+    delayed = []   # (thời điểm được thử lại, key, attempt)
+    # Lần tải bị bỏ vì quá giờ vẫn giữ luồng của nó đến khi tự kết thúc: dành thêm luồng
+    # để lần thử lại chạy ngay thay vì xếp hàng sau lần tải đang treo
+    executor = ThreadPoolExecutor(max_workers=limit * (retries + 1), thread_name_prefix="drive-fetch")
+
+    def fill():
+        # Tối đa limit lần tải đang được chờ cùng lúc; lần thử lại đứng đầu hàng
+        while queued and len(pending) < limit:
+            key, attempt = queued.pop(0)
+            # Mang theo context (phần phân tích đang đo thời gian) sang luồng tải
+            future = executor.submit(contextvars.copy_context().run, fetch_one, key)
+            pending[future] = (key, attempt, time.monotonic())
+
+    def fail(key, attempt, exc):
+        if attempt < retries:
+            delayed.append((time.monotonic() + backoff * (2 ** attempt), key, attempt + 1))
+        else:
+            errors[key] = exc
+
+    try:
+        while queued or pending or delayed:
+            now = time.monotonic()
+            for item in [d for d in delayed if d[0] <= now]:
+                delayed.remove(item)
+                queued.insert(0, item[1:])
+            fill()
+
+            wait(list(pending), timeout=0.05 if delayed else 0.2, return_when=FIRST_COMPLETED)
+
+            now = time.monotonic()
+            for fut in list(pending):
+                key, attempt, sent = pending[fut]
+                if fut.done():
+                    del pending[fut]
+                    exc = fut.exception()
+                    if exc is None:
+                        done_results[key] = fut.result()
+                    else:
+                        fail(key, attempt, exc)
+                elif timeout and now - sent > timeout:
+                    # Không thể ngắt luồng đang chạy: bỏ kết quả của lần tải này và thử lại
+                    del pending[fut]
+                    fut.cancel()
+                    fail(key, attempt, FetchTimeout(f"Quá {timeout:g}s khi tải {key}"))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return [done_results.get(k) if k is not None else None for k in keys], errors
+
+
+def _as_tuple(cols):
+    return tuple(cols) if cols is not None else None
+
+
+def load_sheet(client, file_id, modified_time=None, usecols=None, nrows=None, numeric_cols=None, compact=False, cache=None):
+    """Đọc sheet đầu của một file Excel trên Drive, qua cache trên đĩa; ném lỗi nếu tải / đọc lỗi.
+
+    client() trả về context manager cho một Drive service (xem DriveClientPool.client).
+    Cache trên đĩa khóa theo (file_id, modified_time) nên file được tải lên lại sẽ được đọc mới;
+    nhiều nơi cùng đọc một file chưa có trong cache thì chỉ một nơi tải (ParquetCache.get_or_load).
+    usecols / nrows / numeric_cols: chỉ đọc các cột, số dòng cần dùng (xem excel_reader.read_sheet).
+    compact: thu gọn kiểu dữ liệu trước khi cache (xem loss_calc.compact_frame).
+    """
+    cache = cache or get_cache()
+    usecols, numeric_cols = _as_tuple(usecols), _as_tuple(numeric_cols)
+    projected = usecols is not None or nrows is not None
+    variant = f"c{usecols}_n{nrows}_f{numeric_cols}" if projected else ""
+    if compact:
+        # "m": chỉ các cột số liệu được đổi sang số (bản cache cũ đổi cả cột mã)
+        variant += "_compact_m"
+
+    def load():
+        with stage("download") as m:
+            m["cache"] = "miss"
+            fh = io.BytesIO()
+            with client() as service:
+                request = service.files().get_media(fileId=file_id)
+                downloader = MediaIoBaseDownload(fh, request)
+                done = False
+                while not done:
+                    status, done = downloader.next_chunk()
+            m["bytes"] = fh.tell()
+        fh.seek(0)
+        with stage("read_excel") as m:
+            if projected:
+                df = read_sheet(fh, usecols=usecols, nrows=nrows, numeric_cols=numeric_cols)
+            else:
+                df = pd.read_excel(fh, sheet_name=0)
+            m["rows"] = len(df)
+        return compact_frame(df) if compact else df
+
+    if not modified_time:
+        return load()
+    # Một lần tải cho mỗi phiên bản file trên cả máy: các luồng / tiến trình khác chờ rồi đọc cache
+    started = time.perf_counter()
+    df, hit = cache.get_or_load(file_id, modified_time, load, variant)
+    if hit:
+        record("download", time.perf_counter() - started, rows=len(df), cache="hit")
+    return df
@@ -0,0 +1,81 @@
+"""Đọc sheet Excel theo cột và số dòng cần dùng, không dựng DataFrame cho toàn bộ sheet."""
+from importlib.util import find_spec
+
+import pandas as pd
+
+from loss_calc import to_number
+
+# Engine calamine của pandas nhanh hơn openpyxl, dùng khi có cài python-calamine
+HAS_CALAMINE = find_spec("python_calamine") is not None
+
+
+def _header_names(values):
+    """Đặt tên cột giống pandas: ô trống -> 'Unnamed: i', tên trùng -> 'tên.1', 'tên.2'..."""
+    names, seen = [], {}
+    for i, v in values:
+        name = f"Unnamed: {i}" if v is None else str(v)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _read_openpyxl(source, usecols, nrows):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(source, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        # Một số phần mềm ghi sai kích thước sheet; đọc lại theo dữ liệu thực tế
+        ws.reset_dimensions()
+        max_col = usecols[-1] + 1 if usecols else None
+        max_row = nrows + 1 if nrows is not None else None
+        rows = ws.iter_rows(max_row=max_row, max_col=max_col, values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return pd.DataFrame()
+        positions = usecols if usecols else list(range(len(header)))
+
+        def pick(row):
+            return [row[i] if i < len(row) else None for i in positions]
+
+        data = [pick(row) for row in rows]
+        # Bỏ các dòng trống ở cuối như pandas
+        while data and all(v is None for v in data[-1]):
+            data.pop()
+        return pd.DataFrame(data, columns=_header_names(zip(positions, pick(header))))
+    finally:
+        wb.close()
+
+
+def read_sheet(source, usecols=None, nrows=None, numeric_cols=None):
+    """Đọc sheet đầu tiên của file Excel.
+
+    usecols: vị trí các cột cần đọc (trả về theo thứ tự tăng dần), None = tất cả.
+    nrows: số dòng dữ liệu tối đa sau dòng tiêu đề, None = tất cả.
+    numeric_cols: vị trí các cột (trong usecols) cần chuyển sang số, chấp nhận dấu phẩy thập phân.
+    """
+    usecols = sorted(usecols) if usecols else None
+    df = None
+    if HAS_CALAMINE:
+        try:
+            if hasattr(source, "seek"):
+                source.seek(0)
+            df = pd.read_excel(source, sheet_name=0, engine="calamine", usecols=usecols, nrows=nrows)
+        except Exception:
+            df = None
+    if df is None:
+        if hasattr(source, "seek"):
+            source.seek(0)
+        df = _read_openpyxl(source, usecols, nrows)
+
+    if numeric_cols:
+        positions = usecols if usecols else list(range(df.shape[1]))
+        for pos in numeric_cols:
+            if pos in positions and positions.index(pos) < df.shape[1]:
+                j = positions.index(pos)
+                df[df.columns[j]] = to_number(df.iloc[:, j])
+    return df
@@ -0,0 +1,186 @@
+"""Chỉ mục file Excel trong các thư mục Google Drive, cập nhật tăng dần qua Drive changes API.
+
+Lần đầu liệt kê đầy đủ (có phân trang) từng thư mục, sau đó chỉ đọc các thay đổi
+kể từ start page token đã lưu. Chỉ mục được giữ trong bộ nhớ và ghi ra đĩa để
+tiến trình khởi động lại không phải liệt kê lại từ đầu.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from googleapiclient.errors import HttpError
+
+from config import XLSX_MIME
+
+INDEX_PATH = os.environ.get("DRIVE_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "drive_index.json"))
+POLL_SECONDS = float(os.environ.get("DRIVE_INDEX_POLL_SECONDS", "60"))
+FULL_RESYNC_SECONDS = float(os.environ.get("DRIVE_INDEX_RESYNC_SECONDS", str(24 * 3600)))
+
+FILE_FIELDS = "id, name, mimeType, parents, modifiedTime, size, trashed"
+# Mã lỗi changes().list trả về khi page token hết hạn / không hợp lệ
+INVALID_TOKEN_STATUSES = (400, 404, 410)
+
+logger = logging.getLogger(__name__)
+
+
+def _record(f):
+    return {"id": f["id"], "name": f["name"], "modifiedTime": f.get("modifiedTime"), "size": int(f["size"]) if f.get("size") else None}
+
+
+class FolderIndex:
+    """Chỉ mục tên file -> {'id', 'name', 'modifiedTime', 'size'} cho một nhóm thư mục Drive.
+
+    client() trả về context manager cho một Drive service (xem DriveClientPool.client).
+    """
+
+    def __init__(self, client, folder_ids, path=INDEX_PATH, poll_seconds=POLL_SECONDS, full_resync_seconds=FULL_RESYNC_SECONDS):
+        self.client = client
+        self.folder_ids = list(folder_ids)
+        self.path = path
+        self.poll_seconds = poll_seconds
+        self.full_resync_seconds = full_resync_seconds
+        self._lock = threading.Lock()
+        self._last_poll = 0.0
+        self._state = self._load()
+
+    def files(self, folder_id):
+        """Trả về bản sao {tên file: bản ghi} của thư mục, đồng bộ với Drive nếu đã đến hạn."""
+        self.refresh()
+        with self._lock:
+            return {name: dict(rec) for name, rec in self._state["folders"].get(folder_id, {}).items()}
+
+    def refresh(self, force=False):
+        """Đồng bộ đầy đủ khi chưa có chỉ mục / đã quá hạn, ngược lại chỉ đọc các thay đổi.
+
+        Chỉ liệt kê lại toàn bộ khi chưa có chỉ mục, đã quá hạn resync định kỳ hoặc page token
+        không còn hợp lệ. Khi đã có chỉ mục, lỗi (mạng, quota, 5xx) chỉ được ghi log: giữ chỉ mục
+        cũ và thử lại ở lần poll sau.
+        """
+        with self._lock:
+            now = time.time()
+            missing = not self._state.get("page_token") or any(fid not in self._state["folders"] for fid in self.folder_ids)
+            due = force or now - self._last_poll >= self.poll_seconds
+            if missing:
+                # Chưa có gì để dùng tạm: lỗi được ném cho nơi gọi
+                self._full_sync()
+            elif not due:
+                return
+            elif now - self._state.get("full_synced_at", 0) > self.full_resync_seconds:
+                self._resync()
+            else:
+                try:
+                    self._poll_changes()
+                except HttpError as e:
+                    if e.resp.status not in INVALID_TOKEN_STATUSES:
+                        self._keep_stale(e)
+                    else:
+                        # Token hết hạn hoặc không hợp lệ: liệt kê lại toàn bộ
+                        self._resync()
+                except Exception as e:
+                    self._keep_stale(e)
+
+    def _resync(self):
+        try:
+            self._full_sync()
+        except Exception as e:
+            self._keep_stale(e)
+
+    def _keep_stale(self, exc):
+        # Lỗi tạm thời (mạng, quota, 5xx): giữ chỉ mục hiện có, thử lại ở lần poll sau
+        logger.warning("Không đồng bộ được với Drive, dùng chỉ mục cũ: %s", exc)
+        self._last_poll = time.time()
+
+    def _full_sync(self):
+        with self.client() as service:
+            # Lấy token trước khi liệt kê để không bỏ sót thay đổi xảy ra trong lúc liệt kê
+            token = service.changes().getStartPageToken(supportsAllDrives=True).execute()["startPageToken"]
+            folders = {}
+            for folder_id in self.folder_ids:
+                query = f"'{folder_id}' in parents and mimeType='{XLSX_MIME}' and trashed=false"
+                entries, page_token = {}, None
+                while True:
+                    results = service.files().list(
+                        q=query,
+                        fields=f"nextPageToken, files({FILE_FIELDS})",
+                        pageSize=1000,
+                        pageToken=page_token,
+                        supportsAllDrives=True,
+                        includeItemsFromAllDrives=True,
+                    ).execute()
+                    for f in results.get("files", []):
+                        entries[f["name"]] = _record(f)
+                    page_token = results.get("nextPageToken")
+                    if not page_token:
+                        break
+                folders[folder_id] = entries
+            now = time.time()
+            self._state = {"page_token": token, "full_synced_at": now, "folders": folders}
+            self._last_poll = now
+            self._save()
+
+    def _poll_changes(self):
+        with self.client() as service:
+            token = self._state["page_token"]
+            folders = self._state["folders"]
+            changed = False
+            while token:
+                results = service.changes().list(
+                    pageToken=token,
+                    fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}))",
+                    pageSize=1000,
+                    supportsAllDrives=True,
+                    includeItemsFromAllDrives=True,
+                ).execute()
+                for change in results.get("changes", []):
+                    changed |= self._apply_change(folders, change)
+                if results.get("newStartPageToken"):
+                    token = results["newStartPageToken"]
+                    break
+                token = results.get("nextPageToken")
+            self._last_poll = time.time()
+            if token != self._state["page_token"] or changed:
+                self._state["page_token"] = token
+                self._save()
+
+    def _apply_change(self, folders, change):
+        file_id = change.get("fileId")
+        changed = False
+        # Bỏ bản ghi cũ (file có thể bị đổi tên, chuyển thư mục hoặc xóa)
+        for entries in folders.values():
+            for name in [n for n, rec in entries.items() if rec["id"] == file_id]:
+                del entries[name]
+                changed = True
+        f = change.get("file")
+        if change.get("removed") or not f or f.get("trashed") or f.get("mimeType") != XLSX_MIME:
+            return changed
+        for parent in f.get("parents", []):
+            if parent in folders:
+                folders[parent][f["name"]] = _record(f)
+                changed = True
+        return changed
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                state = json.load(fh)
+            if isinstance(state.get("folders"), dict):
+                return state
+        except (OSError, ValueError):
+            pass
+        return {"page_token": None, "full_synced_at": 0, "folders": {}}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump(self._state, fh, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
@@ -0,0 +1,255 @@
+"""Tính số liệu tổn thất không cần Streamlit: hàm gọi trực tiếp, dòng lệnh và endpoint JSON.
+
+    python loss_api.py query --level ha --year 2026 --to 6 --mode "Lũy kế"
+    python loss_api.py query --level tba --year 2026 --from 1 --to 6 --mode "Lũy kế cùng kỳ"
+    python loss_api.py serve --port 8600
+        GET /loss?level=dy&year=2026&mode=Tháng
+
+level: tba (số TBA theo ngưỡng), ha / trung / dv (tỷ lệ tổn thất theo tháng), dy (tỷ lệ theo
+đường dây). Thông tin service account lấy từ GOOGLE_SERVICE_ACCOUNT_JSON hoặc
+.streamlit/secrets.toml. Dữ liệu đi qua cùng cache trên đĩa với dashboard nên khi cache đã
+nóng, mỗi truy vấn chỉ mất vài mili giây.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import math
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+from config import ALL_FOLDER_IDS, FOLDER_ID, FOLDER_ID_DY, FOLDER_ID_HA, FOLDER_ID_TOAN_DON_VI, FOLDER_ID_TRUNG
+from drive_fetch import fetch_many, load_sheet
+from loss_calc import FEEDER_READ, TBA_READ, concat_compact, feeder_files, feeder_frame, feeder_loss_table, tba_threshold_summary, with_ky
+from loss_facts import SCALAR_READ, LossFacts, loss_series
+
+TBA_MODES = ["Theo tháng", "Lũy kế", "So sánh cùng kỳ", "Lũy kế cùng kỳ"]
+LEVEL_MODES = ["Tháng", "Lũy kế"]
+LEVELS = ["tba", "ha", "trung", "dv", "dy"]
+
+LEVEL_FOLDERS = {"ha": FOLDER_ID_HA, "trung": FOLDER_ID_TRUNG, "dv": FOLDER_ID_TOAN_DON_VI}
+RESULT_CACHE_SIZE = 256
+
+logger = logging.getLogger(__name__)
+
+
+def tba_months(month_from, month_to, mode):
+    """Các tháng cần đọc: cả khoảng ở chế độ lũy kế, chỉ tháng đầu ở chế độ theo tháng (như dashboard)."""
+    return list(range(month_from, (month_to if "Lũy kế" in mode else month_from) + 1))
+
+
+class LossService:
+    """Các phép tổng hợp của dashboard, đọc dữ liệu qua chỉ mục Drive và cache trên đĩa."""
+
+    def __init__(self, client, index, facts):
+        self.client = client
+        self.index = index
+        self.facts = facts
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def fetch(self, files, options):
+        """Đọc nhiều file song song (None hoặc file lỗi cho DataFrame rỗng).
+
+        File lỗi được ghi log và ghi vào danh sách của collect_errors() đang mở trong luồng này.
+        """
+        keys = [(f["id"], f.get("modifiedTime")) if f else None for f in files]
+        results, errors = fetch_many(keys, lambda key: load_sheet(self.client, *key, **options))
+        names = {(f["id"], f.get("modifiedTime")): f.get("name", f["id"]) for f in files if f}
+        for key, exc in errors.items():
+            logger.warning("Không tải được file %s: %s", names.get(key, key[0]), exc)
+            for log in getattr(self._local, "errors", []):
+                log.append(f"{names.get(key, key[0])}: {exc}")
+        return [df if df is not None else pd.DataFrame() for df in results]
+
+    @contextmanager
+    def collect_errors(self):
+        """Trả về danh sách (tên file: lỗi) của các file tải lỗi trong khối with, ở luồng hiện tại."""
+        errors = []
+        self._local.errors = getattr(self._local, "errors", []) + [errors]
+        try:
+            yield errors
+        finally:
+            self._local.errors = [log for log in self._local.errors if log is not errors]
+
+    def tba_frame(self, year, month_from, month_to=None, mode="Theo tháng"):
+        """Bảng TBA các tháng đã chọn (kèm năm trước nếu so sánh cùng kỳ), có cột "Kỳ"."""
+        files = self.index.files(FOLDER_ID)
+        frames = []
+        periods = [(year, "Thực hiện")] + ([(year - 1, "Cùng kỳ")] if "cùng kỳ" in mode.lower() else [])
+        for y, ky in periods:
+            names = [f"TBA_{y}_{m:02}.xlsx" for m in tba_months(month_from, month_to or month_from, mode)]
+            frames += [with_ky(df, ky) for df in self.fetch([files.get(n) for n in names], TBA_READ)]
+        return concat_compact(frames)
+
+    def tba_thresholds(self, year, month_from, month_to=None, mode="Theo tháng"):
+        """(số TBA theo ngưỡng x Kỳ, tỷ trọng theo ngưỡng), None nếu không có dữ liệu."""
+        df = self.tba_frame(year, month_from, month_to, mode)
+        if df.empty or "Tỷ lệ tổn thất" not in df.columns:
+            return None
+        _, pivot_df, pie_data = tba_threshold_summary(df, cumulative="Lũy kế" in mode)
+        return pivot_df, pie_data
+
+    def level_series(self, level, year, month=12, mode="Tháng"):
+        """(tỷ lệ năm year đến tháng month, tỷ lệ cùng kỳ đủ 12 tháng) cho ha / trung / dv."""
+        files = self.index.files(LEVEL_FOLDERS[level])
+        self.facts.sync(level, files, lambda fs: self.fetch(fs, SCALAR_READ), years={year, year - 1})
+        df_th = loss_series(self.facts.rows(level, year), month, luy_ke=(mode == "Lũy kế"))
+        df_ck = loss_series(self.facts.rows(level, year - 1))
+        return df_th, df_ck
+
+    def feeder_table(self, year, mode="Tháng", include_cungky=True):
+        """Tỷ lệ tổn thất (%) theo (Đường dây, Tháng) x Kỳ, như feeder_loss_table."""
+        selected = feeder_files(self.index.files(FOLDER_ID_DY), year, include_cungky)
+        frames = self.fetch([f for _, _, f in selected], FEEDER_READ)
+        parts = [feeder_frame(df, y, m, "Cùng kỳ" if y == year - 1 else "Thực hiện") for (y, m, _), df in zip(selected, frames)]
+        return feeder_loss_table(parts, luy_ke=(mode == "Lũy kế"))
+
+    def query(self, level, year, month_from=1, month_to=None, mode=None):
+        """Kết quả dạng dict (ghi được JSON) cho một truy vấn (level, năm, khoảng tháng, chế độ).
+
+        Kết quả được nhớ theo tham số và phiên bản các file của thư mục liên quan; nếu có file
+        tải lỗi thì kết quả kèm khóa "errors" và không được nhớ, lần sau tính lại.
+        """
+        if level not in LEVELS:
+            raise ValueError(f"level phải là một trong {LEVELS}")
+        modes = TBA_MODES if level == "tba" else LEVEL_MODES
+        mode = mode or modes[0]
+        if mode not in modes:
+            raise ValueError(f"mode của {level} phải là một trong {modes}")
+        month_to = month_to or (month_from if level == "tba" else 12)
+        if not 1 <= month_from <= month_to <= 12:
+            raise ValueError("Khoảng tháng không hợp lệ")
+
+        folder = {"tba": FOLDER_ID, "dy": FOLDER_ID_DY}.get(level) or LEVEL_FOLDERS[level]
+        key = (level, year, month_from, month_to, mode, self._version(folder))
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key]
+
+        result = {"level": level, "year": year, "month_from": month_from, "month_to": month_to, "mode": mode}
+        with self.collect_errors() as errors:
+            self._compute(result, level, year, month_from, month_to, mode)
+        if errors:
+            result["errors"] = errors
+            return result
+
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+        return result
+
+    def _compute(self, result, level, year, month_from, month_to, mode):
+        if level == "tba":
+            summary = self.tba_thresholds(year, month_from, month_to, mode)
+            result["months"] = tba_months(month_from, month_to, mode)
+            result["counts"] = _records(summary[0].reset_index()) if summary else []
+            result["share"] = {k: int(v) for k, v in summary[1].items()} if summary else {}
+        elif level == "dy":
+            wide = self.feeder_table(year, mode)
+            wide = wide[wide.index.get_level_values("Tháng").to_series().between(month_from, month_to).to_numpy()] if not wide.empty else wide
+            result["rows"] = _records(wide.reset_index())
+        else:
+            df_th, df_ck = self.level_series(level, year, month_to, mode)
+            df = df_th.assign(**{"Cùng kỳ": df_ck["Tỷ lệ"]})
+            result["rows"] = _records(df[df["Tháng"].between(month_from, month_to)])
+
+    def _version(self, folder_id):
+        files = self.index.files(folder_id)
+        sig = sorted((name, f["id"], f.get("modifiedTime") or "") for name, f in files.items())
+        return hashlib.sha1(repr(sig).encode("utf-8")).hexdigest()
+
+
+def _records(df):
+    """DataFrame -> list dict, NaN thành None, số numpy thành số Python."""
+    rows = []
+    for rec in df.to_dict(orient="records"):
+        rows.append({str(k): (None if isinstance(v, float) and math.isnan(v) else v.item() if hasattr(v, "item") else v) for k, v in rec.items()})
+    return rows
+
+
+def from_env():
+    """LossService dùng thông tin service account từ biến môi trường / secrets.toml."""
+    from drive_client import DriveClientPool, load_service_account_info
+    from folder_index import FolderIndex
+
+    pool = DriveClientPool(load_service_account_info())
+    return LossService(pool.client, FolderIndex(pool.client, ALL_FOLDER_IDS), LossFacts())
+
+
+class _Handler(BaseHTTPRequestHandler):
+    service = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path != "/loss":
+            self._send(404, {"error": "Không tìm thấy. Dùng GET /loss?level=&year=&from=&to=&mode="})
+            return
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        try:
+            result = self.service.query(
+                params["level"],
+                int(params["year"]),
+                int(params.get("from", 1)),
+                int(params["to"]) if "to" in params else None,
+                params.get("mode"),
+            )
+        except (KeyError, ValueError) as e:
+            self._send(400, {"error": str(e)})
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+        else:
+            self._send(200, result)
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(service, port=8600, host="127.0.0.1"):
+    """Chạy endpoint JSON GET /loss (chặn cho đến khi dừng tiến trình).
+
+    Endpoint không xác thực nên mặc định chỉ nghe trên máy cục bộ; truyền host="0.0.0.0" để mở ra ngoài.
+    """
+    handler = type("Handler", (_Handler,), {"service": service})
+    ThreadingHTTPServer((host, port), handler).serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Số liệu tổn thất (TBA, hạ thế, trung thế, toàn đơn vị, đường dây) dạng JSON.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    q = sub.add_parser("query", help="in kết quả một truy vấn")
+    q.add_argument("--level", choices=LEVELS, required=True)
+    q.add_argument("--year", type=int, required=True)
+    q.add_argument("--from", dest="month_from", type=int, default=1)
+    q.add_argument("--to", dest="month_to", type=int)
+    q.add_argument("--mode", help=f"tba: {TBA_MODES}; các cấp khác: {LEVEL_MODES}")
+    s = sub.add_parser("serve", help="mở endpoint HTTP JSON")
+    s.add_argument("--host", default="127.0.0.1", help="0.0.0.0 để nhận truy vấn từ máy khác")
+    s.add_argument("--port", type=int, default=8600)
+    args = parser.parse_args(argv)
+
+    service = from_env()
+    if args.command == "query":
+        print(json.dumps(service.query(args.level, args.year, args.month_from, args.month_to, args.mode), ensure_ascii=False, indent=2))
+    else:
+        serve(service, args.port, args.host)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""Các phép tính tổn thất dùng chung (không phụ thuộc Streamlit)."""
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Cận các ngưỡng tỷ lệ tổn thất (%) - mọi nhãn ngưỡng đều sinh ra từ danh sách này
+NGUONG_EDGES = [2, 3, 4, 5, 7]
+NGUONG_KHONG_RO = "Không rõ"
+
+
+def _nguong_labels(edges):
+    labels = [f"<{edges[0]}%"]
+    labels += [f">={a} và <{b}%" for a, b in zip(edges[:-1], edges[1:])]
+    labels.append(f">={edges[-1]}%")
+    return labels
+
+
+NGUONG_LABELS = _nguong_labels(NGUONG_EDGES)
+NGUONG_DTYPE = pd.CategoricalDtype(NGUONG_LABELS + [NGUONG_KHONG_RO], ordered=True)
+
+
+def to_number(s):
+    """Chuyển cột số dạng chuỗi (có thể dùng dấu phẩy thập phân) sang float, giá trị lỗi thành NaN."""
+    if pd.api.types.is_numeric_dtype(s):
+        return s.astype("float64")
+    return pd.to_numeric(s.astype(str).str.replace(",", ".", regex=False), errors="coerce")
+
+
+# Tên cột có thể gặp trong sheet TBA (so không phân biệt hoa thường, bỏ khoảng trắng thừa);
+# thêm tên khác qua biến môi trường, phân cách bằng dấu phẩy
+TBA_NAME_COLUMN = "Tên TBA"
+TBA_LOSS_COLUMNS = [c for c in os.environ.get("TBA_LOSS_COLUMNS", "").split(",") if c.strip()] + ["Điện tổn thất", "Tổn thất", "ĐN tổn thất", "Tổn thất (kWh)"]
+TBA_SALES_COLUMNS = [c for c in os.environ.get("TBA_SALES_COLUMNS", "").split(",") if c.strip()] + ["Thương phẩm", "Điện thương phẩm", "ĐN thương phẩm", "Thương phẩm (kWh)"]
+
+# Các cột số liệu của sheet TBA được đọc thành số khi thu gọn (xem compact_frame)
+TBA_MEASURE_COLUMNS = TBA_LOSS_COLUMNS + TBA_SALES_COLUMNS + ["Tỷ lệ tổn thất"]
+
+# Cách đọc sheet TBA: đọc đủ cột (bảng chi tiết hiển thị tất cả) nhưng thu gọn kiểu dữ liệu
+TBA_READ = {"compact": True}
+
+
+def compact_frame(df, measures=TBA_MEASURE_COLUMNS):
+    """Thu gọn bộ nhớ của một sheet vừa đọc.
+
+    Bỏ cột toàn rỗng; cột chữ có tên trong measures (không phân biệt hoa thường / khoảng trắng)
+    chỉ chứa số (kể cả dấu phẩy thập phân) thành số; số nguyên và số thực được thu nhỏ kiểu khi
+    không mất độ chính xác; các cột chữ còn lại (kể cả mã TBA / đường dây có số 0 ở đầu) thành category.
+    """
+    df = df.dropna(axis=1, how="all")
+    measures = {" ".join(name.split()).lower() for name in measures}
+    out = {}
+    for col in df.columns:
+        s = df[col]
+        if pd.api.types.is_object_dtype(s) or pd.api.types.is_string_dtype(s):
+            num = to_number(s) if " ".join(str(col).split()).lower() in measures else None
+            if num is not None and num.notna().sum() == s.notna().sum():
+                s = num
+            else:
+                out[col] = s.astype("category")
+                continue
+        if pd.api.types.is_integer_dtype(s):
+            s = pd.to_numeric(s, downcast="integer")
+        elif pd.api.types.is_float_dtype(s) and s.dtype != "float32":
+            f32 = s.astype("float32")
+            # Chỉ dùng float32 khi giữ nguyên giá trị (số kWh nguyên, tỷ lệ 2 chữ số thập phân vẫn phải so ngưỡng đúng)
+            if ((f32.astype("float64") == s) | s.isna()).all():
+                s = f32
+        out[col] = s
+    return pd.DataFrame(out, index=df.index)
+
+
+def concat_compact(frames):
+    """Nối các bảng đã thu gọn thành một, dùng chung tập category giữa các tháng để giữ kiểu category."""
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame()
+    for col in set().union(*(f.columns for f in frames)):
+        parts = [f[col] for f in frames if col in f.columns]
+        if all(isinstance(p.dtype, pd.CategoricalDtype) for p in parts):
+            categories = union_categoricals([p.array for p in parts]).categories
+            for f in frames:
+                if col in f.columns:
+                    f[col] = f[col].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+def with_ky(df, ky):
+    """Gắn cột "Kỳ" (category một giá trị, không tốn bộ nhớ theo số dòng) cho bảng một tháng."""
+    if df.empty:
+        return df
+    df = df.copy(deep=False)
+    df["Kỳ"] = pd.Categorical.from_codes(np.zeros(len(df), dtype="int8"), categories=[ky])
+    return df
+
+
+def classify_nguong(s):
+    """Phân loại cả cột tỷ lệ tổn thất vào các ngưỡng, trả về Categorical có thứ tự.
+
+    Giá trị không phải số được xếp vào "Không rõ".
+    """
+    values = to_number(pd.Series(s)).to_numpy()
+    codes = np.searchsorted(NGUONG_EDGES, values, side="right")
+    codes[np.isnan(values)] = len(NGUONG_LABELS)
+    return pd.Categorical.from_codes(codes, dtype=NGUONG_DTYPE)
+
+
+def resolve_column(df, candidates):
+    """Tên cột đầu tiên của df khớp một trong candidates (không phân biệt hoa thường / khoảng trắng), None nếu không có."""
+    columns = {" ".join(str(c).split()).lower(): c for c in df.columns}
+    for name in candidates:
+        key = " ".join(name.split()).lower()
+        if key in columns:
+            return columns[key]
+    return None
+
+
+def tba_cumulative_columns(df):
+    """(cột tổn thất, cột thương phẩm) của bảng TBA, None nếu thiếu một trong hai."""
+    loss, sales = resolve_column(df, TBA_LOSS_COLUMNS), resolve_column(df, TBA_SALES_COLUMNS)
+    return (loss, sales) if loss is not None and sales is not None else None
+
+
+def tba_cumulative(df):
+    """Gộp bảng TBA nhiều tháng (đã có cột "Kỳ") thành một dòng mỗi (Tên TBA, Kỳ).
+
+    Tổn thất và thương phẩm được cộng qua các tháng; "Tỷ lệ tổn thất" lũy kế tính lại từ hai
+    tổng đó. Trả về None nếu không tìm được cột tổn thất / thương phẩm (xem TBA_LOSS_COLUMNS).
+    """
+    columns = tba_cumulative_columns(df)
+    if columns is None:
+        return None
+    loss, sales = columns
+    values = pd.DataFrame({"Tổn thất": to_number(df[loss]), "Thương phẩm": to_number(df[sales])})
+    keys = [df[TBA_NAME_COLUMN], df["Kỳ"]]
+    grouped = values.groupby(keys, observed=True, sort=False)
+    totals = grouped.sum(min_count=1)
+    totals["Số tháng"] = grouped.size().astype("int8")
+    ratio = totals["Tổn thất"] / totals["Thương phẩm"].where(totals["Thương phẩm"] != 0) * 100
+    totals["Tỷ lệ tổn thất"] = ratio.round(2)
+    out = totals.reset_index()
+    out[TBA_NAME_COLUMN] = out[TBA_NAME_COLUMN].astype("category")
+    out["Kỳ"] = out["Kỳ"].astype("category")
+    return compact_frame(out)
+
+
+def tba_threshold_summary(df, cumulative=False):
+    """Phân ngưỡng tổn thất cho bảng TBA (đã có cột "Kỳ") và đếm số TBA theo ngưỡng.
+
+    cumulative=True: gộp các tháng bằng tba_cumulative trước khi phân ngưỡng (một dòng mỗi
+    TBA mỗi kỳ); nếu thiếu cột tổn thất / thương phẩm thì dùng tháng đầu tiên của mỗi TBA.
+    Trả về (df có thêm cột "Ngưỡng tổn thất", pivot_df số lượng theo ngưỡng x Kỳ, pie_data
+    tỷ trọng của kỳ "Thực hiện" hoặc kỳ đầu tiên).
+    """
+    if cumulative:
+        totals = tba_cumulative(df)
+        if totals is not None:
+            df = totals
+    # Đảm bảo cột Tỷ lệ tổn thất là số rồi phân ngưỡng cho cả cột một lần
+    df["Tỷ lệ tổn thất"] = to_number(df["Tỷ lệ tổn thất"])
+    df["Ngưỡng tổn thất"] = classify_nguong(df["Tỷ lệ tổn thất"])
+
+    # Drop duplicates based on 'Tên TBA' and 'Kỳ' to count unique TBAs per period
+    df_unique = df.drop_duplicates(subset=["Tên TBA", "Kỳ"])
+
+    # Create count_df and pivot_df for plotting
+    count_df = df_unique.groupby(["Ngưỡng tổn thất", "Kỳ"], observed=True).size().reset_index(name="Số lượng")
+    pivot_df = count_df.pivot(index="Ngưỡng tổn thất", columns="Kỳ", values="Số lượng").fillna(0).astype(int)
+    # Sắp xếp lại thứ tự các ngưỡng
+    pivot_df = pivot_df.reindex(NGUONG_LABELS)
+
+    # Biểu đồ tròn (Tỷ trọng) - Ưu tiên dữ liệu 'Thực hiện' hoặc kỳ đầu tiên nếu không có
+    pie_data = pd.Series(0, index=pivot_df.index) # Default empty
+    if 'Thực hiện' in df_unique['Kỳ'].unique():
+        df_latest = df_unique[df_unique['Kỳ'] == 'Thực hiện']
+        pie_data = df_latest["Ngưỡng tổn thất"].value_counts().reindex(pivot_df.index, fill_value=0)
+    elif not df_unique.empty and not pivot_df.empty:
+        # Fallback to the first available period if 'Thực hiện' is not present
+        first_col_data = pivot_df.iloc[:, 0]
+        if first_col_data.sum() > 0:
+            pie_data = first_col_data
+    return df, pivot_df, pie_data
+
+
+# Vị trí cột tên đường dây, thương phẩm, điện tổn thất trong workbook đường dây
+FEEDER_SOURCE_COLUMNS = [1, 2, 5]
+FEEDER_READ = {"usecols": FEEDER_SOURCE_COLUMNS, "numeric_cols": FEEDER_SOURCE_COLUMNS[1:]}
+FEEDER_COLUMNS = ["Đường dây", "Thương phẩm", "Điện tổn thất"]
+
+
+def feeder_files(all_files, year, include_cungky=True):
+    """Chọn các file đường dây (tên dạng *_YYYY_MM.xlsx) của năm year và năm trước nếu so sánh cùng kỳ.
+
+    Trả về danh sách (năm, tháng, bản ghi file) theo thứ tự trong all_files.
+    """
+    selected = []
+    for fname, file in all_files.items():
+        try:
+            file_year = int(fname.split("_")[1])
+            month = int(fname.split("_")[2].split(".")[0])
+        except (IndexError, ValueError):
+            continue
+        if file_year == year or (include_cungky and file_year == year - 1):
+            selected.append((file_year, month, file))
+    return selected
+
+
+def feeder_frame(df, year, month, ky):
+    """Gắn nhãn năm/tháng/kỳ cho workbook đường dây đã đọc theo FEEDER_SOURCE_COLUMNS (3 cột)."""
+    if df is None or df.shape[1] < len(FEEDER_COLUMNS):
+        return pd.DataFrame(columns=FEEDER_COLUMNS + ["Năm", "Tháng", "Kỳ"])
+    part = df.iloc[:, :len(FEEDER_COLUMNS)].copy()
+    part.columns = FEEDER_COLUMNS
+    part["Đường dây"] = part["Đường dây"].astype(str).str.strip()
+    part["Thương phẩm"] = to_number(part["Thương phẩm"])
+    part["Điện tổn thất"] = to_number(part["Điện tổn thất"])
+    part["Năm"] = year
+    part["Tháng"] = month
+    part["Kỳ"] = ky
+    return part
+
+
+def feeder_loss_table(frames, luy_ke=False):
+    """Tính tỷ lệ tổn thất (%) theo tháng cho mọi đường dây cùng lúc.
+
+    frames là các bảng từ feeder_frame. Trả về bảng rộng có index (Đường dây, Tháng 1..12)
+    theo thứ tự đường dây xuất hiện, mỗi cột là một Kỳ; ô không có số liệu là NaN.
+    Chế độ lũy kế cộng dồn tổn thất và thương phẩm theo tháng trong từng (Đường dây, Kỳ).
+    """
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    order = pd.unique(df["Đường dây"].dropna())
+
+    totals = df.groupby(["Đường dây", "Kỳ", "Tháng"])[["Điện tổn thất", "Thương phẩm"]].sum(min_count=1)
+    if luy_ke:
+        totals = totals.groupby(level=["Đường dây", "Kỳ"]).cumsum()
+    pct = (totals["Điện tổn thất"] / totals["Thương phẩm"] * 100).round(2)
+
+    wide = pct.unstack("Kỳ")
+    full = pd.MultiIndex.from_product([order, range(1, 13)], names=["Đường dây", "Tháng"])
+    return wide.reindex(full)
+
+
+def feeder_charts(wide_df):
+    """Tách bảng từ feeder_loss_table thành [(đường dây, bảng Tháng x Kỳ)] để vẽ từng biểu đồ."""
+    if wide_df.empty:
+        return []
+    return [
+        (dd, wide_df.loc[dd].dropna(axis=1, how="all").fillna(0))
+        for dd in wide_df.index.get_level_values("Đường dây").unique()
+    ]
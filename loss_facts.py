@@ -0,0 +1,173 @@
+"""Bảng tổng hợp tổn thất theo tháng (hạ thế, trung thế, toàn đơn vị).
+
+Mỗi file HA_/TA_/DV_YYYY_MM.xlsx chỉ cần 3 số ở dòng đầu: thương phẩm (cột 1),
+tổn thất (cột 3) và tỷ lệ (cột 4), xem SCALAR_COLUMNS. Các số này được trích một lần cho mỗi phiên bản
+file rồi lưu vào một bảng Parquet nhỏ; các biểu đồ chỉ tra bảng này.
+"""
+import os
+import re
+import threading
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from disk_cache import SingleFlight
+
+FACTS_PATH = os.environ.get("LOSS_FACTS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "loss_facts.parquet"))
+
+# Cấp báo cáo -> tiền tố tên file
+LEVEL_PREFIX = {"ha": "HA", "trung": "TA", "dv": "DV"}
+
+# Vị trí cột thương phẩm, tổn thất, tỷ lệ trong sheet (chỉ đọc dòng đầu của 3 cột này)
+SCALAR_COLUMNS = [1, 3, 4]
+SCALAR_READ = {"usecols": SCALAR_COLUMNS, "nrows": 1, "numeric_cols": SCALAR_COLUMNS}
+
+COLUMNS = ["level", "year", "month", "thuong_pham", "ton_that", "ty_le", "file_id", "modified_time"]
+
+
+def parse_filename(fname, prefix):
+    """Tách (năm, tháng) từ tên file dạng PREFIX_YYYY_MM.xlsx, None nếu không đúng mẫu."""
+    m = re.fullmatch(rf"{prefix}_(\d{{4}})_(\d{{1,2}})\.xlsx", fname)
+    return (int(m.group(1)), int(m.group(2))) if m else None
+
+
+def _to_float(value):
+    try:
+        return float(str(value).replace(",", "."))
+    except (ValueError, TypeError):
+        return np.nan
+
+
+def extract_scalars(df):
+    """Trả về (thương phẩm, tổn thất, tỷ lệ) ở dòng đầu; giá trị không đọc được là NaN.
+
+    df là sheet đã đọc chỉ gồm các cột SCALAR_COLUMNS (theo thứ tự đó).
+    """
+    if df is None or df.empty or df.shape[1] < len(SCALAR_COLUMNS):
+        return np.nan, np.nan, np.nan
+    row = df.iloc[0]
+    return _to_float(row.iloc[0]), _to_float(row.iloc[1]), _to_float(row.iloc[2])
+
+
+class LossFacts:
+    """Bảng (level, year, month, thuong_pham, ton_that, ty_le) lưu trên đĩa, cập nhật tăng dần."""
+
+    def __init__(self, path=FACTS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self.table = self._load()
+        # Nhiều tiến trình cùng ghi một file bảng: chỉ một nơi cập nhật tại một thời điểm
+        self.flight = SingleFlight(os.path.join(os.path.dirname(path) or ".", "locks"))
+
+    def sync(self, level, files, fetch_frames, years=None):
+        """Trích số liệu cho các file mới hoặc đã đổi của cấp level.
+
+        files là {tên file: bản ghi Drive}; fetch_frames(list bản ghi) trả về list DataFrame
+        cùng thứ tự, DataFrame rỗng nếu tải lỗi. years giới hạn các năm cần đồng bộ (None = tất cả).
+        Trả về số file đã nạp.
+        """
+        self._reload_if_changed()
+        pending, removed = self._pending(level, files, years)
+        if not pending and not removed:
+            return 0
+        with self.flight("loss_facts"):
+            # Tiến trình khác có thể vừa cập nhật bảng trong lúc chờ khóa
+            self._reload_if_changed()
+            pending, removed = self._pending(level, files, years)
+            if not pending and not removed:
+                return 0
+
+            frames = fetch_frames([f for _, f in pending]) if pending else []
+            rows = []
+            for ((year, month), f), df in zip(pending, frames):
+                if df is None or df.empty:
+                    # Tải lỗi: không ghi vào bảng để lần sau thử lại
+                    continue
+                rows.append((level, year, month, *extract_scalars(df), f["id"], f.get("modifiedTime")))
+            new = pd.DataFrame(rows, columns=COLUMNS)
+
+            with self._lock:
+                t = self.table
+                drop = {(r[1], r[2]) for r in rows} | set(removed)
+                keep = ~((t["level"] == level) & pd.Series(list(zip(t["year"], t["month"])), index=t.index, dtype=object).isin(drop))
+                self.table = pd.concat([t[keep], new], ignore_index=True) if not new.empty else t[keep].reset_index(drop=True)
+                self._save()
+            return len(rows)
+
+    def _pending(self, level, files, years):
+        """(các file mới / đã đổi [((năm, tháng), bản ghi)], các (năm, tháng) không còn trên Drive)."""
+        prefix = LEVEL_PREFIX[level]
+        wanted = {}
+        for fname, f in files.items():
+            ym = parse_filename(fname, prefix)
+            if ym and (years is None or ym[0] in years):
+                wanted[ym] = f
+
+        with self._lock:
+            t = self.table
+            mask = (t["level"] == level) & (t["year"].isin(years) if years is not None else True)
+            known = {(int(r.year), int(r.month)): (r.file_id, r.modified_time) for r in t[mask].itertuples()}
+        pending = [(ym, f) for ym, f in wanted.items() if known.get(ym) != (f["id"], f.get("modifiedTime"))]
+        removed = [ym for ym in known if ym not in wanted]
+        return pending, removed
+
+    def _reload_if_changed(self):
+        """Đọc lại bảng nếu tiến trình khác đã ghi file sau lần đọc / ghi gần nhất."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._mtime:
+            with self._lock:
+                self.table = self._load()
+
+    def rows(self, level, year):
+        """Các dòng của cấp level trong năm year, sắp theo tháng."""
+        with self._lock:
+            t = self.table
+            return t[(t["level"] == level) & (t["year"] == year)].sort_values("month").reset_index(drop=True)
+
+    def _load(self):
+        try:
+            self._mtime = os.stat(self.path).st_mtime_ns
+            t = pd.read_parquet(self.path)
+            if list(t.columns) == COLUMNS:
+                return t
+        except Exception:
+            pass
+        dtypes = {"level": object, "year": "int64", "month": "int64", "file_id": object, "modified_time": object}
+        return pd.DataFrame({c: pd.Series(dtype=dtypes.get(c, "float64")) for c in COLUMNS})
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        try:
+            self.table.to_parquet(tmp, index=False)
+            os.replace(tmp, self.path)
+            self._mtime = os.stat(self.path).st_mtime_ns
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+
+def loss_series(rows, thang=12, luy_ke=False):
+    """Dựng bảng 12 tháng ("Tháng", "Tỷ lệ") từ các dòng của một năm.
+
+    Chỉ lấy các tháng <= thang có đủ số liệu; chế độ lũy kế tính tổng tổn thất / tổng
+    thương phẩm cộng dồn (%), chế độ tháng lấy tỷ lệ của từng tháng.
+    """
+    rows = rows[rows["month"] <= thang]
+    if luy_ke:
+        rows = rows.dropna(subset=["thuong_pham", "ton_that", "ty_le"])
+        tp = rows["thuong_pham"].cumsum()
+        ty_le = (rows["ton_that"].cumsum() / tp * 100).where(tp > 0, 0.0)
+    else:
+        rows = rows.dropna(subset=["ty_le"])
+        ty_le = rows["ty_le"]
+    values = pd.Series(ty_le.to_numpy(), index=rows["month"].astype(int).to_numpy())
+    months = list(range(1, 13))
+    return pd.DataFrame({"Tháng": months, "Tỷ lệ": values.reindex(months).to_numpy()})
@@ -0,0 +1,193 @@
+"""Đo thời gian từng giai đoạn xử lý (liệt kê file, tải, đọc Excel, tổng hợp, vẽ biểu đồ).
+
+Mỗi lần đo ghi: thời gian, số byte tải về, số dòng đọc được, trúng / trượt cache.
+Số liệu được cộng dồn theo (phần phân tích, giai đoạn, thư mục) cho cả tiến trình và
+xuất dạng text Prometheus (metrics.serve); mỗi lần chạy một phần phân tích còn được
+ghi log JSON và giữ lại trong SectionRun để hiển thị ở bảng debug.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Cổng HTTP cho endpoint /metrics (0 = không mở)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+# Địa chỉ lắng nghe của /metrics: mặc định chỉ máy cục bộ, đặt METRICS_HOST=0.0.0.0 để mở ra ngoài
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+STAGES = ["listing", "warehouse", "download", "read_excel", "aggregation", "render"]
+
+logger = logging.getLogger("metrics")
+
+_current = contextvars.ContextVar("metrics_section", default=None)
+
+
+class SectionRun:
+    """Số liệu của một lần chạy một phần phân tích (cộng dồn theo giai đoạn)."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, bytes_=0, rows=0, cache=None):
+        with self._lock:
+            s = self.stages.setdefault(stage, {"calls": 0, "seconds": 0.0, "bytes": 0, "rows": 0, "hits": 0, "misses": 0})
+            s["calls"] += 1
+            s["seconds"] += seconds
+            s["bytes"] += bytes_
+            s["rows"] += rows
+            if cache == "hit":
+                s["hits"] += 1
+            elif cache == "miss":
+                s["misses"] += 1
+
+    def table(self):
+        """Bảng giai đoạn x số liệu theo thứ tự STAGES, để hiển thị."""
+        import pandas as pd
+
+        with self._lock:
+            rows = {stage: dict(self.stages[stage]) for stage in STAGES if stage in self.stages}
+        df = pd.DataFrame.from_dict(rows, orient="index", columns=["calls", "seconds", "bytes", "rows", "hits", "misses"])
+        df["seconds"] = df["seconds"].round(3)
+        return df
+
+    def as_dict(self):
+        with self._lock:
+            return {"section": self.name, "seconds": round(self.seconds or 0.0, 4), "stages": {k: dict(v) for k, v in self.stages.items()}}
+
+
+class Registry:
+    """Tổng cộng dồn cho cả tiến trình, khóa theo (section, stage, folder)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, section, stage, folder, seconds, bytes_=0, rows=0, cache=None):
+        key = (section, stage, folder or "")
+        with self._lock:
+            s = self._series.setdefault(key, {"count": 0, "seconds": 0.0, "bytes": 0, "rows": 0, "hit": 0, "miss": 0})
+            s["count"] += 1
+            s["seconds"] += seconds
+            s["bytes"] += bytes_
+            s["rows"] += rows
+            if cache in ("hit", "miss"):
+                s[cache] += 1
+
+    def prometheus(self):
+        """Xuất số liệu theo định dạng text của Prometheus."""
+        with self._lock:
+            series = {k: dict(v) for k, v in self._series.items()}
+
+        def labels(section, stage, folder, **extra):
+            pairs = [("section", section), ("stage", stage)] + ([("folder", folder)] if folder else []) + list(extra.items())
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        lines = [
+            "# HELP dashboard_stage_seconds Thời gian xử lý theo giai đoạn.",
+            "# TYPE dashboard_stage_seconds summary",
+        ]
+        for key, s in sorted(series.items()):
+            lines.append(f"dashboard_stage_seconds_sum{labels(*key)} {s['seconds']:.6f}")
+            lines.append(f"dashboard_stage_seconds_count{labels(*key)} {s['count']}")
+        for metric, field, help_ in (
+            ("dashboard_stage_bytes_total", "bytes", "Số byte tải về từ Google Drive."),
+            ("dashboard_stage_rows_total", "rows", "Số dòng Excel đọc được."),
+        ):
+            lines += [f"# HELP {metric} {help_}", f"# TYPE {metric} counter"]
+            lines += [f"{metric}{labels(*key)} {s[field]}" for key, s in sorted(series.items()) if s[field]]
+        lines += ["# HELP dashboard_cache_requests_total Số lần tra cache theo kết quả.", "# TYPE dashboard_cache_requests_total counter"]
+        for key, s in sorted(series.items()):
+            for result in ("hit", "miss"):
+                if s[result]:
+                    lines.append(f"dashboard_cache_requests_total{labels(*key, result=result)} {s[result]}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def record(stage, seconds, folder=None, bytes_=0, rows=0, cache=None):
+    """Ghi một lần đo vào phần phân tích đang chạy (nếu có) và vào tổng của tiến trình."""
+    run = _current.get()
+    REGISTRY.observe(run.name if run else "-", stage, folder, seconds, bytes_, rows, cache)
+    if run is not None:
+        run.add(stage, seconds, bytes_, rows, cache)
+
+
+@contextmanager
+def stage(name, folder=None):
+    """Đo thời gian một giai đoạn; khối lệnh có thể gán info["bytes"], info["rows"], info["cache"] ("hit"/"miss")."""
+    info = {}
+    started = time.perf_counter()
+    try:
+        yield info
+    finally:
+        record(name, time.perf_counter() - started, folder, info.get("bytes", 0), info.get("rows", 0), info.get("cache"))
+
+
+@contextmanager
+def section(name):
+    """Gom các lần đo trong khối lệnh (kể cả luồng phụ tạo qua drive_fetch.fetch_many) vào một SectionRun."""
+    run = SectionRun(name)
+    token = _current.set(run)
+    try:
+        yield run
+    finally:
+        _current.reset(token)
+        run.seconds = time.perf_counter() - run.started
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(run.as_dict(), ensure_ascii=False))
+
+
+_startup_lock = threading.Lock()
+_started_runs = 0
+
+
+def startup(import_seconds, render_seconds, services_seconds):
+    """Ghi thời gian khởi động một lần chạy app.py: import, đến khi giao diện chính hiển thị, khởi động dịch vụ nền.
+
+    Lần chạy đầu tiên của tiến trình (phải nạp module thật) được ghi vào section "startup_cold",
+    các lần sau vào "startup_warm". Trả về dict số liệu, cũng được ghi log JSON.
+    """
+    global _started_runs
+    with _startup_lock:
+        cold = _started_runs == 0
+        _started_runs += 1
+    report = {"cold": cold, "import": import_seconds, "first_render": render_seconds, "services": services_seconds}
+    name = "startup_cold" if cold else "startup_warm"
+    for key in ("import", "first_render", "services"):
+        REGISTRY.observe(name, key, None, report[key])
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({"section": name, **{k: round(v, 4) for k, v in report.items() if k != "cold"}}))
+    return report
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=METRICS_PORT, host=METRICS_HOST):
+    """Mở endpoint http://host:port/metrics trong luồng nền; trả về server."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
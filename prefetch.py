@@ -0,0 +1,163 @@
+"""Làm nóng cache nền: phát hiện file mới / đã đổi trong năm thư mục Drive, tải trước và tính sẵn các view mặc định.
+
+Chạy trong tiến trình dashboard (luồng nền, xem Prefetcher.start) hoặc như một lệnh riêng:
+
+    python prefetch.py            # lặp theo PREFETCH_INTERVAL_SECONDS
+    python prefetch.py --once     # chạy một lượt rồi thoát
+
+Mỗi lượt đưa sheet đã đọc vào cache trên đĩa (cùng khóa với dashboard), cập nhật bảng
+tổng hợp tổn thất, và khi chạy trong tiến trình dashboard thì vẽ sẵn các biểu đồ
+của năm hiện tại, tháng mới nhất ở cả chế độ "Tháng" và "Lũy kế".
+"""
+import argparse
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+import metrics
+from charts import LOSS_TREND_TITLES, draw_feeder, draw_loss_trend, draw_tba_threshold
+from config import ALL_FOLDER_IDS, FOLDER_ID, FOLDER_ID_DY, FOLDER_ID_HA, FOLDER_ID_TOAN_DON_VI, FOLDER_ID_TRUNG
+from drive_fetch import fetch_many, load_sheet
+from loss_api import LEVEL_FOLDERS, LossService
+from loss_calc import FEEDER_READ, TBA_READ, feeder_charts
+from loss_facts import LEVEL_PREFIX, SCALAR_READ, LossFacts
+
+# Chu kỳ (giây) giữa hai lượt làm nóng; 0 = không chạy nền trong dashboard
+PREFETCH_SECONDS = float(os.environ.get("PREFETCH_INTERVAL_SECONDS", "600"))
+
+# Cách đọc sheet của từng thư mục - phải giống dashboard để dùng chung khóa cache
+READ_OPTIONS = {
+    FOLDER_ID: TBA_READ,
+    FOLDER_ID_HA: SCALAR_READ,
+    FOLDER_ID_TRUNG: SCALAR_READ,
+    FOLDER_ID_TOAN_DON_VI: SCALAR_READ,
+    FOLDER_ID_DY: FEEDER_READ,
+}
+
+logger = logging.getLogger(__name__)
+
+
+def _year_month(fname):
+    m = re.search(r"_(\d{4})_(\d{1,2})\.xlsx$", fname)
+    return (int(m.group(1)), int(m.group(2))) if m else None
+
+
+class Prefetcher:
+    """Định kỳ nạp trước các file của năm hiện tại và năm trước vào cache của dashboard."""
+
+    def __init__(self, client, index, facts, figures=None, interval=PREFETCH_SECONDS):
+        self.client = client
+        self.index = index
+        self.facts = facts
+        self.figures = figures
+        self.service = LossService(client, index, facts)
+        self.interval = interval
+        self._warmed = {}  # file ID -> modifiedTime đã nạp
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Chạy run_once định kỳ trong một luồng nền (daemon)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name="drive-prefetch", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Làm nóng cache thất bại")
+            self._stop.wait(self.interval)
+
+    def run_once(self, year=None):
+        """Một lượt làm nóng cho năm year (mặc định năm hiện tại). Trả về số file mới được nạp."""
+        with metrics.section("prefetch"):
+            return self._run_once(year or datetime.now().year)
+
+    def _run_once(self, year):
+        started = time.monotonic()
+        self.index.refresh(force=True)
+        folders = {fid: self.index.files(fid) for fid in ALL_FOLDER_IDS}
+
+        jobs = {}
+        for fid, files in folders.items():
+            for fname, f in files.items():
+                ym = _year_month(fname)
+                if ym and ym[0] in (year, year - 1) and self._warmed.get(f["id"]) != f.get("modifiedTime"):
+                    jobs[(fid, f["id"], f.get("modifiedTime"))] = f
+        results, errors = fetch_many(list(jobs), lambda key: load_sheet(self.client, key[1], key[2], **READ_OPTIONS[key[0]]))
+        for (fid, file_id, modified_time), df in zip(jobs, results):
+            if df is not None:
+                self._warmed[file_id] = modified_time
+        for key, e in errors.items():
+            logger.warning("Không tải trước được file %s: %s", key[1], e)
+
+        for level, fid in LEVEL_FOLDERS.items():
+            self.facts.sync(level, folders[fid], lambda fs: self.service.fetch(fs, SCALAR_READ), years={year, year - 1})
+
+        if self.figures is not None:
+            self._warm_views(year, folders)
+        logger.info("Làm nóng cache năm %s: %d file mới, %d lỗi, %.1fs", year, len(jobs) - len(errors), len(errors), time.monotonic() - started)
+        return len(jobs) - len(errors)
+
+    def _warm_views(self, year, folders):
+        """Vẽ sẵn (SVG, như mặc định của dashboard) các biểu đồ tháng mới nhất, chế độ Tháng và Lũy kế."""
+        # TBA công cộng: "Theo tháng" (tháng mới nhất) và "Lũy kế" (tháng 1 đến tháng mới nhất)
+        months = [ym[1] for fname in folders[FOLDER_ID] if fname.startswith("TBA_") and (ym := _year_month(fname)) and ym[0] == year]
+        if months:
+            latest = max(months)
+            for month_from, mode in ((latest, "Theo tháng"), (1, "Lũy kế")):
+                summary = self.service.tba_thresholds(year, month_from, latest, mode)
+                if summary:
+                    self.figures.render(draw_tba_threshold, *summary, fmt="svg")
+
+        # Hạ thế, trung thế, toàn đơn vị
+        for level in LEVEL_PREFIX:
+            rows_th = self.facts.rows(level, year)
+            if rows_th.empty:
+                continue
+            thang = int(rows_th["month"].max())
+            for mode in ("Tháng", "Lũy kế"):
+                df_th, df_ck = self.service.level_series(level, year, thang, mode)
+                if df_th["Tỷ lệ"].notna().any():
+                    self.figures.render(draw_loss_trend, df_th, df_ck, fmt="svg", title=LOSS_TREND_TITLES[level])
+
+        # Đường dây trung thế (có so sánh cùng kỳ, biểu đồ cột)
+        for mode in ("Tháng", "Lũy kế"):
+            for dd, pivot_df in feeder_charts(self.service.feeder_table(year, mode)):
+                self.figures.render(draw_feeder, pivot_df, fmt="svg", dd=dd, selected_year=year, chart_type="Cột")
+
+def main(argv=None):
+    from drive_client import DriveClientPool, load_service_account_info
+    from folder_index import FolderIndex
+
+    parser = argparse.ArgumentParser(description="Tải trước các file báo cáo tổn thất mới vào cache của dashboard.")
+    parser.add_argument("--once", action="store_true", help="chạy một lượt rồi thoát")
+    parser.add_argument("--year", type=int, help="năm cần làm nóng (mặc định năm hiện tại)")
+    parser.add_argument("--interval", type=float, default=PREFETCH_SECONDS or 600, help="số giây giữa hai lượt")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    pool = DriveClientPool(load_service_account_info())
+    prefetcher = Prefetcher(pool.client, FolderIndex(pool.client, ALL_FOLDER_IDS), LossFacts(), interval=args.interval)
+    if args.once:
+        prefetcher.run_once(args.year)
+        return
+    while True:
+        try:
+            prefetcher.run_once(args.year)
+        except Exception:
+            logger.exception("Làm nóng cache thất bại")
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
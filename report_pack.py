@@ -0,0 +1,242 @@
+"""Sinh bộ báo cáo tổn thất (DOCX / PPTX / PDF) của một tháng: vẽ biểu đồ và dựng tài liệu song song trên nhiều tiến trình.
+
+    python report_pack.py --year 2026 --month 6
+    python report_pack.py --year 2026 --month 6 --formats pdf --workers 8 --out reports
+
+Bộ báo cáo gồm phân bố TBA theo ngưỡng (tháng và lũy kế, có cùng kỳ), biểu đồ tỷ lệ tổn thất
+hạ thế / trung thế / toàn đơn vị và mỗi đường dây trung thế một trang. Số liệu lấy qua
+loss_api.LossService nên dùng chung cache trên đĩa và bảng tổng hợp với dashboard; ảnh PNG
+được lưu theo băm số liệu nên lần chạy sau chỉ vẽ lại biểu đồ có số liệu mới.
+"""
+import argparse
+import io
+import logging
+import multiprocessing
+import os
+import shutil
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import metrics
+from charts import LOSS_TREND_TITLES, data_hash
+from disk_cache import CACHE_DIR
+from loss_calc import feeder_charts
+
+REPORT_DPI = int(os.environ.get("REPORT_DPI", "150"))
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", str(os.cpu_count() or 2)))
+FIGURE_DIR = os.environ.get("REPORT_FIGURE_DIR", os.path.join(os.path.dirname(CACHE_DIR), "report_figures"))
+# Font TrueType có dấu tiếng Việt cho PDF; mặc định dùng DejaVuSans đi kèm matplotlib
+FONT_PATH = os.environ.get("REPORT_FONT_PATH", "")
+
+FORMATS = ["docx", "pptx", "pdf"]
+LEVEL_NAMES = {"ha": "Hạ thế", "trung": "Trung thế", "dv": "Toàn đơn vị"}
+
+logger = logging.getLogger(__name__)
+
+
+def collect_pages(service, year, month):
+    """Các trang của bộ báo cáo: [(phần, tiêu đề, tên hàm vẽ trong charts, dữ liệu, tùy chọn)]."""
+    pages = []
+    for month_from, mode, label in ((month, "So sánh cùng kỳ", f"tháng {month}/{year}"), (1, "Lũy kế cùng kỳ", f"lũy kế tháng 1-{month}/{year}")):
+        summary = service.tba_thresholds(year, month_from, month, mode)
+        if summary:
+            pages.append(("TBA công cộng", f"TBA theo ngưỡng tổn thất - {label}", "draw_tba_threshold", summary, {}))
+
+    for level, name in LEVEL_NAMES.items():
+        for mode in ("Tháng", "Lũy kế"):
+            df_th, df_ck = service.level_series(level, year, month, mode)
+            if df_th["Tỷ lệ"].notna().any():
+                title = f"{LOSS_TREND_TITLES[level]} ({mode.lower()}, đến tháng {month}/{year})"
+                pages.append((name, title, "draw_loss_trend", (df_th, df_ck), {"title": LOSS_TREND_TITLES[level]}))
+
+    for dd, pivot_df in feeder_charts(service.feeder_table(year, "Tháng")):
+        pivot_df = pivot_df[pivot_df.index <= month]
+        pages.append(("Đường dây trung thế", f"Đường dây {dd}", "draw_feeder", (pivot_df,), {"dd": dd, "selected_year": year, "chart_type": "Cột"}))
+    return pages
+
+
+def figure_path(draw_name, data, options, dpi=REPORT_DPI):
+    """Đường dẫn ảnh PNG của biểu đồ trong FIGURE_DIR, khóa theo hàm vẽ + số liệu + tùy chọn."""
+    return os.path.join(FIGURE_DIR, f"{draw_name}_{dpi}_{data_hash(*data, sorted(options.items()))}.png")
+
+
+def render_figure(path, draw_name, data, options, dpi=REPORT_DPI):
+    """Vẽ một biểu đồ ra PNG (chạy trong tiến trình con); ghi qua file tạm để tiến trình khác không đọc ảnh dở.
+
+    Ảnh được bỏ kênh alpha: fpdf tách kênh alpha từng điểm ảnh bằng Python, rất chậm với ảnh RGBA.
+    """
+    import charts
+    from PIL import Image
+
+    png = charts.get_figure_cache().render(getattr(charts, draw_name), *data, dpi=dpi, **options)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with Image.open(io.BytesIO(png)) as im:
+        im.convert("RGB").save(tmp, format="PNG")
+    os.replace(tmp, path)
+    return path
+
+
+def _render_task(task):
+    return render_figure(*task)
+
+
+def build_docx(pages, path, heading):
+    from docx import Document
+    from docx.shared import Cm
+
+    doc = Document()
+    doc.add_heading(heading, 0)
+    doc.add_paragraph(f"Lập lúc {datetime.now():%d/%m/%Y %H:%M} - {len(pages)} biểu đồ")
+    section = None
+    for part, title, image in pages:
+        doc.add_page_break()
+        if part != section:
+            doc.add_heading(part, 1)
+            section = part
+        doc.add_heading(title, 2)
+        doc.add_picture(image, width=Cm(16))
+    doc.save(path)
+
+
+def build_pptx(pages, path, heading):
+    from pptx import Presentation
+    from pptx.util import Inches
+
+    prs = Presentation()
+    prs.slide_width, prs.slide_height = Inches(13.333), Inches(7.5)
+    slide = prs.slides.add_slide(prs.slide_layouts[0])
+    slide.shapes.title.text = heading
+    slide.placeholders[1].text = f"Lập lúc {datetime.now():%d/%m/%Y %H:%M}"
+
+    top, margin = Inches(1.4), Inches(0.4)
+    for part, title, image in pages:
+        slide = prs.slides.add_slide(prs.slide_layouts[5])
+        slide.shapes.title.text = f"{part}: {title}"
+        pic = slide.shapes.add_picture(image, margin, top, width=prs.slide_width - 2 * margin)
+        # Ảnh cao quá thì co theo chiều cao, rồi căn giữa theo chiều ngang
+        max_height = prs.slide_height - top - margin
+        if pic.height > max_height:
+            pic.width, pic.height = int(pic.width * max_height / pic.height), max_height
+        pic.left = int((prs.slide_width - pic.width) / 2)
+    prs.save(path)
+
+
+def _ascii(text):
+    """Bỏ dấu tiếng Việt khi không có font Unicode cho PDF."""
+    text = text.replace("đ", "d").replace("Đ", "D")
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+
+
+def _pdf_font(pdf):
+    """Đăng ký font Unicode cho PDF; trả về (tên font, hàm chuẩn hóa chữ). Không có font nào thì bỏ dấu.
+
+    fpdf ghi file .pkl số đo font cạnh file TTF nên font được chép vào FIGURE_DIR/fonts trước,
+    không ghi vào thư mục cài đặt của matplotlib (có thể chỉ đọc).
+    """
+    import matplotlib
+
+    candidates = [FONT_PATH, os.path.join(matplotlib.get_data_path(), "fonts", "ttf", "DejaVuSans.ttf")]
+    for font in candidates:
+        if font and os.path.exists(font):
+            try:
+                font_dir = os.path.join(FIGURE_DIR, "fonts")
+                local = os.path.join(font_dir, os.path.basename(font))
+                if not os.path.exists(local) or os.path.getsize(local) != os.path.getsize(font):
+                    os.makedirs(font_dir, exist_ok=True)
+                    tmp = f"{local}.{os.getpid()}.tmp"
+                    shutil.copyfile(font, tmp)
+                    os.replace(tmp, local)
+                pdf.add_font("ReportSans", "", local, uni=True)
+                return "ReportSans", str
+            except Exception as e:
+                logger.warning("Không nạp được font %s: %s", font, e)
+    return "Helvetica", _ascii
+
+
+def build_pdf(pages, path, heading):
+    from fpdf import FPDF
+
+    pdf = FPDF("L", "mm", "A4")
+    pdf.set_auto_page_break(False)
+    font, text = _pdf_font(pdf)
+    pdf.add_page()
+    pdf.set_font(font, "", 20)
+    pdf.cell(0, 20, text(heading), ln=1)
+    pdf.set_font(font, "", 11)
+    pdf.cell(0, 8, text(f"Lập lúc {datetime.now():%d/%m/%Y %H:%M} - {len(pages)} biểu đồ"), ln=1)
+    for part, title, image in pages:
+        pdf.add_page()
+        pdf.set_font(font, "", 14)
+        pdf.cell(0, 10, text(f"{part}: {title}"), ln=1)
+        # Vừa khung 273 x 176 mm dưới tiêu đề
+        if _aspect(image) >= 273 / 176:
+            pdf.image(image, x=12, y=24, w=273)
+        else:
+            pdf.image(image, x=12, y=24, h=176)
+    pdf.output(path, "F")
+
+
+def _aspect(image):
+    from PIL import Image
+
+    with Image.open(image) as im:
+        return im.width / im.height
+
+
+BUILDERS = {"docx": build_docx, "pptx": build_pptx, "pdf": build_pdf}
+
+
+def _build_task(fmt, pages, path, heading):
+    BUILDERS[fmt](pages, path, heading)
+    return path
+
+
+def build_pack(service, year, month, out_dir="reports", formats=FORMATS, workers=REPORT_WORKERS):
+    """Sinh bộ báo cáo tháng month/year vào out_dir; trả về {định dạng: đường dẫn file}.
+
+    Tổng hợp số liệu chạy trong tiến trình hiện tại (dùng cache), vẽ biểu đồ chưa có ảnh
+    và dựng từng tài liệu chạy song song trên workers tiến trình. Có file nguồn tải lỗi thì
+    báo RuntimeError thay vì sinh báo cáo thiếu số liệu.
+    """
+    with metrics.section("report") as run:
+        with service.collect_errors() as errors:
+            pages = collect_pages(service, year, month)
+        if errors:
+            # Không sinh báo cáo với số liệu thiếu tháng; chạy lại khi Drive tải được
+            raise RuntimeError(f"Không tải được {len(errors)} file nguồn: " + "; ".join(errors))
+        paths = [figure_path(draw, data, options) for _, _, draw, data, options in pages]
+        todo = {path: (path, draw, data, options) for path, (_, _, draw, data, options) in zip(paths, pages) if not os.path.exists(path)}
+        os.makedirs(FIGURE_DIR, exist_ok=True)
+        os.makedirs(out_dir, exist_ok=True)
+
+        heading = f"Báo cáo tổn thất điện năng tháng {month}/{year}"
+        outputs = {fmt: os.path.join(out_dir, f"BaoCao_TonThat_{year}_{month:02}.{fmt}") for fmt in formats}
+        doc_pages = [(part, title, path) for (part, title, *_), path in zip(pages, paths)]
+        # spawn: tiến trình con không thừa hưởng luồng tải / khóa của tiến trình cha
+        with ProcessPoolExecutor(max(1, workers), mp_context=multiprocessing.get_context("spawn")) as pool:
+            list(pool.map(_render_task, todo.values(), chunksize=max(1, len(todo) // (4 * max(1, workers)))))
+            for future in [pool.submit(_build_task, fmt, doc_pages, path, heading) for fmt, path in outputs.items()]:
+                future.result()
+    logger.info("Bộ báo cáo %02d/%d: %d trang, vẽ %d biểu đồ mới, %.1fs", month, year, len(pages), len(todo), run.seconds)
+    return outputs
+
+
+def main(argv=None):
+    from loss_api import from_env
+
+    parser = argparse.ArgumentParser(description="Sinh bộ báo cáo tổn thất tháng (DOCX / PPTX / PDF).")
+    parser.add_argument("--year", type=int, required=True)
+    parser.add_argument("--month", type=int, required=True)
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=FORMATS)
+    parser.add_argument("--out", default="reports", help="thư mục ghi file báo cáo")
+    parser.add_argument("--workers", type=int, default=REPORT_WORKERS, help="số tiến trình vẽ / dựng tài liệu")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    for fmt, path in build_pack(from_env(), args.year, args.month, args.out, args.formats, args.workers).items():
+        print(f"{fmt}: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Bộ nhớ kết quả đã tổng hợp theo phiên Streamlit, đặt trong các ô df_* của st.session_state.
+
+Mỗi ô ứng với một phần phân tích và một chế độ (xem SLOTS) và giữ tối đa SESSION_CACHE_SIZE kết
+quả gần nhất, khóa theo (năm, khoảng tháng, chế độ, phiên bản các file nguồn). Chuyển qua lại
+giữa các lựa chọn đã xem (Tháng <-> Lũy kế, năm nay <-> năm trước) lấy lại kết quả ngay, không
+tải hay tính lại; file trên Drive đổi thì phiên bản đổi nên kết quả được tính mới.
+"""
+import os
+from collections import OrderedDict
+
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "4"))
+
+# (phần phân tích, chế độ) -> ô trong session_state; các chế độ so sánh cùng kỳ dùng ô *_ck
+SLOTS = {
+    ("tba", "Theo tháng"): "df_tba_thang",
+    ("tba", "Lũy kế"): "df_tba_luyke",
+    ("tba", "So sánh cùng kỳ"): "df_tba_ck",
+    ("tba", "Lũy kế cùng kỳ"): "df_tba_ck",
+    ("ha", "Tháng"): "df_ha_thang",
+    ("ha", "Lũy kế"): "df_ha_luyke",
+    ("ha", "Cùng kỳ"): "df_ha_ck",
+    ("trung", "Tháng"): "df_trung_thang_tt",
+    ("trung", "Lũy kế"): "df_trung_luyke_tt",
+    ("trung", "Cùng kỳ"): "df_trung_ck_tt",
+    ("dy", "Tháng"): "df_trung_thang_dy",
+    ("dy", "Lũy kế"): "df_trung_luyke_dy",
+    ("dy", "Cùng kỳ"): "df_trung_ck_dy",
+    ("dv", "Tháng"): "df_dv_thang",
+    ("dv", "Lũy kế"): "df_dv_luyke",
+    ("dv", "Cùng kỳ"): "df_dv_ck",
+}
+
+
+def init_slots(state):
+    """Tạo các ô còn thiếu (hoặc còn giá trị None của phiên bản cũ) trong session_state."""
+    for name in dict.fromkeys(SLOTS.values()):
+        if not isinstance(state.get(name), OrderedDict):
+            state[name] = OrderedDict()
+
+
+def files_version(files, names=None, years=None):
+    """Phiên bản các file nguồn: (tên, modifiedTime) của các file có tên trong names / thuộc các năm years."""
+    return tuple(sorted(
+        (name, f.get("modifiedTime"))
+        for name, f in files.items()
+        if (names is None or name in names) and (years is None or any(f"_{y}_" in name for y in years))
+    ))
+
+
+def memoize(state, section, mode, key, compute, size=SESSION_CACHE_SIZE):
+    """Kết quả compute() cho (section, mode, key) của phiên state, tính một lần rồi giữ trong ô tương ứng.
+
+    Mỗi ô giữ tối đa size kết quả, bỏ kết quả ít được dùng lại nhất.
+    """
+    name = SLOTS[(section, mode)]
+    slot = state.get(name)
+    if not isinstance(slot, OrderedDict):
+        slot = state[name] = OrderedDict()
+    key = (mode, *key)
+    if key in slot:
+        slot.move_to_end(key)
+        return slot[key]
+    value = compute()
+    slot[key] = value
+    while len(slot) > size:
+        slot.popitem(last=False)
+    return value
+
+
+def forget(state, section, mode, key):
+    """Bỏ kết quả đã nhớ của (section, mode, key), ví dụ khi có file tải lỗi trong lúc tính."""
+    slot = state.get(SLOTS[(section, mode)])
+    if isinstance(slot, OrderedDict):
+        slot.pop((mode, *key), None)
@@ -0,0 +1,286 @@
+"""Kho dữ liệu tổn thất trên Postgres / Supabase (tùy chọn): nạp hàng loạt từ kho Parquet của backfill, truy vấn tổng hợp bằng SQL.
+
+    python backfill.py --since 2020
+    python warehouse.py load --store .cache/history
+    python warehouse.py query --level tba --year 2026 --to 6 --mode "Lũy kế cùng kỳ"
+
+Bật bằng biến môi trường WAREHOUSE_URL (chuỗi kết nối Postgres, ví dụ chuỗi kết nối trực tiếp
+hoặc qua pooler của Supabase). Khi có kho, dashboard lấy số liệu tổng hợp qua một nhóm kết nối
+dùng chung thay vì đọc workbook; nhiều tiến trình app cùng đọc một nguồn số liệu. Kho chỉ được
+dùng cho một màn hình khi loss_source khớp modifiedTime trên Drive của mọi file màn hình đó cần
+(xem Warehouse.stale_sources), nên cần nạp từ backfill đọc Drive; còn thiếu hoặc cũ thì đọc workbook.
+
+Mỗi lần nạp chỉ đưa lên các file trong checkpoint của backfill có phiên bản khác bảng loss_source:
+số liệu được COPY vào bảng tạm rồi upsert theo lô trong một giao dịch, các dòng không còn trong
+file của tháng đó bị xóa. Cần psycopg (>= 3) và psycopg_pool.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+import pandas as pd
+
+from backfill import STORE_DIR, Checkpoint, file_period
+from loss_calc import FEEDER_COLUMNS, TBA_NAME_COLUMN, compact_frame, tba_cumulative_columns, to_number
+
+WAREHOUSE_URL = os.environ.get("WAREHOUSE_URL", "")
+POOL_SIZE = int(os.environ.get("WAREHOUSE_POOL_SIZE", "4"))
+# Thời gian tối đa (giây) chờ mượn kết nối; kho không phản hồi thì dashboard quay về đọc workbook
+POOL_TIMEOUT = float(os.environ.get("WAREHOUSE_TIMEOUT", "5"))
+# Số file nguồn mỗi giao dịch nạp
+LOAD_BATCH_FILES = int(os.environ.get("WAREHOUSE_BATCH_FILES", "24"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS loss_level (
+    level text NOT NULL, year smallint NOT NULL, month smallint NOT NULL,
+    thuong_pham double precision, ton_that double precision, ty_le double precision,
+    PRIMARY KEY (level, year, month)
+);
+CREATE TABLE IF NOT EXISTS loss_tba (
+    year smallint NOT NULL, month smallint NOT NULL, ten_tba text NOT NULL,
+    thuong_pham double precision, ton_that double precision, ty_le double precision,
+    PRIMARY KEY (year, month, ten_tba)
+);
+CREATE INDEX IF NOT EXISTS loss_tba_ten_tba ON loss_tba (ten_tba, year, month);
+CREATE TABLE IF NOT EXISTS loss_feeder (
+    year smallint NOT NULL, month smallint NOT NULL, duong_day text NOT NULL,
+    thuong_pham double precision, ton_that double precision,
+    PRIMARY KEY (year, month, duong_day)
+);
+CREATE INDEX IF NOT EXISTS loss_feeder_duong_day ON loss_feeder (duong_day, year, month);
+CREATE TABLE IF NOT EXISTS loss_source (
+    key text PRIMARY KEY, version text NOT NULL, loaded_at timestamptz NOT NULL DEFAULT now()
+);
+"""
+
+# Loại dữ liệu của backfill -> (bảng, các cột khóa, các cột số liệu)
+TABLES = {
+    "tba": ("loss_tba", ["year", "month", "ten_tba"], ["thuong_pham", "ton_that", "ty_le"]),
+    "dy": ("loss_feeder", ["year", "month", "duong_day"], ["thuong_pham", "ton_that"]),
+    "level": ("loss_level", ["level", "year", "month"], ["thuong_pham", "ton_that", "ty_le"]),
+}
+
+logger = logging.getLogger(__name__)
+
+
+def tba_rows(df):
+    """Bảng TBA một tháng của kho backfill -> dòng loss_tba (TBA trùng tên giữ dòng đầu, như khi phân ngưỡng)."""
+    columns = tba_cumulative_columns(df)
+    out = pd.DataFrame({
+        "year": df["Năm"].astype(int),
+        "month": df["Tháng"].astype(int),
+        "ten_tba": df[TBA_NAME_COLUMN].astype(str).str.strip(),
+        "thuong_pham": to_number(df[columns[1]]) if columns else float("nan"),
+        "ton_that": to_number(df[columns[0]]) if columns else float("nan"),
+        "ty_le": to_number(df["Tỷ lệ tổn thất"]),
+    })
+    out = out[df[TBA_NAME_COLUMN].notna().to_numpy()]
+    return out.drop_duplicates(["year", "month", "ten_tba"])
+
+
+def feeder_rows(df):
+    """Bảng đường dây một tháng -> dòng loss_feeder (đường dây trùng tên được cộng, như feeder_loss_table)."""
+    out = df.rename(columns={"Năm": "year", "Tháng": "month", "Đường dây": "duong_day", "Thương phẩm": "thuong_pham", "Điện tổn thất": "ton_that"})
+    return out.groupby(["year", "month", "duong_day"], as_index=False)[["thuong_pham", "ton_that"]].sum(min_count=1)
+
+
+def _values(row):
+    return [None if isinstance(v, float) and v != v else v.item() if hasattr(v, "item") else v for v in row]
+
+
+class Warehouse:
+    """Kho tổn thất trên Postgres, truy cập qua nhóm kết nối dùng chung (an toàn đa luồng)."""
+
+    def __init__(self, url, pool_size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        from psycopg_pool import ConnectionPool
+
+        # prepare_threshold=None: pooler chế độ transaction (Supabase) không giữ prepared statement giữa các giao dịch
+        self.pool = ConnectionPool(
+            url, min_size=1, max_size=max(1, pool_size), timeout=timeout,
+            kwargs={"prepare_threshold": None, "connect_timeout": max(1, int(timeout))}, open=True,
+        )
+
+    def close(self):
+        self.pool.close()
+
+    def ensure_schema(self):
+        with self.pool.connection() as conn:
+            conn.execute(SCHEMA)
+
+    def frame(self, sql, params=None):
+        """Kết quả truy vấn dạng DataFrame."""
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(sql, params)
+            return pd.DataFrame(cur.fetchall(), columns=[c.name for c in cur.description])
+
+    # --- Nạp dữ liệu ---
+
+    def load_store(self, store=STORE_DIR, batch_files=LOAD_BATCH_FILES):
+        """Nạp các file đã backfill có phiên bản mới; trả về {loại: số file đã nạp}."""
+        self.ensure_schema()
+        loaded = dict(self.frame("SELECT key, version FROM loss_source").itertuples(index=False))
+        pending = {}
+        for key, entry in Checkpoint(store).entries.items():
+            if entry["status"] == "ok" and loaded.get(key) != entry["version"]:
+                kind = key.split("/", 1)[0]
+                pending.setdefault("level" if kind in ("ha", "trung", "dv") else kind, []).append((key, entry))
+
+        counts = {}
+        for kind, files in pending.items():
+            for start in range(0, len(files), batch_files):
+                batch = files[start:start + batch_files]
+                frames = [pd.read_parquet(os.path.join(store, entry["path"])) for _, entry in batch]
+                if kind == "tba":
+                    frames = [tba_rows(df) for df in frames]
+                elif kind == "dy":
+                    frames = [feeder_rows(df) for df in frames]
+                self._upsert(kind, pd.concat(frames, ignore_index=True), [(key, entry["version"]) for key, entry in batch])
+            counts[kind] = len(files)
+        return counts
+
+    def _upsert(self, kind, df, sources):
+        """COPY df vào bảng tạm rồi thay số liệu các tháng có trong df, trong một giao dịch."""
+        table, keys, values = TABLES[kind]
+        columns = keys + values
+        months = ["year", "month"] + (["level"] if kind == "level" else [])
+        match = " AND ".join(f"t.{c} = s.{c}" for c in keys)
+        same_month = " AND ".join(f"t.{c} = m.{c}" for c in months)
+        with self.pool.connection() as conn, conn.transaction(), conn.cursor() as cur:
+            cur.execute(f"CREATE TEMP TABLE stage (LIKE {table}) ON COMMIT DROP")
+            with cur.copy(f"COPY stage ({', '.join(columns)}) FROM STDIN") as copy:
+                for row in df[columns].itertuples(index=False, name=None):
+                    copy.write_row(_values(row))
+            # Dòng của các tháng vừa nạp mà file mới không còn (TBA / đường dây bị bỏ) thì xóa
+            cur.execute(
+                f"DELETE FROM {table} t USING (SELECT DISTINCT {', '.join(months)} FROM stage) m "
+                f"WHERE {same_month} AND NOT EXISTS (SELECT 1 FROM stage s WHERE {match})"
+            )
+            cur.execute(
+                f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM stage "
+                f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {', '.join(f'{c} = EXCLUDED.{c}' for c in values)}"
+            )
+            cur.executemany(
+                "INSERT INTO loss_source (key, version) VALUES (%s, %s) "
+                "ON CONFLICT (key) DO UPDATE SET version = EXCLUDED.version, loaded_at = now()",
+                sources,
+            )
+
+    # --- Truy vấn tổng hợp ---
+
+    def stale_sources(self, kind, files, keep=lambda year, month: True):
+        """Tên các file loại kind (năm, tháng thỏa keep) mà kho không khớp với files ({tên: bản ghi Drive}).
+
+        Gồm file chưa nạp hoặc đã nạp phiên bản khác modifiedTime hiện tại, và file đã nạp nhưng
+        không còn trên Drive. Danh sách rỗng nghĩa là số liệu của kho đúng với các workbook đó.
+        """
+        loaded = dict(self.frame(
+            "SELECT substr(key, %s) AS name, version FROM loss_source WHERE key LIKE %s",
+            (len(kind) + 2, f"{kind}/%"),
+        ).itertuples(index=False))
+        current = {name: f.get("modifiedTime") or "" for name, f in files.items() if f}
+        names = {name for name in loaded.keys() | current.keys() if (period := file_period(kind, name)) and keep(*period)}
+        return sorted(name for name in names if loaded.get(name) != current.get(name))
+
+    def level_rows(self, level, years):
+        """Các dòng (level, year, month, thuong_pham, ton_that, ty_le) như LossFacts.rows, cho các năm years."""
+        return self.frame(
+            "SELECT level, year::int AS year, month::int AS month, thuong_pham, ton_that, ty_le FROM loss_level "
+            "WHERE level = %s AND year = ANY(%s) ORDER BY year, month",
+            (level, list(years)),
+        )
+
+    def tba_totals(self, year, months, include_cungky=False):
+        """Một dòng mỗi (Tên TBA, Kỳ) cho các tháng months của năm year (và năm trước nếu so sánh cùng kỳ).
+
+        Cùng cột và kiểu dữ liệu với loss_calc.tba_cumulative: tổn thất và thương phẩm được cộng,
+        tỷ lệ tính lại từ hai tổng; thiếu một trong hai thì lấy tỷ lệ của tháng đầu tiên.
+        """
+        years = [year, year - 1] if include_cungky else [year]
+        df = self.frame(
+            """
+            SELECT ten_tba AS "Tên TBA",
+                   CASE WHEN year = %s THEN 'Thực hiện' ELSE 'Cùng kỳ' END AS "Kỳ",
+                   sum(ton_that) AS "Tổn thất", sum(thuong_pham) AS "Thương phẩm", count(*)::int AS "Số tháng",
+                   CASE WHEN sum(thuong_pham) IS NULL OR sum(ton_that) IS NULL THEN (array_agg(ty_le ORDER BY month))[1]
+                        ELSE round((sum(ton_that) / nullif(sum(thuong_pham), 0) * 100)::numeric, 2)::float8 END AS "Tỷ lệ tổn thất"
+            FROM loss_tba WHERE year = ANY(%s) AND month = ANY(%s)
+            GROUP BY ten_tba, year ORDER BY year DESC, ten_tba
+            """,
+            (year, years, list(months)),
+        )
+        # Cùng thứ tự Kỳ với bảng đọc từ workbook: Thực hiện trước, Cùng kỳ sau
+        df["Kỳ"] = pd.Categorical(df["Kỳ"], categories=[k for k in ("Thực hiện", "Cùng kỳ") if k in set(df["Kỳ"])])
+        df["Tên TBA"] = df["Tên TBA"].astype("category")
+        return compact_frame(df)
+
+    def feeder_frame(self, year, include_cungky=True):
+        """Tổng theo (Đường dây, Năm, Tháng) với các cột của loss_calc.feeder_frame, dùng cho feeder_loss_table."""
+        years = [year, year - 1] if include_cungky else [year]
+        df = self.frame(
+            """
+            SELECT duong_day, year::int AS year, month::int AS month, thuong_pham, ton_that,
+                   CASE WHEN year = %s THEN 'Thực hiện' ELSE 'Cùng kỳ' END AS ky
+            FROM loss_feeder WHERE year = ANY(%s) ORDER BY duong_day, year, month
+            """,
+            (year, years),
+        )
+        df.columns = FEEDER_COLUMNS[:1] + ["Năm", "Tháng"] + FEEDER_COLUMNS[1:] + ["Kỳ"]
+        return df
+
+
+_default = None
+
+
+def get_warehouse():
+    """Kho dùng chung trong tiến trình, None nếu không đặt WAREHOUSE_URL."""
+    global _default
+    if _default is None and WAREHOUSE_URL:
+        _default = Warehouse(WAREHOUSE_URL)
+    return _default
+
+
+def main(argv=None):
+    from loss_api import LEVELS, TBA_MODES, tba_months
+    from loss_calc import feeder_loss_table, tba_threshold_summary
+    from loss_facts import loss_series
+
+    parser = argparse.ArgumentParser(description="Kho dữ liệu tổn thất trên Postgres / Supabase.")
+    parser.add_argument("--url", default=WAREHOUSE_URL, help="chuỗi kết nối Postgres (mặc định WAREHOUSE_URL)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ld = sub.add_parser("load", help="nạp các file mới của kho backfill")
+    ld.add_argument("--store", default=STORE_DIR)
+    q = sub.add_parser("query", help="in số liệu tổng hợp dạng JSON")
+    q.add_argument("--level", choices=LEVELS, required=True)
+    q.add_argument("--year", type=int, required=True)
+    q.add_argument("--from", dest="month_from", type=int, default=1)
+    q.add_argument("--to", dest="month_to", type=int, default=12)
+    q.add_argument("--mode", help=f"tba: {TBA_MODES}; các cấp khác: Tháng / Lũy kế")
+    args = parser.parse_args(argv)
+    if not args.url:
+        parser.error("cần --url hoặc biến môi trường WAREHOUSE_URL")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    warehouse = Warehouse(args.url)
+    started = time.perf_counter()
+    if args.command == "load":
+        counts = warehouse.load_store(args.store)
+        logger.info("Đã nạp %s trong %.1fs", counts, time.perf_counter() - started)
+        return
+    if args.level == "tba":
+        mode = args.mode or TBA_MODES[0]
+        df = warehouse.tba_totals(args.year, tba_months(args.month_from, args.month_to, mode), "cùng kỳ" in mode.lower())
+        result = tba_threshold_summary(df)[1].reset_index().to_dict(orient="records")
+    elif args.level == "dy":
+        wide = feeder_loss_table([warehouse.feeder_frame(args.year)], luy_ke=(args.mode == "Lũy kế"))
+        result = json.loads(wide.reset_index().to_json(orient="records", force_ascii=False))
+    else:
+        rows = warehouse.level_rows(args.level, [args.year])
+        result = loss_series(rows, args.month_to, luy_ke=(args.mode == "Lũy kế")).to_dict(orient="records")
+    print(json.dumps(result, ensure_ascii=False, default=str, indent=2))
+    logger.info("Truy vấn %.1f ms", (time.perf_counter() - started) * 1000)
+
+
+if __name__ == "__main__":
+    main()